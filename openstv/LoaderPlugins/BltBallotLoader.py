@@ -15,6 +15,8 @@
 __revision__ = "$Id: BltBallotLoader.py 719 2010-03-01 03:43:54Z jeff.oneill $"
 
 import re
+from cStringIO import StringIO
+from itertools import chain
 from openstv.plugins import LoaderPlugin
 
 class BltBallotLoader(LoaderPlugin):
@@ -31,14 +33,29 @@ class BltBallotLoader(LoaderPlugin):
   ballotAndIDRE = re.compile(r'^\s*\(([^\)]+)\)\s+(\d+(?:\s+[\d\-=]+)*)\s+0\s*(?:#.*)?$')
   endOfBallotsRE = re.compile(r'\s*0\s*(?:#.*)?')
   stringRE = re.compile(r'^\s*"([^"]+)"\s*(?:#.*)?$')
+  batchSize = 10000
+  maxParsedLines = 100000
 
   def __init__(self):
     LoaderPlugin.__init__(self)
+    self.parsedRankings = {}
 
   def loadFromObject(self, ballotList, f):
     "Load ERS ballot data from a file-like object."
     
-    if self.hasCustomBallotIDs(f):
+    (customBallotIDs, line) = self.loadHeader(ballotList, f)
+    self.loadBallots(ballotList, chain([line], f), customBallotIDs)
+    self.loadNamesAndTitle(ballotList, f)
+
+  def loadHeader(self, ballotList, f):
+    """Load the numbers of candidates and seats and the withdrawn candidates.
+
+    Returns whether the ballots have IDs and the first line after the header.
+    """
+
+    # Weighted only ballots don't keep the IDs but they still need parsing
+    customBallotIDs = self.hasCustomBallotIDs(f)
+    if customBallotIDs:
       ballotList.customBallotIDs = True
     
     line = self.getNextNonBlankLine(f)
@@ -51,20 +68,66 @@ class BltBallotLoader(LoaderPlugin):
     if withdrawn != []:
       ballotList.withdrawn = withdrawn
       line = self.getNextNonBlankLine(f)
+    return (customBallotIDs, line)
+
+  def loadBallots(self, ballotList, lines, customBallotIDs):
+    """Load the ballots from an iterable of lines.
 
-    while not self.atEndOfBallots(line):
-      
-      if ballotList.customBallotIDs:
+    Stops after the end of the ballots line or the last line.  Returns
+    whether the end of the ballots line was found.
+    """
+
+    # Real ballot files repeat the same lines over and over, so each
+    # distinct line is parsed only once.  A line found in parsedLines is
+    # known to be a ballot line, so the checks for blank lines and the end
+    # of the ballots are skipped too.  Lines of ballots with IDs are all
+    # different but the rankings are still parsed only once (see
+    # getRankings).
+    parsedLines = {}
+    self.parsedRankings = {}
+
+    # Ballots are appended in batches to avoid the overhead of appending
+    # them one at a time.  Repeated lines in a row become one weighted
+    # ballot.
+    ballots, weights, customIDs = [], [], []
+    foundEnd = False
+    for line in lines:
+
+      parsed = parsedLines.get(line)
+      if parsed is not None:
+        (weight, ballot) = parsed
+      elif self.blankLineRE.match(line) is not None:
+        continue
+      elif self.atEndOfBallots(line):
+        foundEnd = True
+        break
+      elif customBallotIDs:
         (customID, ballot) = self.getBallotWithCustomID(line)
-        ballotList.appendBallot(ballot, customID)
+        customIDs.append(customID)
+        weight = 1
       else:
         (weight, ballot) = self.getBallot(line)
-        for i in xrange(weight):
-          ballotList.appendBallot(ballot)
-      line = self.getNextNonBlankLine(f)
+        if len(parsedLines) < self.maxParsedLines:
+          parsedLines[line] = (weight, ballot)
+
+      if not customBallotIDs and len(ballots) > 0 and ballots[-1] is ballot:
+        weights[-1] += weight
+      else:
+        ballots.append(ballot)
+        weights.append(weight)
+      if len(ballots) == self.batchSize:
+        ballotList.appendBallots(ballots, weights, customIDs or None)
+        ballots, weights, customIDs = [], [], []
+    if len(ballots) > 0:
+      ballotList.appendBallots(ballots, weights, customIDs or None)
+    self.parsedRankings = {}
+    return foundEnd
+
+  def loadNamesAndTitle(self, ballotList, f):
+    "Load the candidates' names and the title that follow the ballots."
 
     names = []
-    for c in range(numCandidates):
+    for c in range(ballotList.numCandidates):
       line = self.getNextNonBlankLine(f)
       name = self.getCandidateName(line)
       names.append(name)
@@ -72,7 +135,106 @@ class BltBallotLoader(LoaderPlugin):
     
     line = self.getNextNonBlankLine(f)
     ballotList.title = self.getTitle(line)
-    
+
+  def getBallotRanges(self, fName, n):
+    """Split the ballots of a file into about n ranges of whole lines.
+
+    Returns a list of (start, stop, end) where the lines of a range are from
+    byte start to byte stop and the end of the ballots line starts at byte
+    end.  The end of the ballots is found by reading the names and the title
+    backwards from the end of the file, so a whole large file need not be
+    read.  Returns None if the file can't be split.
+    """
+
+    f = open(fName, "rb")
+    try:
+      # The ballots start after the numbers of candidates and seats and the
+      # withdrawn candidates
+      line = f.readline()
+      while line != "" and self.blankLineRE.match(line) is not None:
+        line = f.readline()
+      out = self.nCandnSeatsRE.match(line)
+      if out is None:
+        return None
+      numCandidates = int(out.group(1))
+      start = f.tell()
+      line = f.readline()
+      while line != "" and self.blankLineRE.match(line) is not None:
+        line = f.readline()
+      if self.withdrawnRE.match(line) is not None:
+        start = f.tell()
+
+      # Read larger and larger pieces of the end of the file until the end
+      # of the ballots line is found before the names and the title
+      f.seek(0, 2)
+      size = f.tell()
+      end = None
+      tailSize = 4096
+      while end is None:
+        tailStart = max(start, size - tailSize)
+        f.seek(tailStart)
+        lines = f.read(size - tailStart).split("\n")
+        if tailStart > start:
+          lines.pop(0) # Part of a line
+        pos = size + 1
+        numStrings = 0
+        for line in reversed(lines):
+          pos -= len(line) + 1
+          if self.blankLineRE.match(line) is not None:
+            continue
+          if numStrings < numCandidates + 1:
+            if self.stringRE.match(line) is None:
+              return None
+            numStrings += 1
+          elif self.atEndOfBallots(line):
+            end = pos
+            break
+          else:
+            return None
+        if end is None and tailStart == start:
+          return None
+        tailSize *= 4
+
+      # Move each split to the start of the next line
+      splits = [start]
+      for k in range(1, n):
+        f.seek(start + (end - start) * k // n - 1)
+        f.readline()
+        splits.append(min(f.tell(), end))
+      splits.append(end)
+    finally:
+      f.close()
+
+    ranges = [(splits[k], splits[k+1], end) for k in range(n)
+              if splits[k] < splits[k+1]]
+    if len(ranges) == 0:
+      return None
+    return ranges
+
+  def loadRange(self, ballotList, fName, ballotRange):
+    """Load the ballots in one range from getBallotRanges().
+
+    The numbers of candidates and seats, the withdrawn candidates, the
+    candidates' names, and the title are loaded too, so the ranges of a file
+    can be loaded separately and appended in order.
+    """
+
+    (start, stop, end) = ballotRange
+    self.fName = fName
+    f = open(self.fName, "rb")
+    try:
+      customBallotIDs = self.loadHeader(ballotList, f)[0]
+      f.seek(start)
+      lines = StringIO(f.read(stop - start))
+      if self.loadBallots(ballotList, lines, customBallotIDs):
+        self.reportLoadError("Found the end of the ballots before the "
+                             "names of the candidates.")
+      f.seek(end)
+      f.readline() # The end of the ballots line
+      self.loadNamesAndTitle(ballotList, f)
+    finally:
+      f.close()
+
   def hasCustomBallotIDs(self, f):
     self.getNextNonBlankLine(f) # candidates and seats
     self.getNextNonBlankLine(f) # maybe withdrawn candidates
@@ -117,12 +279,25 @@ class BltBallotLoader(LoaderPlugin):
     if out is None:
       self.reportLoadError("Cannot process this line:\n\t%s" % line)
     customID = out.group(1)
-    rankings = out.group(2).split()
-    weight = int(rankings.pop(0))
+    (weight, ballot) = self.getRankings(out.group(2))
     if weight != 1:
       self.reportLoadError("Cannot process this line:\n\t%s" % line)
-    ballot = self.processRankings(rankings)
     return (customID, ballot)
+
+  def getRankings(self, text):
+    "Return the weight and ballot from the text of a ballot with an ID."
+
+    # Identical text always gives the same ballot so only parse it once
+    try:
+      return self.parsedRankings[text]
+    except KeyError:
+      pass
+    rankings = text.split()
+    weight = int(rankings.pop(0))
+    ballot = self.processRankings(rankings)
+    if len(self.parsedRankings) < self.maxParsedLines:
+      self.parsedRankings[text] = (weight, ballot)
+    return (weight, ballot)
   
   def processRankings(self, rankings):
     ballot = []
@@ -193,7 +368,7 @@ class BltBallotLoader(LoaderPlugin):
       withdrawnList = [str(-(c+1)) for c in ballotList.withdrawn]
       f.write(" ".join(withdrawnList) + "\n")
 
-    if packed:
+    if packed or ballotList.weightedOnly:
       for i in xrange(ballotList.numWeightedBallots):
         weight, ballot = ballotList.getWeightedBallot(i)
         line = self.stringifyBallot(weight, ballot)
@@ -0,0 +1,245 @@
+"Plugin module for binary ballot cache files."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from openstv.plugins import LoaderPlugin
+from openstv.ballots import MappedArray
+
+class BltcBallotLoader(LoaderPlugin):
+  """Ballot loader class for binary ballot cache files.
+
+  The file holds the same data as a BLT file, stored in the flat arrays used
+  by CompactBallots, so it can be loaded without parsing any text.  The file
+  is memory mapped and CompactBallots read ballots directly from it.  Other
+  Ballots objects copy the data into memory.
+
+  The file starts with a header followed by the title, the candidate names,
+  the withdrawn candidates, the offsets, rankings, and weights of the unique
+  ballots, the ballot runs and run ends, and the ballot IDs.  Integers are
+  stored in the native byte order and sizes, so the files are meant to be
+  used as a cache on one computer and not for sharing ballots.
+
+  The header records whether the order of the ballots was kept (it is not
+  for packed and weighted only ballots), and the size and modification time
+  of the ballot file the cache was made from, if any.  See isCacheFor().
+  """
+
+  status = 1
+  extensions = ["bltc"]
+  formatName = "BLT cache"
+
+  magic = "BLTC"
+  version = 2
+  headerFormat = "=4sH16s12qd"
+  # magic, version, platform, numCandidates, numSeats, customBallotIDs,
+  # orderPreserved, numWithdrawn, numUnique, numRankings, numRuns, the
+  # lengths of the title, names, and IDs sections, and the size and
+  # modification time of the ballot file
+  alignment = 8
+
+  def __init__(self):
+    LoaderPlugin.__init__(self)
+
+  def getPlatform(self):
+    "Describe the byte order and integer sizes used for the arrays."
+    return "%s i%d l%d" % (sys.byteorder, array("i").itemsize,
+                           array("l").itemsize)
+
+  def align(self, pos):
+    return (pos + self.alignment - 1) // self.alignment * self.alignment
+
+  def readHeader(self, buf):
+    "Unpack and check the header at the start of buf."
+
+    headerSize = struct.calcsize(self.headerFormat)
+    if len(buf) < headerSize:
+      self.reportLoadError("File is too short.")
+    header = struct.unpack_from(self.headerFormat, buf, 0)
+    (magic, version, platform) = header[:3]
+    if magic != self.magic:
+      self.reportLoadError("Not a ballot cache file.")
+    if version != self.version:
+      self.reportLoadError("Unknown version %d." % version)
+    if platform.rstrip("\0") != self.getPlatform():
+      self.reportLoadError("File was written on a different type of computer.")
+    return header[3:]
+
+  def isCacheFor(self, cacheName, fName, weightedOnly=False):
+    """Return whether a cache file holds the ballots of a ballot file.
+
+    The cache must have been saved from ballots loaded from fName, and fName
+    must have the same size and modification time as it did then.  A cache
+    that doesn't keep the order of the ballots can only stand in for the
+    ballot file when only weighted ballots are needed.
+    """
+
+    try:
+      f = open(cacheName, "rb")
+      try:
+        header = self.readHeader(f.read(struct.calcsize(self.headerFormat)))
+      finally:
+        f.close()
+      orderPreserved = header[3]
+      (sourceSize, sourceMtime) = header[-2:]
+      return ((orderPreserved or weightedOnly) and
+              sourceSize == os.path.getsize(fName) and
+              sourceMtime == os.path.getmtime(fName))
+    except (EnvironmentError, RuntimeError):
+      return False
+
+  def getSource(self, ballotList):
+    """Return the size and modification time of the file the ballots are from.
+
+    Only a file with the same name as the cache apart from the extension
+    counts.  Returns -1 for both if there is no such file.
+    """
+
+    source = ballotList.getFileName()
+    if source is None:
+      return (-1, -1.0)
+    source = os.path.abspath(source)
+    cacheName = os.path.abspath(self.fName)
+    if (source == cacheName or
+        os.path.splitext(source)[0] != os.path.splitext(cacheName)[0]):
+      return (-1, -1.0)
+    try:
+      return (os.path.getsize(source), os.path.getmtime(source))
+    except OSError:
+      return (-1, -1.0)
+
+  def load(self, ballotList, fName):
+    """Load a file from a filename"""
+    self.fName = fName
+    f = open(self.fName, "rb")
+    try:
+      self.loadFromObject(ballotList, f)
+    finally:
+      f.close()
+
+  def loadFromObject(self, ballotList, f):
+    "Load binary ballot data from a file-like object."
+
+    # Map the file if possible.  The map stays open after the file is closed
+    # for as long as the ballot data refers to it.
+    try:
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+      buf = f.read()
+
+    (numCandidates, numSeats, customBallotIDs, orderPreserved, numWithdrawn,
+     numUnique, numRankings, numRuns, titleLength, namesLength, idsLength,
+     sourceSize, sourceMtime) = self.readHeader(buf)
+    headerSize = struct.calcsize(self.headerFormat)
+
+    # Find the sections of the file
+    sections = []
+    pos = headerSize
+    for typecode, length in [("c", titleLength), ("c", namesLength),
+                             ("i", numWithdrawn), ("l", numUnique + 1),
+                             ("i", numRankings), ("l", numUnique),
+                             ("i", numRuns), ("l", numRuns),
+                             ("c", idsLength)]:
+      pos = self.align(pos)
+      sections.append(MappedArray(typecode, buf, pos, length))
+      pos += length * sections[-1].itemsize
+    if len(buf) != pos:
+      self.reportLoadError("File has the wrong length.")
+    (title, names, withdrawn, offsets, rankings, counts, runs, runEnds,
+     ballotIDs) = sections
+
+    names = names.tostring().split("\n") if numCandidates > 0 else []
+    if len(names) != numCandidates:
+      self.reportLoadError("File has the wrong number of candidates.")
+    if not customBallotIDs:
+      ballotIDs = None
+    elif numRuns == 0:
+      ballotIDs = []
+    else:
+      ballotIDs = ballotIDs.tostring().split("\0")
+
+    ballotList.customBallotIDs = bool(customBallotIDs)
+    ballotList.numSeats = numSeats
+    ballotList.names = names
+    ballotList.withdrawn = list(withdrawn)
+    ballotList.title = title.tostring()
+    ballotList.setPackedData(offsets, rankings, counts, runs, runEnds,
+                             ballotIDs)
+
+  def encode(self, text):
+    if isinstance(text, unicode):
+      return text.encode("utf-8")
+    return str(text)
+
+  def save(self, ballotList, fName=None, packed=False):
+    "Save ballots in binary format."
+
+    if fName is not None:
+      self.fName = self.normalizeFileName(fName)
+
+    (offsets, rankings, counts, runs, runEnds) = ballotList.getPackedData()
+    customBallotIDs = ballotList.customBallotIDs and not packed
+    orderPreserved = not (packed or ballotList.weightedOnly)
+    (sourceSize, sourceMtime) = self.getSource(ballotList)
+    if not orderPreserved:
+      # Keep only the unique ballots and their weights
+      runs = array("i", xrange(len(counts)))
+      runEnds = array("l")
+      total = 0
+      for count in counts:
+        total += count
+        runEnds.append(total)
+
+    title = self.encode(ballotList.title)
+    names = "\n".join([self.encode(name) for name in ballotList.names])
+    if customBallotIDs:
+      ballotIDs = "\0".join([self.encode(ballotList.getBallotID(i))
+                             for i in xrange(ballotList.numBallots)])
+    else:
+      ballotIDs = ""
+    withdrawn = array("i", ballotList.withdrawn)
+
+    header = struct.pack(self.headerFormat, self.magic, self.version,
+                         self.getPlatform(), ballotList.numCandidates,
+                         ballotList.numSeats, customBallotIDs, orderPreserved,
+                         len(withdrawn), len(counts), len(rankings),
+                         len(runs), len(title), len(names), len(ballotIDs),
+                         sourceSize, sourceMtime)
+
+    # The ballot data may be mapped from the file being replaced, so write a
+    # new file and then rename it.
+    tmpName = self.fName + ".tmp"
+    f = open(tmpName, "wb")
+    f.write(header)
+    pos = len(header)
+    for data in [title, names, withdrawn, offsets, rankings, counts, runs,
+                 runEnds, ballotIDs]:
+      if not isinstance(data, str):
+        data = data.tostring()
+      padding = self.align(pos) - pos
+      f.write("\0" * padding + data)
+      pos += padding + len(data)
+    f.close()
+
+    try:
+      os.rename(tmpName, self.fName)
+    except OSError:
+      # Windows won't rename over an existing file
+      os.remove(self.fName)
+      os.rename(tmpName, self.fName)
@@ -71,8 +71,7 @@ class TextBallotLoader(LoaderPlugin):
         line = line[y.end():]
 
       names = self.getBallot(line)
-      for i in xrange(weight):
-        ballotList.appendBallotUsingNames(names)
+      ballotList.appendBallotUsingNames(names, weight=weight)
         
   def getBallot(self, line):
     line = line.strip()
@@ -98,7 +97,7 @@ Can't save ballots in text format.  The
 candidates' names must be alphanumeric with
 no white space."""
 
-    if packed:
+    if packed or ballotList.weightedOnly:
       for i in xrange(ballotList.numWeightedBallots):
         weight, ballot = ballotList.getWeightedBallot(i)
         b = [ballotList.names[c] for c in ballot]
@@ -16,6 +16,7 @@ __revision__ = "$Id: CambridgeSTV.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 
 import os.path
 import string
+from itertools import chain, izip
 
 from openstv.STV import OrderDependentSTV
 from openstv.plugins import MethodPlugin
@@ -509,40 +510,39 @@ Need at least %d ballots but have only %d.""" % (
     skip = int(round(1.0 * total / surplus)) # decimation factor
     start = skip - 1                         # starting point
 
-    # compute the order in which ballots will be considered for transfer
+    # the order in which ballots will be considered for transfer
     if surplus == 1:
-      order = range(total)
-      order = order[-1:] + order[:-1]
+      order = chain([total-1], xrange(total-1))
     else:
-      order = []
-      for i in range(start, start+skip):
-        for j in range(i, total, skip):
-          order.append(j)
-      for i in range(start):
-        order.append(i)
+      order = chain(*([xrange(i, total, skip)
+                       for i in range(start, start+skip)] + [xrange(start)]))
 
     # transfer the ballots
     nTransferred = 0
     ctng = self.continuing.copy()  # candidates who can receive votes
-    # attempt to transfer votes in the precalculated order
-    cSurplusVotes = self.votes[cSurplus][:] # use this to loop over c0's votes
+    # attempt to transfer votes in the precalculated order.  Transferred
+    # votes are marked and removed together at the end.
+    cSurplusVotes = self.votes[cSurplus]
+    transferred = bytearray(total)
     for i in order:   # i is the ith vote of a candidate
       bi = cSurplusVotes[i]  # bi is the bith ballot
       # Get the next candidate.
       # If no next candidate, then the vote is not transferable and
       # remains with the current candidate.
-      c = self.b.getTopChoiceFromBallot(bi, ctng)
+      c = self.cursor.getTopChoice(bi, ctng)
       if c != None:
         self.votes[c].append(bi)
         # If the receiving candidate is now a winner, then that
         # candidate can no longer receive any more votes.
         if len(self.votes[c]) >= self.thresh[self.R-1]:
           ctng.remove(c)
-        self.votes[cSurplus].remove(bi)
+        transferred[i] = 1
         nTransferred += 1
       # Check if the entire surplus has been transferred
       if nTransferred == surplus:
         break
+    self.votes[cSurplus] = [bi for bi, t in izip(cSurplusVotes, transferred)
+                            if not t]
 
     desc = "Count after transferring surplus votes from %s by using the "\
            "Cincinnati method with a skip value of %d. " \
@@ -567,7 +567,7 @@ Need at least %d ballots but have only %d.""" % (
       eliminationOrder.append(loser)
       remainingLosers.remove(loser)
       for bi in self.votes[loser]:
-        c = self.b.getTopChoiceFromBallot(bi, ctng)
+        c = self.cursor.getTopChoice(bi, ctng)
         if c != None:
           self.votes[c].append(bi)
           # If receiving candidate becomes a winner, then that
@@ -14,6 +14,12 @@
 
 __revision__ = "$Id: Condorcet.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 
+try:
+  import numpy
+except ImportError:
+  # The pairwise matrix is computed without arrays
+  numpy = None
+from openstv.ballots import PairwiseTally
 from openstv.STV import NonIterative
 from openstv.plugins import MethodPlugin
 from openstv.MethodPlugins.Borda import Borda
@@ -48,7 +54,7 @@ There are three choices for the completion method:</p>
   htmlHelp = (MethodPlugin.htmlBegin % (longMethodName, longMethodName)) +\
              htmlBody + MethodPlugin.htmlEnd
 
-  def __init__(self, b):
+  def __init__(self, b, pMat=None):
     NonIterative.__init__(self, b)
     MethodPlugin.__init__(self)
 
@@ -59,6 +65,10 @@ There are three choices for the completion method:</p>
     self.SSDinfo = ""
     self.pMat = []
     self.dMat = []
+    self.useNumpy = numpy is not None  # compute pMat with numpy arrays
+    self.givenPMat = pMat  # a pairwise matrix computed as ballots were loaded
+    if pMat is not None:
+      assert(len(pMat) == self.b.numCandidates)
     
   def preCount(self):
     NonIterative.preCount(self)
@@ -66,102 +76,241 @@ There are three choices for the completion method:</p>
     assert(self.completion in ["Schwartz Sequential Dropping",
                                "IRV on Smith Set",
                                "Borda on Smith Set"])
+    if (self.completion != "Schwartz Sequential Dropping" and
+        isinstance(self.b, PairwiseTally)):
+      raise RuntimeError, "%s needs the ballots and only the pairwise "\
+            "counts were loaded." % self.completion
 
     self.optionsMsg = "Using %s for the completion method." % self.completion
 
   def computePMat(self):
     "Compute the pairwise comparison matrix."
 
-    # Intialize space
-    self.pMat = []
+    # Sums of weights are exact in floating point below 2**53
+    if self.useNumpy and self.b.numBallots < 2**53:
+      self.computePMatNumpy()
+      return
+
+    # A ballot ranks c over d if it ranks c and doesn't rank d before c.
+    # So pMat[c][d] is the weight of the ballots ranking c less the weight
+    # of those ranking d before c, and only pairs of candidates ranked on
+    # the same ballot need to be visited.
+    ranked = [0] * self.b.numCandidates
+    rankedBefore = []
     for c in range(self.b.numCandidates):
-      self.pMat.append([0] * self.b.numCandidates)
+      rankedBefore.append([0] * self.b.numCandidates)
 
-    # Compute pMat
     for i in xrange(self.b.numWeightedBallots):
       weight, ballot = self.b.getWeightedBallot(i)
-      remainingC = range(self.b.numCandidates)
-      for c in ballot:
-        remainingC.remove(c)
-        for d in remainingC:
-          self.pMat[c][d] += weight
+      for j, c in enumerate(ballot):
+        ranked[c] += weight
+        row = rankedBefore[c]
+        for d in ballot[:j]:
+          row[d] += weight
+
+    self.pMat = []
+    for c in range(self.b.numCandidates):
+      self.pMat.append([ranked[c] - x for x in rankedBefore[c]])
+      self.pMat[c][c] = 0
+
+  def computePMatNumpy(self):
+    """Compute the pairwise comparison matrix with numpy.
+
+    This computes the same sums as computePMat().  The rankings of a block
+    of ballots are put in order of their position on the ballots, and for
+    each distance k the pairs of candidates ranked k positions apart are
+    counted with a weighted bincount.  Each entry of the matrix is at most
+    the number of ballots, so the floating point sums are exact.
+    """
+
+    numCandidates = self.b.numCandidates
+    (offsets, rankings, counts) = [self.toNumpy(data) for data in
+                                   self.b.getPackedData()[:3]]
+    # Equal and skipped rankings are packed as negative numbers
+    assert(len(rankings) == 0 or rankings.min() >= 0)
+    ranked = numpy.zeros(numCandidates)
+    rankedBefore = numpy.zeros(numCandidates * numCandidates)
+
+    # Take blocks of about blockSize rankings
+    blockSize = 2**22
+    stop = 0
+    while stop < len(counts):
+      start = stop
+      stop = numpy.searchsorted(offsets, offsets[start] + blockSize, "right")-1
+      stop = min(max(stop, start + 1), len(counts))
+      lengths = offsets[start+1:stop+1] - offsets[start:stop]
+      weights = counts[start:stop].astype(float)
+      ranked += numpy.bincount(rankings[offsets[start]:offsets[stop]],
+                               numpy.repeat(weights, lengths), numCandidates)
+
+      # With the ballots sorted by length, those with a ranking at position
+      # k come first.  byPosition holds the indices of the rankings at
+      # position 0, then those at position 1, and so on.
+      order = numpy.argsort(-lengths, kind="mergesort")
+      maxLength = lengths[order[0]]
+      if maxLength == 0:
+        continue
+      numLonger = numpy.searchsorted(-lengths[order], -numpy.arange(maxLength))
+      firsts = offsets[start:stop][order]
+      byPosition = numpy.concatenate([firsts[:numLonger[k]] + k
+                                      for k in xrange(maxLength)])
+      firstAt = numpy.concatenate(([0], numpy.cumsum(numLonger)))
+      candidates = rankings[byPosition].astype(numpy.int64) * numCandidates
+      weights = numpy.concatenate([weights[order[:n]] for n in numLonger])
+
+      for k in xrange(1, maxLength):
+        later = slice(firstAt[k], None)
+        rankedBefore += numpy.bincount(
+          candidates[later] + rankings[byPosition[later] - k], weights[later],
+          numCandidates * numCandidates)
+
+    pMat = ranked[:, numpy.newaxis] - \
+           rankedBefore.reshape(numCandidates, numCandidates)
+    pMat[numpy.diag_indices(numCandidates)] = 0
+    self.pMat = pMat.astype(numpy.int64).tolist()
+
+  def toNumpy(self, data):
+    "Return an array of ballot data as a numpy array."
+    if hasattr(data, "typecode"):
+      return numpy.frombuffer(data.tostring(), dtype=numpy.dtype(data.typecode))
+    return numpy.array(data, dtype=numpy.int64)
 
   def computeSmithSet(self):
     "Compute the Smith set."
 
-    dMat = []
-    for c in range(self.b.numCandidates):
-      dMat.append([0] * self.b.numCandidates)
-
-    # compute the Smith set
-    # Adapted from code posted by Markus Schulze at
-    # http://groups.yahoo.com/group/election-methods-list/message/6493
-    self.smithSet = range(self.b.numCandidates)
-    for c in range(self.b.numCandidates):
-      for d in range(self.b.numCandidates):
-        if c != d:
-          if self.pMat[c][d] >= self.pMat[d][c]:
-            dMat[c][d] = True
-          else:
-            dMat[c][d] = False
-    for c in range(self.b.numCandidates):
-      for d in range(self.b.numCandidates):
-        if c != d:
-          for k in range(self.b.numCandidates):
-            if c != k and d != k:
-              if dMat[d][c] and dMat[c][k]:
-                dMat[d][k] = True
+    # The Smith set is the smallest set of candidates who beat or tie every
+    # candidate outside the set.  In the graph with an edge from c to d when
+    # c beats or ties d, it is made up of the strongly connected components
+    # that no edge enters.
+    beatsOrTies = []
     for c in range(self.b.numCandidates):
-      for d in range(self.b.numCandidates):
-        if c != d:
-          if ( (not dMat[c][d]) and
-               dMat[d][c] and
-               (c in self.smithSet) ):
-            self.smithSet.remove(c)
-    self.smithSet.sort()
+      beatsOrTies.append([c != d and self.pMat[c][d] >= self.pMat[d][c]
+                          for d in range(self.b.numCandidates)])
+    self.smithSet = self.getUndominatedSet(beatsOrTies)
+
+  def getUndominatedSet(self, edges):
+    """Return the candidates whose strongly connected component has no edges
+    coming into it.
+
+    edges[c][d] is True if there is an edge from c to d.  With an edge when c
+    beats or ties d this is the Smith set, and with an edge when c beats d
+    this is the Schwartz set.
+    """
+
+    component = self.getStronglyConnectedComponents(edges)
+    entered = set()
+    for c in range(len(edges)):
+      for d in range(len(edges)):
+        if edges[c][d] and component[c] != component[d]:
+          entered.add(component[d])
+    return [c for c in range(len(edges)) if component[c] not in entered]
+
+  def getStronglyConnectedComponents(self, edges):
+    """Return the number of the strongly connected component of each
+    candidate.
+
+    This is Tarjan's algorithm with an explicit stack instead of recursion.
+    Each entry of the stack is a candidate and the next candidate to look at
+    for an edge from it.
+    """
+
+    n = len(edges)
+    index = [None] * n
+    lowLink = [0] * n
+    onStack = [False] * n
+    stack = []
+    component = [None] * n
+    numComponents = 0
+    counter = 0
+
+    for root in range(n):
+      if index[root] is not None:
+        continue
+      work = [(root, 0)]
+      while len(work) > 0:
+        (c, d) = work.pop()
+        if d == 0:
+          index[c] = lowLink[c] = counter
+          counter += 1
+          stack.append(c)
+          onStack[c] = True
+        else:
+          # Back from visiting d-1
+          lowLink[c] = min(lowLink[c], lowLink[d-1])
+
+        row = edges[c]
+        while d < n:
+          if row[d]:
+            if index[d] is None:
+              break
+            if onStack[d]:
+              lowLink[c] = min(lowLink[c], index[d])
+          d += 1
+        if d < n:
+          work.append((c, d+1))
+          work.append((d, 0))
+          continue
+
+        # c is the root of a component
+        if lowLink[c] == index[c]:
+          while True:
+            d = stack.pop()
+            onStack[d] = False
+            component[d] = numComponents
+            if d == c:
+              break
+          numComponents += 1
+
+    return component
 
   def SchwartzSequentialDropping(self):
     "Complete with SSD."
 
     # Initialize the defeats matrix: dMat[i][j] gives the magnitude of i's
     # defeat of j. If i doesn't defeat j, then dMat[i][j] == 0.
-    self.dMat = []
-    for c in range(self.b.numCandidates):
-      self.dMat.append([0] * self.b.numCandidates)
-
-    for c in range(self.b.numCandidates):
-      for d in range(self.b.numCandidates):
-        self.dMat[c][d] = self.pMat[c][d]
-    for c in range(self.b.numCandidates):
-      for d in range(c):
-        if self.pMat[c][d] > self.pMat[d][c]: 
-          self.dMat[d][c] = 0
-        if self.pMat[c][d] < self.pMat[d][c]: 
-          self.dMat[c][d] = 0
-        if self.pMat[c][d] == self.pMat[d][c]: 
-          self.dMat[c][d] = self.dMat[d][c] = 0
 
     # Determine "beatpath" magnitudes array: dMat[i][j] will be the
     # maximum beatpath magnitudes array. The i,j entry is the greatest
     # magnitude of any beatpath from i to j. A beatpath's magnitude is
-    # the magnitude of its weakest defeat.
-
-    changing = 1
-    while changing:
-      changing = 0
+    # the magnitude of its weakest defeat.  These are the widest paths,
+    # found in one pass of the Floyd-Warshall algorithm.
+
+    if self.useNumpy:
+      pMat = numpy.array(self.pMat, dtype=numpy.int64)
+      dMat = numpy.where(pMat > pMat.T, pMat, 0)
+      for k in range(self.b.numCandidates):
+        numpy.maximum(dMat, numpy.minimum(dMat[:, k, numpy.newaxis], dMat[k]),
+                      dMat)
+      self.dMat = dMat.tolist()
+    else:
+      self.dMat = []
       for c in range(self.b.numCandidates):
+        self.dMat.append([0] * self.b.numCandidates)
         for d in range(self.b.numCandidates):
-          for k in range(self.b.numCandidates):
-            dmin = min (self.dMat[c][d], self.dMat[d][k])
-            if self.dMat[c][k] < dmin:
-              self.dMat[c][k] = dmin
-              changing = 1
-
-    ctng = range(self.b.numCandidates)[:]
-    for c in ctng[:]:
-      for d in ctng[:]:
-        if self.dMat[d][c] > self.dMat[c][d] and c in ctng:
-          ctng.remove(c)
+          if self.pMat[c][d] > self.pMat[d][c]:
+            self.dMat[c][d] = self.pMat[c][d]
+      for k in range(self.b.numCandidates):
+        rowK = self.dMat[k]
+        for c in range(self.b.numCandidates):
+          dck = self.dMat[c][k]
+          if dck == 0:
+            continue
+          row = self.dMat[c]
+          for d in range(self.b.numCandidates):
+            dmin = min(dck, rowK[d])
+            if row[d] < dmin:
+              row[d] = dmin
+
+    # Drop the candidates with a stronger beatpath against them than theirs
+    ctng = []
+    remaining = set(range(self.b.numCandidates))
+    for c in range(self.b.numCandidates):
+      for d in remaining:
+        if self.dMat[d][c] > self.dMat[c][d]:
+          remaining.remove(c)
+          break
+      else:
+        ctng.append(c)
 
     if len(ctng) > 1:
       ctng.sort()
@@ -180,7 +329,10 @@ Tie broken randomly.""" % self.b.joinList(ctng)
     "Count the votes using Condorcet voting."
 
     # self.pMat[i][j]: number of votes ranking candidate i over candidate j
-    self.computePMat()
+    if self.givenPMat is None:
+      self.computePMat()
+    else:
+      self.pMat = [row[:] for row in self.givenPMat]
 
     # Even though the Smith Set isn't needed for all completion methods
     # it provides interesting info, so compute it always.
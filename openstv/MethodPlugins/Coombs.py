@@ -43,44 +43,104 @@ candidates, then the unranked candidates share the last-place vote.</p>
     self.stopCond = ["N"]
     self.batchElimination = "None"
     self.unranked = []
+    self.groupBallots = []
+    self.unrankedOn = []
+    self.weight = []
+    self.share = []
+    self.sharedBy = []
+    self.lastRanked = []
+    self.lastOn = []
+    self.lastContinuing = set()
 
   def preCount(self):
     NoSurplusSTV.preCount(self)
     
-    # Create data structures for speeding up mostLast()
-    self.unranked = [None] * self.b.numWeightedBallots
+    # Create data structures for speeding up mostLast().  The last-place
+    # votes are kept up to date as candidates drop out so that each round
+    # only looks at the ballots affected by the candidates who dropped out.
+
+    # Ballots leaving the same candidates unranked are put in a group.
+    # unranked[g] is the set of candidates not ranked on the ballots of
+    # group g and groupBallots[g] lists the ballots.  unrankedOn[c] lists
+    # the groups not ranking candidate c.
+    numCandidates = self.b.numCandidates
+    self.unranked = []
+    self.groupBallots = []
+    self.unrankedOn = [[] for c in range(numCandidates)]
+
+    # Ballot i gives share[i] of a last-place vote to each candidate in
+    # sharedBy[i].  These are the unranked candidates, sharing weight[i]
+    # (sharedBy[i] is the set unranked[g] of the ballot's group), or if
+    # every candidate is ranked, the last continuing candidate, getting all
+    # of weight[i].
+    self.weight = [0] * self.b.numWeightedBallots
+    self.share = [0] * self.b.numWeightedBallots
+    self.sharedBy = [None] * self.b.numWeightedBallots
+
+    # lastRanked[i] is the position of the last continuing candidate on a
+    # ballot with no unranked candidates, lastOn[c] is the set of those
+    # ballots giving their vote to c, and lastContinuing is the set of
+    # continuing candidates when these votes were last moved.
+    self.lastRanked = [None] * self.b.numWeightedBallots
+    self.lastOn = [set() for c in range(numCandidates)]
+    self.lastContinuing = set(self.continuing)
+
+    groups = {}
     for i in xrange(self.b.numWeightedBallots):
-      u = []
-      b = self.b.getWeightedBallot(i)[1]
-      for c in self.continuing:
-        if c in b: 
-          continue
-        u.append(c)
-      self.unranked[i] = u
+      weight, b = self.b.getWeightedBallot(i)
+      self.weight[i] = weight
+      u = frozenset(self.continuing.difference(b))
+      g = groups.get(u)
+      if g is None:
+        g = len(self.unranked)
+        groups[u] = g
+        self.unranked.append(set(u))
+        self.groupBallots.append([])
+        for c in u:
+          self.unrankedOn[c].append(g)
+      self.groupBallots[g].append(i)
+      if len(u) == 0:
+        self.setLastRanked(i, b, len(b))
+      else:
+        self.sharedBy[i] = self.unranked[g]
+        self.share[i] = 1.0 * weight / len(u)
+
+  def setLastRanked(self, i, ballot, j):
+    "Give ballot i's vote to the last continuing candidate before position j."
+
+    for j in range(j-1, -1, -1):
+      if ballot[j] in self.continuing:
+        break
+    c = ballot[j]
+    self.lastRanked[i] = j
+    self.lastOn[c].add(i)
+    self.sharedBy[i] = (c,)
+    self.share[i] = self.weight[i]
     
   def mostLast(self):
     "Count the number of last-place votes per candidate."
 
     desc = ""
 
-    # Count last place votes per candidate
+    # Move the last-place votes of candidates who are no longer continuing
+    for c in self.lastContinuing - self.continuing:
+      for i in self.lastOn[c]:
+        blt = self.b.getWeightedBallot(i)[1]
+        self.setLastRanked(i, blt, self.lastRanked[i])
+      self.lastOn[c] = set()
+    self.lastContinuing = set(self.continuing)
+
+    # Count last place votes per candidate.  If a ballot has no unranked
+    # cands, the last place candidate gets the vote, and otherwise the
+    # unranked cands share the last place vote.  The votes are added in
+    # ballot order so the totals are rounded the same way as always.
     total = [0] * self.b.numCandidates
+    share = self.share
+    sharedBy = self.sharedBy
     for i in xrange(self.b.numWeightedBallots):
-      nUnranked = len(self.unranked[i])
-      weight, blt = self.b.getWeightedBallot(i)
-      # If no unranked cands, last place candidate gets the vote
-      if nUnranked == 0:
-        ballot = blt[:]
-        ballot.reverse()
-        for c in ballot:
-          if c in self.continuing:
-            break
-        total[c] += weight
-      # Otherwise unranked cands share the last place vote
-      else:
-        share = 1.0 * weight / nUnranked
-        for c in self.unranked[i]:
-          total[c] += share
+      s = share[i]
+      for c in sharedBy[i]:
+        total[c] += s
 
     # Resolve ties
     ctng = list(self.continuing)
@@ -100,10 +160,20 @@ candidates, then the unranked candidates share the last-place vote.</p>
     c = ctng[-1] 
     desc += "and %s, %f. "  % (self.b.names[c], total[c])
 
-    # Update data structures
-    for i in xrange(self.b.numWeightedBallots):
-      if c0 in self.unranked[i]: 
-        self.unranked[i].remove(c0)
+    # Update data structures.  The ballots not ranking c0 have one unranked
+    # candidate fewer.
+    for g in self.unrankedOn[c0]:
+      u = self.unranked[g]
+      u.remove(c0)
+      nUnranked = len(u)
+      if nUnranked > 0:
+        for i in self.groupBallots[g]:
+          share[i] = 1.0 * self.weight[i] / nUnranked
+      else:
+        for i in self.groupBallots[g]:
+          blt = self.b.getWeightedBallot(i)[1]
+          self.setLastRanked(i, blt, len(blt))
+    self.unrankedOn[c0] = []
 
     return (c0, desc)
 
@@ -650,7 +650,7 @@ adequately represent the electorate until the next election.
     for loser in cList:
       for i in self.votes[loser]:
         v = self.transferValue[i]
-        if v not in self.votesByTransferValue.keys():
+        if v not in self.votesByTransferValue:
           self.votesByTransferValue[v] = []
         self.votesByTransferValue[v].append(i)
 
@@ -111,49 +111,51 @@ number generator for breaking ties.</p>
   #  This is a variation on MeekSTV.treeCount that rounds up
   #  keep factors per NZ clause 10
   #
-  def updateCount(self, tree=None, remainder=None):
+  def updateCount(self):
     "Traverse the tree to count the ballots."
 
-    if tree is None:
-      tree = self.tree
-    if remainder is None:
-      remainder = self.p
-
-    # Iterate over the next candidates on the ballots
-    for c in tree.keys():
-      if c == "n" or c == "bi":
-        continue
-      rrr = remainder
-      #
-      #  allocate votes for this ballot
-      #
-      #  provisional: three methods for comparison
-      #
-      method = "hill"
-      if method == "hill":
-        # this appears to produce results consistent with David Hill's implementation
-        # and (presumably) the NZ STV Calculator
-        keep, rem = divmod(rrr * self.keepFactor[self.R][c], self.p)
-        if rem > 0:
-          keep += 1   # round up per clause 10
-        self.count[self.R][c] += keep * tree[c]["n"]  # times ballot count
-        rrr -= keep
-      elif method == "nz":
-        # this is the method according to NZ Schedule 1A clause 10
-        keep, rem = divmod(rrr * self.keepFactor[self.R][c], self.p)
-        if rem > 0:
-          keep += 1   # round up per clause 10
-        self.count[self.R][c] += keep * tree[c]["n"]  # times ballot count
-        rrr, rem = divmod(rrr * (1 - self.keepFactor[self.R][c]), self.p)
-        if rem > 0:
-          rrr += 1    # round up per clause 10
-      else:
-        # this is the method used by MeekSTV.py
-        self.count[self.R][c] += rrr * self.keepFactor[self.R][c] * tree[c]["n"] / self.p
-        rrr = rrr * (self.p - self.keepFactor[self.R][c]) / self.p
-      # If ballot not used up, keep going
-      if rrr > 0:
-        self.updateCount(tree[c], rrr)
+    count = self.count[self.R]
+    keepFactor = self.keepFactor[self.R]
+
+    # Each item on the stack is a node and the portion of the ballots
+    # that reaches it.
+    stack = [(self.tree, self.p)]
+    while len(stack) > 0:
+      (tree, remainder) = stack.pop()
+
+      # Iterate over the next candidates on the ballots
+      for c, node in tree.children.iteritems():
+        rrr = remainder
+        #
+        #  allocate votes for this ballot
+        #
+        #  provisional: three methods for comparison
+        #
+        method = "hill"
+        if method == "hill":
+          # this appears to produce results consistent with David Hill's implementation
+          # and (presumably) the NZ STV Calculator
+          keep, rem = divmod(rrr * keepFactor[c], self.p)
+          if rem > 0:
+            keep += 1   # round up per clause 10
+          count[c] += keep * node.n  # times ballot count
+          rrr -= keep
+        elif method == "nz":
+          # this is the method according to NZ Schedule 1A clause 10
+          keep, rem = divmod(rrr * keepFactor[c], self.p)
+          if rem > 0:
+            keep += 1   # round up per clause 10
+          count[c] += keep * node.n  # times ballot count
+          rrr, rem = divmod(rrr * (1 - keepFactor[c]), self.p)
+          if rem > 0:
+            rrr += 1    # round up per clause 10
+        else:
+          # this is the method used by MeekSTV.py
+          count[c] += rrr * keepFactor[c] * node.n / self.p
+          rrr = rrr * (self.p - keepFactor[c]) / self.p
+        # If ballot not used up and more candidates, keep going
+        if rrr > 0 and len(node.children) > 0:
+          stack.append((node, rrr))
 
   def inInfiniteLoop(self):
     "Detect hangs by looking for at keep factor changes"
@@ -305,11 +307,13 @@ number generator for breaking ties.</p>
   def countBallots(self):
     "Count the ballots using NZ Meek STV."
 
-    # Count first place votes
-    self.allocateRound()
-    self.initialVoteTally()
-    self.updateRound()
-    self.describeRound()
+    # Count first place votes unless resuming a count
+    if not self.resuming:
+      self.allocateRound()
+      self.initialVoteTally()
+      self.updateRound()
+      self.describeRound()
+      self.saveCheckpoint()
 
     while (not self.electionOver()):
       self.R += 1
@@ -318,5 +322,6 @@ number generator for breaking ties.</p>
       self.transferSurplusVotes()
       self.updateRound()
       self.describeRound()
+      self.saveCheckpoint()
 
     self.updateCandidateStatus()
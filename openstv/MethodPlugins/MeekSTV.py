@@ -14,6 +14,10 @@
 
 __revision__ = "$Id: MeekSTV.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
 from openstv.STV import RecursiveSTV
 from openstv.plugins import MethodPlugin
 
@@ -43,25 +47,57 @@ transferred as if the candidate never entered the election.</p>
     MethodPlugin.__init__(self)
     self.createGuiOptions(["prec", "thresh0", "thresh1", "thresh2"])
     
-  def updateCount(self, tree=None, remainder=None):
+  def updateCount(self):
     "Traverse the tree to count the ballots."
+
+    # The products must fit in 64 bit integers to use numpy.
+    if self.useNumpy and self.p * self.p * self.b.numBallots < 2**63:
+      self.updateCountNumpy()
+      return
     
-    if tree is None: 
-      tree = self.tree
-    if remainder is None: 
-      remainder = self.p
-    
-    # Iterate over the next candidates on the ballots
     count = self.count[self.R]
     keepFactor = self.keepFactor[self.R]
     p = self.p
-    updateCount = self.updateCount
-    for c in tree:
-      if c == "n" or c == "bi": 
-        continue
-      rrr = remainder
-      count[c] += rrr * keepFactor[c] * tree[c]["n"] / p
-      rrr = rrr * (self.p - keepFactor[c]) / p
-      # If ballot not used up, keep going
-      if rrr > 0:
-        updateCount(tree[c], rrr)
+
+    # Each item on the stack is a node and the portion of the ballots
+    # that reaches it.
+    stack = [(self.tree, p)]
+    while len(stack) > 0:
+      (tree, remainder) = stack.pop()
+
+      # Iterate over the next candidates on the ballots
+      for c, node in tree.children.iteritems():
+        rrr = remainder
+        count[c] += rrr * keepFactor[c] * node.n / p
+        rrr = rrr * (p - keepFactor[c]) / p
+        # If ballot not used up and more candidates, keep going
+        if rrr > 0 and len(node.children) > 0:
+          stack.append((node, rrr))
+
+  def updateCountNumpy(self):
+    """Count the ballots a level of the tree at a time with numpy.
+
+    This gives the same counts as updateCount() since the same integer
+    operations are done for each node of the tree.
+    """
+
+    count = numpy.zeros(self.b.numCandidates, dtype=numpy.int64)
+    keepFactor = numpy.array(self.keepFactor[self.R], dtype=numpy.int64)
+    p = self.p
+
+    # remainder[j] is the portion of the ballots that reaches node j of the
+    # previous level.
+    remainder = None
+    for (c, n, parents, starts, candidates) in self.getTreeLevels():
+      if parents is None:
+        rrr = numpy.empty(len(c), dtype=numpy.int64)
+        rrr.fill(p)
+      else:
+        rrr = remainder[parents]
+      kf = keepFactor[c]
+      count[candidates] += numpy.add.reduceat(rrr * kf * n // p, starts)
+      remainder = rrr * (p - kf) // p
+
+    row = self.count[self.R]
+    for c, votes in enumerate(count.tolist()):
+      row[c] += votes
@@ -67,9 +67,10 @@ condition, consistent with mathematical impossibility.</p>
     surplusFraction = (surplus * self.p)/self.count[self.R-1][cSurplus]
     for i in self.votes[cSurplus][:]:
       self.transferValue[i] = self.transferValue[i] * surplusFraction / self.p
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       if c is not None:
         self.votes[c].append(i)
+        self.countChange[c] += self.b.getWeight(i) * self.transferValue[i]
 
     self.votes[cSurplus] = []
     
@@ -446,13 +446,14 @@ of votes shall be made.
 
     self.votesByTransferValue = {}
     for loser in cList:
+      firstBatch = set(self.batches[loser][0])
       for i in self.votes[loser]:
         v = self.transferValue[i]
-        if i in self.batches[loser][0]:
+        if i in firstBatch:
           key = "first"
         else:
           key = v
-        if key not in self.votesByTransferValue.keys():
+        if key not in self.votesByTransferValue:
           self.votesByTransferValue[key] = []
         self.votesByTransferValue[key].append(i)
 
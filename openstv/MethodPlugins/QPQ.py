@@ -16,7 +16,7 @@ __revision__ = "$Id: QPQ.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 
 from openstv.STV import Iterative
 from openstv.plugins import MethodPlugin
-from openstv.qx import QX
+from openstv.qx import QXContext
 
 ##  Procedure (from Woodall paper http://www.votingmatters.org.uk/ISSUE17/I17P1.PDF)
 ##
@@ -65,6 +65,7 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
   def __init__(self, b):
     Iterative.__init__(self, b)
     MethodPlugin.__init__(self)
+    self.qx = QXContext()  # arithmetic for this count
     self.threshName = ["Droop", "Dynamic", "Fractional"]
     self.prec = 10
     self.weakTieBreakMethod = "strong"  # treat all ties as strong
@@ -79,14 +80,15 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     self.tx = []         # tx[r] is contribution of inactive ballots at round r
     self.thresh = []     # thresh[r] is the winning quota at round r
     self.votes = []      # votes[c] stores the indices of all votes for candidate c.
+    self.contrib = []    # contrib[i] is the contribution of weighted ballot i
     self.restart = False
 
   def preCount(self):
     "QPQ pre-count"
     Iterative.preCount(self)
 
-    QX.set_precision(self, self.prec)
-    QX.set_guard(self, self.prec)
+    self.qx.set_precision(self, self.prec)
+    self.qx.set_guard(self, self.prec)
 
     self.R = 0           # current round
     self.numRounds = 0     # total number of rounds
@@ -99,7 +101,7 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
   def displayValue(self, value):
     "Format a value with specified precision."
 
-    return QX.str(value)
+    return self.qx.str(value)
 
   def allocateRound(self):
     "Allocate space for all data structures for one round."
@@ -122,7 +124,6 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     assert(mostfewest in ["most", "fewest"])
     assert(len(cList) > 0)
     cList = list(cList)
-    tiedCand = []
 
     # Find a candidate who is winning/losing.  He may be tied with others.
     if mostfewest == "most":
@@ -131,12 +132,8 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
       cList.sort(key=lambda a, f=function: f[a])
     top = cList[0] # first/last place candidate
 
-    # Find the number of candidates who are tied with him.
-    for c in cList:
-      if QX.eq(function[c], function[top]):
-        tiedCand.append(c)
-
-    return tiedCand
+    # Find the candidates who are tied with him.
+    return self.qx.tied(function, cList, function[top])
 
   def updateWinners(self):
     "Find best winning candidate."
@@ -146,20 +143,20 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     winners = set()
     self.restart = False
     for c in self.continuing:
-      if QX.gt(self.count[self.R][c], best):
+      if self.qx.gt(self.count[self.R][c], best):
         winners = set([c])
         best = self.count[self.R][c]
       elif self.count[self.R][c] == best:
         winners.add(c)
 
-    if (len(winners) != 0 and QX.gt(best, self.thresh[self.R])):
+    if (len(winners) != 0 and self.qx.gt(best, self.thresh[self.R])):
       # determine single winner
       (cWin, desc) = self.breakWeakTie(self.R, winners, "most", "winner")
       desc = self.newWinners([cWin])
       self.roundInfo[self.R]["action"] = ("surplus", [cWin])
       # distribute ballots to next choice
       for i in self.votes[cWin][:]:
-        self.b.contrib[i] = self.b.getWeight(i) * QX.div(QX.One, self.count[self.R][cWin])
+        self.contrib[i] = self.b.getWeight(i) * self.qx.div(self.qx.One, self.count[self.R][cWin])
         c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
         if c is not None:
           self.votes[c].append(i)
@@ -195,12 +192,12 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     "Find initial first place votes."
 
     # Allocate ballots to candidates based on the first choices.
-    self.b.contrib = []
+    self.contrib = []
     for i in xrange(self.b.numWeightedBallots):
       c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
       if c is not None:
         self.votes[c].append(i)
-      self.b.contrib.append(0)
+      self.contrib.append(0)
     self.roundInfo[self.R]["action"] = ("first", [])
 
   def restartVoteTally(self):
@@ -222,7 +219,7 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
 
     # Count contribution of all ballots (will eventually subtract active contributions)
     for i in xrange(self.b.numWeightedBallots):
-      self.tx[self.R] += self.b.contrib[i]
+      self.tx[self.R] += self.contrib[i]
 
     # Count number (vc) and contribution (tc) of active ballots (ranking hopeful candidates);
     # Calculate quotient for each hopeful candidate (qc=count)
@@ -230,14 +227,14 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     # Adjust tx.
     for c in range(self.b.numCandidates):
       for i in self.votes[c]:
-        self.vc[self.R][c] += QX.fix(self.b.getWeight(i))
-        self.tc[self.R][c] += self.b.contrib[i]
-      self.count[self.R][c] = QX.div(self.vc[self.R][c], QX.One + self.tc[self.R][c])
+        self.vc[self.R][c] += self.qx.fix(self.b.getWeight(i))
+        self.tc[self.R][c] += self.contrib[i]
+      self.count[self.R][c] = self.qx.div(self.vc[self.R][c], self.qx.One + self.tc[self.R][c])
       self.va[self.R] += self.vc[self.R][c]
       self.tx[self.R] -= self.tc[self.R][c]
 
     # Calculate quota for current round
-    self.thresh[self.R] = QX.div(self.va[self.R], QX.fix(1 + self.numSeats) - self.tx[self.R])
+    self.thresh[self.R] = self.qx.div(self.va[self.R], self.qx.fix(1 + self.numSeats) - self.tx[self.R])
 
   def countBallots(self):
     "Count the votes with QPQ."
@@ -260,4 +257,4 @@ that, like STV, meets the <i>Droop proportionality criterion</i>.</p>
     "Report QX stats if enabled"
     self.numRounds = self.R
     if False:
-      QX.postCount(self, self.R)
+      self.qx.postCount(self, self.R)
@@ -87,7 +87,7 @@ set to "Batch".
     # transfer whole votes in excess of the threshold
     surplus = int(self.count[self.R-1][cSurplus] - self.thresh[self.R-1])
     for i in self.votes[cSurplus][:surplus]:
-      c = self.b.getTopChoiceFromBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       self.votes[cSurplus].remove(i)
       if c != None:
         self.votes[c].append(i)
@@ -102,7 +102,7 @@ set to "Batch".
     # Transfer whole votes from losers.
     for loser in elimList:
       for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromBallot(i, self.continuing)
+        c = self.cursor.getTopChoice(i, self.continuing)
         if c != None:
           self.votes[c].append(i)
       self.votes[loser] = []
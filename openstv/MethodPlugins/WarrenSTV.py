@@ -40,25 +40,27 @@ in a different way.</p>
 
     self.createGuiOptions(["prec", "thresh0", "thresh1", "thresh2"])
 
-  def updateCount(self, tree=None, remainder=None):
+  def updateCount(self):
     "Traverse the tree to count the ballots."
     
-    if tree is None: 
-      tree = self.tree
-    if remainder is None: 
-      remainder = self.p
-    
-    # Iterate over the next candidates on the ballots
-    for c in tree.keys():
-      if c == "n" or c == "bi": 
-        continue
-      rrr = remainder
-      if self.keepFactor[self.R][c] < rrr:
-        self.count[self.R][c] += self.keepFactor[self.R][c] * tree[c]["n"]
-        rrr -= self.keepFactor[self.R][c]
-      else:
-        self.count[self.R][c] += rrr * tree[c]["n"]
-        rrr = 0
-      # If ballot not used up and more candidates, keep going
-      if rrr > 0:
-        self.updateCount(tree[c], rrr)
+    count = self.count[self.R]
+    keepFactor = self.keepFactor[self.R]
+
+    # Each item on the stack is a node and the portion of the ballots
+    # that reaches it.
+    stack = [(self.tree, self.p)]
+    while len(stack) > 0:
+      (tree, remainder) = stack.pop()
+
+      # Iterate over the next candidates on the ballots
+      for c, node in tree.children.iteritems():
+        rrr = remainder
+        if keepFactor[c] < rrr:
+          count[c] += keepFactor[c] * node.n
+          rrr -= keepFactor[c]
+        else:
+          count[c] += rrr * node.n
+          rrr = 0
+        # If ballot not used up and more candidates, keep going
+        if rrr > 0 and len(node.children) > 0:
+          stack.append((node, rrr))
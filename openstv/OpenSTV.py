@@ -56,6 +56,10 @@ class Election():
     self.dirtyBallots = None
     self.cleanBallots = None
     self.e = None
+    # Saves the state of long counts so they can be resumed.  Only used if
+    # the user turns on checkpoints.
+    self.checkpointFile = "%s-%s.ckpt" % (os.path.splitext(filename)[0],
+                                          methodClass.__name__)
 
   def loadBallots(self):
     self.dirtyBallots = Ballots()
@@ -83,15 +87,33 @@ class Election():
 
     self.cleanBallots = self.dirtyBallots.getCleanBallots(removeOvervotes=cleanType)
     self.e = self.methodClass(self.cleanBallots)
+
+  def loadCheckpoint(self):
+    "Restore the state of an interrupted count."
+    self.e.loadCheckpoint(self.checkpointFile)
+
+  def countVotes(self, resume):
+    if resume:
+      self.e.resumeElection()
+    else:
+      self.e.runElection()
+    # The count is finished so the checkpoint is no longer needed
+    if os.path.exists(self.checkpointFile):
+      try:
+        os.remove(self.checkpointFile)
+      except OSError:
+        pass
             
-  def runElection(self):
+  def runElection(self, resume=False):
 
     if not self.frame.breakTiesRandomly:
       self.e.strongTieBreakMethod = "manual"
     self.e.breakTieRequestQueue = Queue(1)
     self.e.breakTieResponseQueue = Queue(1)
+    if self.frame.saveCheckpoints:
+      self.e.checkpointFile = self.checkpointFile
 
-    countThread = Thread(target=self.e.runElection)
+    countThread = Thread(target=self.countVotes, args=(resume,))
     countThread.start()
     # Display a progress dialog
     dlg = wx.ProgressDialog(\
@@ -163,6 +185,7 @@ class Frame(wx.Frame):
     self.methodClasses = self.methodClasses1 # Methods currently viewable to user
 
     self.breakTiesRandomly = False
+    self.saveCheckpoints = False
     
     fn = os.path.join(getHome(), "Icons", "pie.ico")
     self.icon = wx.Icon(fn, wx.BITMAP_TYPE_ICO)
@@ -252,6 +275,9 @@ to www.OpenSTV.org, or send an email to OpenSTV@googlegroups.com.
                      self.OnShowAll, "Check")
     self.AddMenuItem(OptionsMenu, 'Break Ties Randomly', 'Break Ties Randomly',
                      self.OnBreakTiesRandomly, "Check")
+    self.AddMenuItem(OptionsMenu, 'Save Checkpoints',
+                     'Save the state of counts so they can be resumed',
+                     self.OnSaveCheckpoints, "Check")
     subMenu = wx.Menu()
     self.AddMenuItem(subMenu, '6', '6', self.OnFontSize)
     self.AddMenuItem(subMenu, '7', '7', self.OnFontSize)
@@ -372,11 +398,26 @@ to www.OpenSTV.org, or send an email to OpenSTV@googlegroups.com.
       return
     dlg.Destroy()
 
+    # Offer to finish a count of the same ballots that was interrupted
+    resume = False
+    if os.path.exists(election.checkpointFile):
+      dlg = wx.MessageDialog(self, """\
+A count of these ballots with %s was interrupted.
+Resume the count from where it was saved?""" % methodName,
+                             "Resume Count", wx.YES_NO|wx.ICON_QUESTION)
+      resume = (dlg.ShowModal() == wx.ID_YES)
+      dlg.Destroy()
+
     try:
-      election.runElection()
+      if resume:
+        election.loadCheckpoint()
+      election.runElection(resume)
     except RuntimeError, msg:
       wx.MessageBox(str(msg), "Error", wx.OK|wx.ICON_ERROR)
       return
+    if election.e.checkpointError is not None:
+      wx.MessageBox(election.e.checkpointError, "Warning",
+                    wx.OK|wx.ICON_INFORMATION)
       
     self.electionList.append(election)
 
@@ -535,6 +576,10 @@ to www.OpenSTV.org, or send an email to OpenSTV@googlegroups.com.
     itemId = event.GetId()
     self.breakTiesRandomly = self.GetMenuBar().FindItemById(itemId).IsChecked()
 
+  def OnSaveCheckpoints(self, event):
+    itemId = event.GetId()
+    self.saveCheckpoints = self.GetMenuBar().FindItemById(itemId).IsChecked()
+
   def OnFontSize(self, event):
     itemId = event.GetId()
     fontSize = int(self.menuBar.FindItemById(itemId).GetLabel())
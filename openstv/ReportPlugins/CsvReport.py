@@ -110,19 +110,20 @@ class CsvReport(ReportPlugin):
     if self.e.methodName == "ERS97 STV":
       nRS = self.e.numStages
     else:
-      nRS = self.e.numRounds
+      rounds = self.e.getRounds()
+      nRS = len(rounds)
 
     # title lines
     tl1 = ','
     tl2 = ',"First"'
     tl3 = '"Candidates","Preferences"'
     for RS in range(1, nRS):
-      tl1 += ',"Stage",%d' % (RS+1)
-
       if self.e.methodName == "ERS97 STV":
         R = self.e.stages[RS][-1]
+        tl1 += ',"Stage",%d' % (RS+1)
       else:
-        R = RS
+        R = rounds[RS]
+        tl1 += ',"Stage",%d' % (R+1)
 
       if self.e.methodName == "Bucklin":
         tl2 += ',"",'
@@ -169,8 +170,8 @@ class CsvReport(ReportPlugin):
             R = self.e.stages[RS][-1]
             prevround = self.e.stages[RS-1][-1]
           else:
-            R = RS
-            prevround = RS - 1
+            R = rounds[RS]
+            prevround = rounds[RS-1]
 
           diff = self.e.count[R][cc] - self.e.count[prevround][cc]
           if diff == 0:
@@ -199,8 +200,8 @@ class CsvReport(ReportPlugin):
         R = self.e.stages[RS][-1]
         prevround = self.e.stages[RS-1][-1]
       else:
-        R = RS
-        prevround = RS - 1
+        R = rounds[RS]
+        prevround = rounds[RS-1]
       diff = self.e.exhausted[R] - self.e.exhausted[prevround]
       if diff == 0:
         diffstr = ''
@@ -153,7 +153,7 @@ Counting votes for %s using %s.<br>
       out("<th>%s</th>\n" % "Threshold")
     out("</tr>\n\n")
       
-    for R in range(self.e.numRounds):
+    for R in self.e.getRounds():
       self.printTableRow(self.getValuesForRound(R))
       out("<tr><td colspan='%d' class='comment'>%s</td></tr>\n\n" % (nCol, self.e.msg[R]))
 
@@ -50,7 +50,7 @@ class MinimalReport(ReportPlugin):
 
     self.generateHeader()
     
-    for r in range(self.e.numRounds):
+    for r in self.e.getRounds():
       roundStage = r
       if self.e.methodName == "ERS97 STV":
         roundStage = self.e.roundToStage(r)
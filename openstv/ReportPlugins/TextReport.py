@@ -136,7 +136,7 @@ Counting votes for %s using %s.
       if "surplus" in dir(self.e):
         m = max(self.e.surplus)
         mv = max(m, mv)
-      for i in range(len(self.e.count)):
+      for i in self.e.getRounds():
         m = max(self.e.count[i])
         mv = max(m, mv)
         
@@ -358,7 +358,7 @@ Matrix of beatpath magnitudes:
           out("  |" + ("-" * colWidth + "+" ) *(nSubCol-1) + "-" *colWidth + "\n")
         
       # Rounds
-      for R in range(self.e.numRounds):
+      for R in self.e.getRounds():
         self.generateTextRoundResults(R, width, nSubCol)
       out("\n")
 
@@ -61,7 +61,8 @@ class YamlReport(ReportPlugin):
 
     self.generateHeader()
 
-    for r in range(self.e.numRounds):
+    rounds = self.e.getRounds()
+    for i, r in enumerate(rounds):
       roundStage = r
       if self.e.methodName == "ERS97 STV":
         roundStage = self.e.roundToStage(r)
@@ -74,14 +75,19 @@ class YamlReport(ReportPlugin):
              if self.e.wonAtRound[c] == r]
       won.sort()
       won = str(won)
+      # The candidates eliminated or transferred after this round are given
+      # by the action of the next round kept.
+      action = ("", [])
+      if i+1 < len(rounds):
+        action = self.e.roundInfo[rounds[i+1]]["action"]
       lost = []
-      if (r < self.e.numRounds - 1) and self.e.roundInfo[r+1]["action"][0] == "eliminate":
-        lost = self.e.roundInfo[r+1]["action"][1] 
+      if action[0] == "eliminate":
+        lost = action[1] 
         lost.sort()
         lost = str(lost)
       xfer = []
-      if (r < self.e.numRounds - 1) and self.e.roundInfo[r+1]["action"][0] == "surplus":
-        xfer = self.e.roundInfo[r+1]["action"][1] 
+      if action[0] == "surplus":
+        xfer = action[1] 
         xfer.sort()
         xfer = str(xfer)
   
@@ -26,7 +26,18 @@ Class ElectionMethod
 
 __revision__ = "$Id: STV.py 822 2010-11-21 05:25:43Z jeff.oneill $"
 
+import os
 import random
+import time
+import zlib
+import cPickle
+try:
+  import numpy
+except ImportError:
+  # Counting is done without arrays
+  numpy = None
+from array import array
+from itertools import izip, repeat
 
 ##################################################################
 
@@ -52,6 +63,10 @@ class ElectionMethod(object):
     iterative -- Methods are either iterative or are not.
 
     threshMethod -- Some methods have a threshold for election.
+
+    weightedBallotsOnly -- Methods that only use the unique ballots and their
+    weights don't need the order of the ballots or the ballot IDs, so the
+    ballots can be loaded with weightedOnly set.
   
   Instance Attributes:
   
@@ -91,6 +106,19 @@ class ElectionMethod(object):
 
     optionsMsg -- Stores test describing options used in the method for 
     reporting purposes.
+
+    checkpointFile -- If set, the state of the count is saved to this file at
+    the end of rounds so that a count that is interrupted can be finished
+    later with loadCheckpoint() and resumeElection().  Only STV methods save
+    checkpoints.
+
+    checkpointInterval -- The minimum number of seconds between checkpoints.
+
+    checkpointError -- If a checkpoint can't be written, the count goes on
+    without checkpoints and this describes the error.  Otherwise None.
+
+    resuming -- True if the state of the count was restored from a
+    checkpoint.
   
   """
 
@@ -99,6 +127,8 @@ class ElectionMethod(object):
   onlySingleWinner = False
   iterative = None
   threshMethod = None
+  weightedBallotsOnly = False
+  checkpointVersion = 1
 
   def __init__(self, b):
 
@@ -117,6 +147,12 @@ class ElectionMethod(object):
     self.p = 1
     self.guiOptions = []
     self.optionsMsg = ""
+    self.checkpointFile = None
+    self.checkpointInterval = 60
+    self.checkpointError = None
+    self.lastCheckpoint = None
+    self.ballotsChecksum = None
+    self.resuming = False
     
     self.winners = set()
     self.losers = set()
@@ -136,6 +172,9 @@ class ElectionMethod(object):
 
     # Check for sufficient candidates and ballots
     self.checkMinRequirements()
+
+    # Counts shorter than the checkpoint interval don't save checkpoints
+    self.lastCheckpoint = time.time()
     
   def countBallots(self):
     raise NotImplementedError
@@ -143,6 +182,117 @@ class ElectionMethod(object):
   def postCount(self):
     pass
 
+  def resumeElection(self):
+    "Finish a count whose state was restored with loadCheckpoint()."
+    assert(self.resuming)
+    self.lastCheckpoint = time.time()
+    self.countBallots()
+    self.postCount()
+
+  def getBallotsChecksum(self):
+    "Return a checksum of the ballots to check that a checkpoint matches."
+
+    if self.ballotsChecksum is None:
+      checksum = zlib.crc32(repr((self.b.numCandidates, self.b.names)))
+      for data in self.b.getPackedData():
+        if not hasattr(data, "tostring"):
+          data = array("l", data)
+        checksum = zlib.crc32(data.tostring(), checksum)
+      self.ballotsChecksum = checksum
+    return self.ballotsChecksum
+
+  def getCheckpointState(self):
+    "Return the attributes that are saved in a checkpoint."
+
+    state = dict(vars(self))
+    # These belong to the ballots or to the process running the count.
+    for name in ["b", "breakTieRequestQueue", "breakTieResponseQueue",
+                 "checkpointFile", "checkpointInterval", "checkpointError",
+                 "lastCheckpoint"]:
+      del state[name]
+    return state
+
+  def saveCheckpoint(self):
+    """Save the state of the count to checkpointFile.
+
+    This is called between rounds and does nothing if checkpointInterval
+    seconds have not passed since the last checkpoint or since the start of
+    the count.  The state of the random number generator is saved too, so
+    a resumed count breaks ties randomly the same way as an uninterrupted
+    one.  If the file can't be written, for example because the directory
+    is read-only or the disk is full, the count goes on without checkpoints
+    and checkpointError is set.
+    """
+
+    if self.checkpointFile is None:
+      return
+    if (self.lastCheckpoint is not None and
+        time.time() - self.lastCheckpoint < self.checkpointInterval):
+      return
+
+    checkpoint = {"version": self.checkpointVersion,
+                  "methodName": self.methodName,
+                  "checksum": self.getBallotsChecksum(),
+                  "random": random.getstate(),
+                  "state": self.getCheckpointState()}
+
+    # Don't leave a partial file if the count is interrupted while saving.
+    tmpName = self.checkpointFile + ".tmp"
+    try:
+      f = open(tmpName, "wb")
+      try:
+        cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        f.close()
+      try:
+        os.rename(tmpName, self.checkpointFile)
+      except OSError:
+        # Windows won't rename over an existing file
+        os.remove(self.checkpointFile)
+        os.rename(tmpName, self.checkpointFile)
+    except (IOError, OSError), msg:
+      # A checkpoint is not needed to finish the count
+      self.checkpointError = "Could not save checkpoint %s: %s" % \
+                             (self.checkpointFile, msg)
+      self.checkpointFile = None
+      if os.path.exists(tmpName):
+        try:
+          os.remove(tmpName)
+        except OSError:
+          pass
+      return
+    self.lastCheckpoint = time.time()
+
+  def loadCheckpoint(self, fName):
+    """Restore the state of a count from a checkpoint file.
+
+    The election must be created with the same ballots as the count that
+    saved the checkpoint.  The options of the saved count replace the
+    options already set.
+    """
+
+    f = open(fName, "rb")
+    try:
+      try:
+        checkpoint = cPickle.load(f)
+      except Exception:
+        raise RuntimeError, "%s is not a checkpoint file." % fName
+    finally:
+      f.close()
+
+    if (not isinstance(checkpoint, dict) or
+        checkpoint.get("version") != self.checkpointVersion):
+      raise RuntimeError, "%s is not a checkpoint file." % fName
+    if checkpoint["methodName"] != self.methodName:
+      raise RuntimeError, "The checkpoint is for a count with %s." \
+            % checkpoint["methodName"]
+    if checkpoint["checksum"] != self.getBallotsChecksum():
+      raise RuntimeError, "The checkpoint is for a count of different ballots."
+
+    vars(self).update(checkpoint["state"])
+    random.setstate(checkpoint["random"])
+    self.resuming = True
+
   def displayValue(self, value):
     "Format a value with specified precision."
 
@@ -284,6 +434,7 @@ class NonIterative(ElectionMethod):
   """
 
   iterative = False
+  weightedBallotsOnly = True
 
   def __init__(self, b):
     ElectionMethod.__init__(self, b)
@@ -312,6 +463,84 @@ class NonIterative(ElectionMethod):
 
 ##################################################################
 
+class DeltaHistory(list):
+  """A list with a row of values for each round, such as the candidates'
+  counts, where the rows of older rounds may be stored as differences.
+
+  compact(r) replaces row r with a tuple of two arrays holding the positions
+  and the values of the entries that differ from row r-1.  Rows are decoded
+  when they are read, so the object can be used like the list of rows, but
+  a decoded row is a copy and changing it does not change the history.
+  Every checkpoint-th row is kept whole so that decoding a row never goes
+  back more than checkpoint rows.
+  """
+
+  def __init__(self, checkpoint=50):
+    list.__init__(self)
+    self.checkpoint = checkpoint
+    self.lastCompacted = (None, None)
+
+  def __getitem__(self, r):
+    if isinstance(r, slice):
+      return [self[i] for i in xrange(*r.indices(len(self)))]
+    row = list.__getitem__(self, r)
+    if not isinstance(row, tuple):
+      return row
+    if r < 0:
+      r += len(self)
+
+    # Start from the last whole row and apply the differences since then
+    base = r
+    while isinstance(list.__getitem__(self, base), tuple):
+      base -= 1
+    row = list(list.__getitem__(self, base))
+    for i in xrange(base+1, r+1):
+      (positions, values) = list.__getitem__(self, i)
+      for c, value in izip(positions, values):
+        row[c] = value
+    return row
+
+  def __getslice__(self, i, j):
+    return self[slice(i, j)]
+
+  def __reduce__(self):
+    # Pickle the rows as they are stored and not the decoded rows
+    return (self.__class__, (self.checkpoint,), self.__dict__,
+            list.__iter__(self))
+
+  def __iter__(self):
+    row = None
+    for entry in list.__iter__(self):
+      if isinstance(entry, tuple):
+        row = list(row)
+        for c, value in izip(*entry):
+          row[c] = value
+      else:
+        row = entry
+      yield row
+
+  def compact(self, r):
+    "Store row r as the differences from row r-1."
+
+    row = list.__getitem__(self, r)
+    if r % self.checkpoint == 0 or isinstance(row, tuple):
+      return
+    if self.lastCompacted[0] == r-1:
+      prev = self.lastCompacted[1]
+    else:
+      prev = self[r-1]
+
+    positions = [c for c in xrange(len(row)) if row[c] != prev[c]]
+    try:
+      values = array("l", [row[c] for c in positions])
+    except (OverflowError, TypeError):
+      # Values that don't fit in an array are kept whole.
+      return
+    list.__setitem__(self, r, (array("i", positions), values))
+    self.lastCompacted = (r, row)
+
+##################################################################
+
 class Iterative(ElectionMethod):
   """Class that provides additional funcationilty for iterative methods.
 
@@ -351,9 +580,36 @@ class Iterative(ElectionMethod):
         roundInfo[r]["winners"] = "Text describing winners"
         roundInfo[r]["surplus"] = "Text describing surplus transfer"
         roundInfo[r]["eliminate"] = "Text describing candidate elimination"
-  
+
+    historyPolicy -- How much of the history of the count to keep.  Allowable
+    values are "all" (keep every round), "events" (drop the rounds that are
+    not events, see isEventRound()), and "deltas" (keep every round but
+    store the counts of older rounds as differences from the previous
+    round).  Meek and Warren counts may run for thousands of surplus
+    iterations that only bring the keep factors closer to their final
+    values, and with "events" only the rounds where something else happens
+    are reported.  The entries of eventHistories are set to None for the
+    dropped rounds.  Their counts are still needed for breaking weak ties,
+    so they are kept as differences as with "deltas".
+
+    historyWindow -- The number of the most recent rounds that are always
+    kept whole because the count still uses them.
+
+    historyCheckpoint -- With "deltas", every historyCheckpoint-th round is
+    kept whole.
+
+    roundHistories -- Names of the attributes that have an entry for each
+    round.
+
+    deltaHistories -- Names of the attributes whose rows are stored as
+    DeltaHistory objects with "deltas", and with "events" if they are not
+    in eventHistories.
+
+    eventHistories -- Names of the attributes that are set to None for the
+    rounds dropped with "events".
+
   """
-  
+
   iterative = True
   threshMethod = True # methods may override this
 
@@ -374,12 +630,64 @@ class Iterative(ElectionMethod):
     self.winnersOver = set() # winners who still have a surplus
     self.wonAtRound = [None] * self.b.numCandidates
     self.lostAtRound = [None] * self.b.numCandidates
-    
+
+    self.historyPolicy = "all"
+    self.historyWindow = 3
+    self.historyCheckpoint = 50
+    self.roundHistories = ["msg", "roundInfo", "count", "exhausted"]
+    self.deltaHistories = ["count"]
+    self.eventHistories = ["msg", "roundInfo"]
+
+  def preCount(self):
+    ElectionMethod.preCount(self)
+
+    assert(self.historyPolicy in ["all", "events", "deltas"])
+    for name in self.getDeltaHistories():
+      setattr(self, name, DeltaHistory(self.historyCheckpoint))
+
   def postCount(self):
     ElectionMethod.postCount(self)
     self.numRounds = self.R+1
-  
-  def allocateRound(self):  
+    if self.historyPolicy != "all":
+      for r in range(max(0, self.numRounds - self.historyWindow),
+                     self.numRounds - 1):
+        self.compactRound(r)
+
+  def getRounds(self):
+    "Return the numbers of the rounds that have been kept."
+    return [r for r in range(self.numRounds) if self.roundInfo[r] is not None]
+
+  def getDeltaHistories(self):
+    "Return the names of the histories stored as DeltaHistory objects."
+
+    if self.historyPolicy == "deltas":
+      return self.deltaHistories
+    elif self.historyPolicy == "events":
+      return [name for name in self.deltaHistories
+              if name not in self.eventHistories]
+    return []
+
+  def isEventRound(self, r):
+    """Return True if round r is kept with the "events" history policy.
+
+    Every round is an event unless a method says otherwise.
+    """
+    return True
+
+  def compactRound(self, r):
+    "Reduce the memory used by a round that the count no longer needs."
+
+    if self.roundInfo[r] is None:
+      return
+    if self.historyPolicy == "events" and not self.isEventRound(r):
+      for name in self.eventHistories:
+        getattr(self, name)[r] = None
+    for name in self.getDeltaHistories():
+      getattr(self, name).compact(r)
+
+  def allocateRound(self):
+    if self.historyPolicy != "all" and self.R >= self.historyWindow:
+      self.compactRound(self.R - self.historyWindow)
     self.msg.append("")
     self.roundInfo.append({})
     self.count.append([0] * self.b.numCandidates)
@@ -522,6 +830,11 @@ class STV(Iterative):
   
     firstEliminationRound -- Initially set to true.  Set to false after the
     first elimination round.
+
+    cursor -- A TopChoiceCursor used to find the next choice on a ballot when
+    votes are transferred.  Created with getCursor() by order dependent and
+    order independent methods.  It refers to the ballots, so it is not saved
+    in a checkpoint but made again when the checkpoint is loaded.
   
   """
 
@@ -535,13 +848,32 @@ class STV(Iterative):
     self.firstEliminationRound = True
     self.surplus = []    # surplus[r] is number of surplus votes
     self.thresh = []     # thresh[r] is the winning threshold
+    self.roundHistories += ["surplus", "thresh"]
     # votes[c] stores the indices of all votes for candidate c.
     self.votes = []
+    self.cursor = None
 
   def preCount(self):
     Iterative.preCount(self)
     for _c in range(self.b.numCandidates):
       self.votes.append([])
+
+  def getCursor(self):
+    "Return a new cursor for the ballots or None if the method doesn't use one."
+    return None
+
+  def getCheckpointState(self):
+    "Leave out the cursor since it is a view of the ballots."
+    state = Iterative.getCheckpointState(self)
+    del state["cursor"]
+    return state
+
+  def loadCheckpoint(self, fName):
+    "Restore the state of a count and make a new cursor for the ballots."
+    Iterative.loadCheckpoint(self, fName)
+    # A new cursor finds the same top choices; the saved positions only
+    # made the search faster.
+    self.cursor = self.getCursor()
  
   def allocateRound(self):
     "Allocate space for all data structures for one round."
@@ -832,11 +1164,13 @@ class STV(Iterative):
   def countBallots(self):
     "Count the votes with STV."
 
-    # Count first place votes
-    self.allocateRound()
-    self.initialVoteTally()    
-    self.updateRound()
-    self.describeRound()
+    # Count first place votes unless resuming a count
+    if not self.resuming:
+      self.allocateRound()
+      self.initialVoteTally()    
+      self.updateRound()
+      self.describeRound()
+      self.saveCheckpoint()
     
     # Transfer surplus votes or eliminate candidates until done
     while (not self.electionOver()):
@@ -851,6 +1185,7 @@ class STV(Iterative):
 
       self.updateRound()
       self.describeRound()
+      self.saveCheckpoint()
 
     self.updateCandidateStatus()
 
@@ -871,13 +1206,18 @@ class OrderDependentSTV(STV):
   def preCount(self):
     STV.preCount(self)
     assert(self.threshName[2] == "Whole")
+    self.cursor = self.getCursor()
+
+  def getCursor(self):
+    "Return a cursor for the individual ballots."
+    return self.b.getTopChoiceCursor(weighted=False)
       
   def initialVoteTally(self):
     "Count the first place votes with order dependent rules."
 
     # Allocate votes to candidates bases on the first choices.
     for i in xrange(self.b.numBallots):
-      c = self.b.getTopChoiceFromBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       if c is not None: 
         self.votes[c].append(i)
 
@@ -896,16 +1236,40 @@ class OrderIndependentSTV(STV):
   independent of the order of the ballots.  Order independent methods can use
   weighted ballots to speed up the count.
   
-  No additional attributes.
+  Attributes:
+
+    countChange -- countChange[c] is the change in candidate c's count in
+    the current round.  Methods that transfer votes add up the value of the
+    votes moved here, so that the counts can be found from the counts of
+    the previous round without going over all of the votes.
   
   """
 
+  weightedBallotsOnly = True
+
+  def __init__(self, b):
+    STV.__init__(self, b)
+    self.countChange = []
+
+  def preCount(self):
+    STV.preCount(self)
+    self.cursor = self.getCursor()
+
+  def getCursor(self):
+    "Return a cursor for the weighted ballots."
+    return self.b.getTopChoiceCursor()
+
+  def allocateRound(self):
+    "Start with no changes to the counts."
+    STV.allocateRound(self)
+    self.countChange = [0] * self.b.numCandidates
+
   def initialVoteTally(self):
     "Count the first place votes."
 
     # Allocate votes to candidates based on the first choices.
     for i in range(self.b.numWeightedBallots):
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       if c is not None: 
         self.votes[c].append(i)
     self.roundInfo[self.R]["action"] = ("first", [])
@@ -944,9 +1308,12 @@ class NoSurplusSTV(OrderIndependentSTV):
 
     for loser in elimList:
       for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+        weight = self.b.getWeight(i)
+        self.countChange[loser] -= weight
+        c = self.cursor.getTopChoice(i, self.continuing)
         if c is not None:
           self.votes[c].append(i)
+          self.countChange[c] += weight
       self.votes[loser] = []
 
     desc = "Count after eliminating %s and transferring votes. " \
@@ -960,10 +1327,15 @@ class NoSurplusSTV(OrderIndependentSTV):
   def updateCount(self):
     "Update the vote totals after a transfer of votes for NoSurplus methods."
 
-    # Recount votes for all candidates
-    for c in range(self.b.numCandidates):
-      for i in self.votes[c]:
-        self.count[self.R][c] += self.b.getWeight(i)
+    # Count votes for all candidates in the first round.  Afterwards only
+    # the transferred votes change the counts.
+    if self.R == 0:
+      for c in range(self.b.numCandidates):
+        for i in self.votes[c]:
+          self.count[self.R][c] += self.b.getWeight(i)
+    else:
+      for c in range(self.b.numCandidates):
+        self.count[self.R][c] = self.count[self.R-1][c] + self.countChange[c]
 
 ##################################################################
 
@@ -993,6 +1365,11 @@ class GregorySTV(OrderIndependentSTV):
   
     transferValue -- Each ballot has a transfer value.  Initially, it is set 
     to 1, but may be reduced when a vote is part of a surplus transfer.
+
+    owner -- owner[i] is the candidate whose votes list holds vote i, or None
+    if the vote is exhausted or held by a winner whose surplus has been
+    transferred.  This avoids searching the votes lists of the losers for
+    each vote transferred.
   
   """
   
@@ -1007,11 +1384,13 @@ class GregorySTV(OrderIndependentSTV):
     self.batches = []
     self.transferValue = []
     self.transferValues = []
+    self.owner = []
 
   def preCount(self):
     OrderIndependentSTV.preCount(self)
     
     self.transferValue = [self.p] * self.b.numWeightedBallots
+    self.owner = [None] * self.b.numWeightedBallots
     for _c in range(self.b.numCandidates):
       self.batches.append([])
   
@@ -1023,6 +1402,8 @@ class GregorySTV(OrderIndependentSTV):
     # The first batch is all the votes a candidate has.
     for c in range(self.b.numCandidates):
       self.batches[c].append(self.votes[c][:])
+      for i in self.votes[c]:
+        self.owner[i] = c
 
   def transferSurplusVotesFromCandidate(self, cSurplus):
     "Transfer surplus votes according to the Gregory rules."
@@ -1044,7 +1425,7 @@ class GregorySTV(OrderIndependentSTV):
     transferableValue = 0
     nTransferable = 0
     for i in lastBatch:
-      if self.b.getTopChoiceFromWeightedBallot(i, self.continuing) \
+      if self.cursor.getTopChoice(i, self.continuing) \
          is not None:
         transferableValue += \
                           self.b.getWeight(i) * self.transferValue[i]
@@ -1054,16 +1435,21 @@ class GregorySTV(OrderIndependentSTV):
     for i in lastBatch:
       if transferableValue > surplus:
         self.transferValue[i] = self.p * surplus / nTransferable
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       if c is not None:
         self.votes[c].append(i)
         newBatch[c].append(i)
+        self.owner[i] = c
+        self.countChange[c] += self.b.getWeight(i) * self.transferValue[i]
 
     # for candidates who received votes, add new batch
     for c in self.continuing:
       if len(newBatch[c]) > 0:
         self.batches[c].append(newBatch[c])
 
+    for i in self.votes[cSurplus]:
+      if self.owner[i] == cSurplus:
+        self.owner[i] = None
     self.votes[cSurplus] = []
 
     desc = "Count after transferring surplus votes from %s. " % \
@@ -1075,12 +1461,16 @@ class GregorySTV(OrderIndependentSTV):
 
     # Update counts for losers, continuing, and winnersOver.
     # Because of substage transfers with ERS97, losing candidates
-    # will sometimes have a count greater than 0.
+    # will sometimes have a count greater than 0.  After the first round,
+    # only the transferred votes change the counts.
     for c in self.losers | self.continuing | self.winnersOver:
-      self.count[self.R][c] = 0
-      for i in self.votes[c]:
-        self.count[self.R][c] += \
-            self.b.getWeight(i) * self.transferValue[i]
+      if self.R == 0:
+        self.count[self.R][c] = 0
+        for i in self.votes[c]:
+          self.count[self.R][c] += \
+              self.b.getWeight(i) * self.transferValue[i]
+      else:
+        self.count[self.R][c] = self.count[self.R-1][c] + self.countChange[c]
 
     # Set counts for winnersEven.  This will always be the same as the
     # previous round.
@@ -1108,16 +1498,22 @@ class GregorySTV(OrderIndependentSTV):
     for c in range(self.b.numCandidates):
       newBatch.append([])
 
-    # Transfer votes of this value
+    # Transfer votes of this value and note which losers they came from
+    fromLosers = set()
     for i in self.votesByTransferValue[v]:
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      value = self.b.getWeight(i) * self.transferValue[i]
+      fromLosers.add(self.owner[i])
+      self.countChange[self.owner[i]] -= value
+      c = self.cursor.getTopChoice(i, self.continuing)
+      self.owner[i] = c
       if c is not None:
         self.votes[c].append(i)
         newBatch[c].append(i)
-      # Don't know where this vote came from so try all losers
-      for d in self.losers:
-        if i in self.votes[d]:
-          self.votes[d].remove(i)
+        self.countChange[c] += value
+
+    # Remove the transferred votes from the losers in one pass
+    for d in fromLosers:
+      self.votes[d] = [i for i in self.votes[d] if self.owner[i] == d]
 
     # For candidates who received votes, add new batch
     for c in self.continuing:
@@ -1137,14 +1533,16 @@ class GregorySTV(OrderIndependentSTV):
   def countBallots(self):
     "Count the votes with Gregory rules."
 
-    # Count first place votes
-    self.allocateRound()
-    if self.methodName == "ERS97 STV":
-      self.stages.append([])
-      self.stages[self.S].append(self.R)
-    self.initialVoteTally()    
-    self.updateRound()
-    self.describeRound()
+    # Count first place votes unless resuming a count
+    if not self.resuming:
+      self.allocateRound()
+      if self.methodName == "ERS97 STV":
+        self.stages.append([])
+        self.stages[self.S].append(self.R)
+      self.initialVoteTally()    
+      self.updateRound()
+      self.describeRound()
+      self.saveCheckpoint()
     
     # Transfer surplus votes or eliminate candidates until done
     while (not self.electionOver()):
@@ -1162,6 +1560,7 @@ class GregorySTV(OrderIndependentSTV):
         self.describeRound()
       else:
         self.eliminateCandidates()
+      self.saveCheckpoint()
 
     self.updateCandidateStatus()
 
@@ -1194,9 +1593,10 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
     for i in self.votes[cSurplus][:]:
       self.transferValue[i] = self.transferValue[i] * surplus / \
           self.count[self.R-1][cSurplus]
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      c = self.cursor.getTopChoice(i, self.continuing)
       if c is not None:
         self.votes[c].append(i)
+        self.countChange[c] += self.b.getWeight(i) * self.transferValue[i]
 
     self.votes[cSurplus] = []
     
@@ -1209,12 +1609,16 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
   def updateCount(self):
     "Update the vote totals after a transfer of votes."
 
-    # Update counts for losers, continuing, and winnersOver.
+    # Update counts for losers, continuing, and winnersOver.  After the
+    # first round, only the transferred votes change the counts.
     for c in self.losers | self.continuing | self.winnersOver:
-      self.count[self.R][c] = 0
-      for i in self.votes[c]:
-        self.count[self.R][c] += \
-            self.b.getWeight(i) * self.transferValue[i]
+      if self.R == 0:
+        self.count[self.R][c] = 0
+        for i in self.votes[c]:
+          self.count[self.R][c] += \
+              self.b.getWeight(i) * self.transferValue[i]
+      else:
+        self.count[self.R][c] = self.count[self.R-1][c] + self.countChange[c]
 
     # Set counts for winnersEven.  This will always be the same as the
     # previous round.
@@ -1234,9 +1638,12 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
     # Transfer votes from losers simultaneously.
     for loser in elimList:
       for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+        value = self.b.getWeight(i) * self.transferValue[i]
+        self.countChange[loser] -= value
+        c = self.cursor.getTopChoice(i, self.continuing)
         if c is not None:
           self.votes[c].append(i)
+          self.countChange[c] += value
       self.votes[loser] = []
 
     elimList.sort()
@@ -1246,6 +1653,27 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
 
 ##################################################################
 
+class TreeNode(object):
+  """A node of the ballot tree used by recursive STV methods.
+
+  n is the number of ballots counted at this node, bi is an array of the
+  indices of the weighted ballots that stop at this node, pos is an array
+  of the positions of this node's candidate on those ballots (see
+  Ballots.getWeightedBallotSpan), and children is a dictionary mapping
+  candidates to the nodes below this one.  See
+  RecursiveSTV.addBallotToTree() for how the tree is built.
+  """
+
+  __slots__ = ["n", "bi", "pos", "children"]
+
+  def __init__(self):
+    self.n = 0
+    self.bi = array("i")
+    self.pos = array("l")
+    self.children = {}
+
+##################################################################
+
 class RecursiveSTV(OrderIndependentSTV):
   """Class that provides additional functionality for recursive STV methods.
   
@@ -1255,12 +1683,28 @@ class RecursiveSTV(OrderIndependentSTV):
     set to 1.  When a candidate's vote exceeds the winning threshold, the
     keep factor is reduced to transfer surplus votes to other candidates.
     
-    tree -- A data structure that stores the votes in a tree and allows for
+    tree -- The root TreeNode of a tree that stores the votes and allows for
     faster algorithms.  The first level (below the root) contains the current 
     active first choices.  When a candidate has exceeded the winning threshold,
     then that node of the tree is expanded to another level.  When a candidate
     is eliminated, the tree is rebuilt to remove that canddiate entirely as if
     the candidate had never been in the election.
+
+    treeParents -- treeParents[c] is a list of the nodes of the tree that
+    have a child for candidate c.
+
+    treeWinners -- The winners whose nodes of the tree have been expanded.
+
+    treeStatus -- treeStatus[c] is 0 for losing candidates, 1 for
+    continuing candidates, and 2 for winners.  It is set before the tree
+    is changed.
+
+    useNumpy -- When True, methods that provide a vectorized count use the
+    levels of the tree stored in numpy arrays.  Defaults to True if numpy is
+    available.
+
+    treeLevels -- The levels of the tree as returned by getTreeLevels(), or
+    None if the tree has changed since they were computed.
     
   """
 
@@ -1273,12 +1717,30 @@ class RecursiveSTV(OrderIndependentSTV):
     self.delayedTransfer = "On"
     self.batchElimination = "Losers"
     self.keepFactor = []
-    self.tree = {}
+    self.roundHistories.append("keepFactor")
+    self.deltaHistories.append("keepFactor")
+    self.eventHistories.append("keepFactor")
+    self.tree = TreeNode()
+    self.treeParents = [[] for c in range(b.numCandidates)]
+    self.treeWinners = set()
+    self.treeStatus = []
+    self.useNumpy = numpy is not None
+    self.treeLevels = None
 
   def allocateRound(self):
     "Add keep factor allocation."
     OrderIndependentSTV.allocateRound(self)
     self.keepFactor.append([0] * self.b.numCandidates)
+
+  def isEventRound(self, r):
+    """Return True if something other than a surplus transfer happened.
+
+    A surplus round of a recursive count is one more iteration towards the
+    final keep factors, so only these rounds are dropped with "events".
+    """
+    info = self.roundInfo[r]
+    return (info.get("action", ("",))[0] != "surplus" or
+            info.has_key("winners") or info.has_key("eliminate"))
     
   def describeRound(self):
     
@@ -1311,32 +1773,39 @@ class RecursiveSTV(OrderIndependentSTV):
     for c in range(self.b.numCandidates):
       self.keepFactor[0][c] = self.p
 
+    self.updateTreeStatus()
     for i in xrange(self.b.numWeightedBallots):
       self.addBallotToTree(self.tree, i)
 
-  def addBallotToTree(self, tree, ballotIndex, ballot=""):
+  def updateTreeStatus(self):
+    "Record which candidates are losers, continuing, and winners."
+    self.treeStatus = [0] * self.b.numCandidates
+    for c in self.continuing:
+      self.treeStatus[c] = 1
+    for c in self.winners:
+      self.treeStatus[c] = 2
+
+  def addBallotToTree(self, tree, ballotIndex, start=None):
     """Add one ballot to the tree.
     
-    The root of the tree is a dictionary that has as keys the indicies of all 
-    continuing and winning candidates.  For each candidate, the value is also
-    a dictionary, and the keys of that dictionary include "n" and "bi".
-    tree[c]["n"] is the number of ballots that rank candidate c first.
-    tree[c]["bi"] is a list of ballot indices where the ballots rank c first.
+    The tree is made of TreeNode objects.  The children of the root are the
+    nodes of all continuing and winning candidates that are ranked first on
+    some ballot.  For the node of candidate c, node.n is the number of
+    ballots that rank candidate c first and node.bi is a list of ballot
+    indices where the ballots rank c first.
     
     If candidate c is a winning candidate, then that portion of the tree is
     expanded to indicate the breakdown of the subsequently ranked candidates.
-    In this situation, additional keys are added to the tree[c] dictionary
-    corresponding to subsequently ranked candidates.
-    tree[c]["n"] is the number of ballots that rank candidate c first.
-    tree[c]["bi"] is a list of ballot indices where the ballots rank c first.
-    tree[c][d]["n"] is the number of ballots that rank c first and d second.
-    tree[c][d]["bi"] is a list of the corresponding ballot indices.
+    In this situation, the node of c has children for the subsequently
+    ranked candidates and node.bi is empty.  The child d of the node of c
+    has as n the number of ballots that rank c first and d second and as bi
+    the corresponding ballot indices.
     
     Where the second ranked candidates is also a winner, then the tree is 
     expanded to the next level.  
     
     Losing candidates are ignored and treated as if they do not appear on the 
-    ballots.  For example, tree[c][d]["n"] is the total number of ballots
+    ballots.  For example, the child d of the node of c counts all ballots
     where candidate c is the first non-losing candidate, c is a winner, and
     d is the next non-losing candidate.  This will include the following
     ballots, where x represents a losing candidate:
@@ -1348,83 +1817,140 @@ class RecursiveSTV(OrderIndependentSTV):
     During the count, the tree is dynamically updated as candidates change
     their status.  The parameter "tree" to this method may be the root of the
     tree or may be a sub-tree.
-    """
 
-    if ballot == "":
-      # Add the complete ballot to the tree
-      weight, ballot = self.b.getWeightedBallot(ballotIndex)
-    else:
-      # When ballot is not "", we are adding a truncated ballot to the tree,
-      # because a higher-ranked candidate is a winner.
-      weight = self.b.getWeight(ballotIndex)
-    
-    # Get the top choice among candidates still in the running
-    # Note that we can't use Ballots.getTopChoiceFromWeightedBallot since
-    # we are looking for the top choice over a truncated ballot.
-    for c in ballot:
-      if c in self.continuing | self.winners:
-        break # c is the top choice so stop
-    else:
-      c = None # no candidates left on this ballot
-
-    if c is None:
-      # This will happen if the ballot contains only winning and losing
-      # candidates.  The ballot index will not need to be transferred
-      # again so it can be thrown away.
-      return
+    When start is given, only the rankings from that position on are added
+    to the tree, because a higher-ranked candidate is a winner.  Positions
+    are as in Ballots.getWeightedBallotSpan() and the ballot is never
+    copied.  Candidates are checked against self.treeStatus.
+    """
 
-    # Create space if necessary.
-    if not tree.has_key(c):
-      tree[c] = {}
-      tree[c]["n"] = 0
-      tree[c]["bi"] = []
-
-    tree[c]["n"] += weight
-
-    if c in self.winners:
-      # Because candidate is a winner, a portion of the ballot goes to
-      # the next candidate.  Pass on a truncated ballot so that the same
-      # candidate doesn't get counted twice.
-      i = ballot.index(c)
-      ballot2 = ballot[i+1:]
-      self.addBallotToTree(tree[c], ballotIndex, ballot2)
-    else:
-      # Candidate is in continuing so we stop here.
-      tree[c]["bi"].append(ballotIndex)
+    (rankings, first, end) = self.b.getWeightedBallotSpan(ballotIndex)
+    weight = self.b.getWeight(ballotIndex)
+    status = self.treeStatus
+    if start is None:
+      start = first
+
+    # Walk down the tree one winner at a time.  Note that we can't use
+    # Ballots.getTopChoiceFromWeightedBallot since we are looking for the
+    # top choice over a truncated ballot.
+    node = tree
+    k = start
+    while True:
+
+      # Get the top choice among candidates still in the running
+      while k < end and status[rankings[k]] == 0:
+        k += 1
+      if k == end:
+        # This will happen if the ballot contains only winning and losing
+        # candidates.  The ballot index will not need to be transferred
+        # again so it can be thrown away.
+        return
+      c = rankings[k]
+
+      # Create space if necessary.
+      child = node.children.get(c)
+      if child is None:
+        child = TreeNode()
+        node.children[c] = child
+        self.treeParents[c].append(node)
+      child.n += weight
+
+      if status[c] == 2:
+        # Because candidate is a winner, a portion of the ballot goes to
+        # the next candidate.  Continue with the rest of the ballot so that
+        # the same candidate doesn't get counted twice.
+        node = child
+        k += 1
+      else:
+        # Candidate is in continuing so we stop here.
+        child.bi.append(ballotIndex)
+        child.pos.append(k)
+        return
       
   def updateTree(self, tree, loserSet):    
-    "Update the tree data structure to account for new winners and losers."
+    """Update the tree data structure to account for new winners and losers.
+
+    Only the nodes of new losers and new winners need to be changed and
+    these are found with treeParents, so the rest of the tree is not
+    visited.  The parameter "tree" must be the root of the tree.
+    """
+    status = self.treeStatus
+    self.updateTreeStatus()
+    if self.treeStatus != status:
+      self.treeLevels = None
     self.updateLoserTree(tree, loserSet)
     self.updateWinnerTree(tree, loserSet)
 
+  def getTreeLevels(self):
+    """Return the nodes of the tree in numpy arrays, one level at a time.
+
+    Each level is a tuple (c, n, parents, starts, candidates).  For node j
+    of the level, c[j] is the candidate, n[j] is the number of ballots, and
+    parents[j] is the index of the parent node in the previous level.  The
+    nodes of a level are sorted by candidate and starts[i] is the index of
+    the first node of candidate candidates[i].  The children of the root
+    have no parents and parents is None.
+
+    The tree only changes when there are new winners or losers, so the
+    levels are kept and reused for the iterations in between.
+    """
+
+    if self.treeLevels is not None:
+      return self.treeLevels
+
+    # Only the nodes with children are needed to find the next level.  They
+    # are kept with their index in the current level.
+    self.treeLevels = []
+    nodes = [(0, self.tree)] if self.tree.children else []
+    while len(nodes) > 0:
+      c = []
+      parents = []
+      children = []
+      for j, node in nodes:
+        c.extend(node.children.iterkeys())
+        children.extend(node.children.itervalues())
+        parents.extend(repeat(j, len(node.children)))
+
+      # Sort by candidate so that the counts can be added with reduceat()
+      c = numpy.array(c, dtype=numpy.int64)
+      order = c.argsort(kind="mergesort")
+      c = c[order]
+      n = numpy.array([child.n for child in children], dtype=numpy.int64)
+      n = n[order]
+      if len(self.treeLevels) == 0:
+        parents = None
+      else:
+        parents = numpy.array(parents, dtype=numpy.int64)[order]
+      starts = numpy.flatnonzero(numpy.diff(c)) + 1
+      starts = numpy.concatenate(([0], starts))
+      self.treeLevels.append((c, n, parents, starts, c[starts]))
+      nodes = [(k, children[j]) for k, j in enumerate(order.tolist())
+               if children[j].children]
+
+    return self.treeLevels
+
   def updateLoserTree(self, tree, loserSet):
     "Update the tree data structure to account for new losers."
-    for c in loserSet.intersection(tree):
-      for i in tree[c]["bi"]:
-        ballot = self.b.getWeightedBallot(i)[1] # drop weight
-        j = ballot.index(c)
-        ballot2 = ballot[j+1:]
-        self.addBallotToTree(tree, i, ballot2)
-      del tree[c]
+    for c in loserSet:
+      for parent in self.treeParents[c]:
+        node = parent.children.pop(c)
+        for i, k in izip(node.bi, node.pos):
+          self.addBallotToTree(parent, i, k+1)
+      self.treeParents[c] = []
 
   def updateWinnerTree(self, tree, loserSet):
     "Update the tree data structure to account for new winners."
-    for c in self.winners.intersection(tree):
-      if len(tree[c]["bi"]) > 0:
-        # The current candidate is a new winner (has ballot indices), so
-        # expand this node to the next level.  There is no need to call
-        # updateTree() recursively since addBallotToTree() will appropriately
-        # expand lower nodes.
-        for i in tree[c]["bi"]:
-          ballot = self.b.getWeightedBallot(i)[1]
-          j = ballot.index(c)
-          ballot2 = ballot[j+1:]
-          self.addBallotToTree(tree[c], i, ballot2)
-        tree[c]["bi"] = []
-      else:
-        # The current candidate is an old winner, so recurse to see if
-        # anything needs to be done at lower levels.
-        self.updateTree(tree[c], loserSet)
+    for c in self.winners - self.treeWinners:
+      # The nodes of a new winner have ballot indices, so expand these
+      # nodes to the next level.  Nodes added later for a winner are
+      # expanded by addBallotToTree().
+      for parent in self.treeParents[c][:]:
+        node = parent.children[c]
+        for i, k in izip(node.bi, node.pos):
+          self.addBallotToTree(node, i, k+1)
+        node.bi = array("i")
+        node.pos = array("l")
+      self.treeWinners.add(c)
 
   def inInfiniteLoop(self):
     "detect stable state as infinite loop"
@@ -15,6 +15,15 @@
 __revision__ = "$Id: ballots.py 821 2010-11-19 23:36:17Z jeff.oneill $"
 
 import os
+import struct
+try:
+  import multiprocessing
+except ImportError:
+  # Not available before Python 2.6
+  multiprocessing = None
+from array import array
+from bisect import bisect_right
+from itertools import chain, imap, islice, izip, repeat
 from openstv.plugins import getLoaderPlugins, getLoaderPluginClass
 
 ##################################################################
@@ -28,26 +37,34 @@ class Ballots(object):
   a candidate index number, but can also be -1 (skipped ranking) or a list of
   candidate index numbers (equal rankings).
   
-  Only unique ballots are stored, and the list of ballots is a list of pointers
-  to the appropriate ballot.  For methods where the outcome can depend on the
-  order of the ballots (e.g., Cambridge STV) the individual ballots are used,
-  but for methods where the outcome is independent of the order, only the 
-  unique ballots are used along with a weight (the number of times that ballot
-  appears).
+  Only unique ballots are stored, and the list of ballots is a list of runs
+  of pointers to the appropriate ballot.  For methods where the outcome can
+  depend on the order of the ballots (e.g., Cambridge STV) the individual
+  ballots are used, but for methods where the outcome is independent of the
+  order, only the unique ballots are used along with a weight (the number of
+  times that ballot appears).
   
   A ballots object may only contain valid ballot data.  If the ballot data
   contains an error (e.g., a candidate index number that is out of range), an
   error should be raised immediately.
+
+  If weightedOnly is True, only the unique ballots and their weights are
+  kept.  The order of the ballots and the ballot IDs are thrown away, which
+  saves a lot of memory when the ballots are only used by methods that are
+  independent of the order of the ballots.
   """
 
-  def __init__(self, customBallotIDs=False):
+  def __init__(self, customBallotIDs=False, weightedOnly=False):
 
     self.title = "Title" # An election title.
     self.date = ""       # The date of the election.
     self.numSeats = 1    # The number of seats to be filled.
+    self.weightedOnly = weightedOnly # Whether only unique ballots and their
+    # weights are kept.
     self.customBallotIDs = customBallotIDs # Whether custom ballot IDs are
-    # used.  If fale, the ballot IDs are just 1 to N.
-    self.exceptionQueue = None # Used to erport exceptions back to GUI
+    # used.  If false, the ballot IDs are just 1 to N.  Always false when
+    # weightedOnly is true.
+    self.exceptionQueue = None # Used to report exceptions back to GUI
     self.dirtyBallots = None # For clean ballots this is a pointer to the 
                              # dirty ballots from which they were created
 
@@ -68,7 +85,9 @@ class Ballots(object):
     # Note that ballotIDs are assigned to individual ballots and not to
     # weighted ballots.  Where a ballot file specifies a weighted ballot,
     # then a number of individual ballots will be included and each individual
-    # ballot will be given a ballotID.
+    # ballot will be given a ballotID.  The individual ballots are not stored
+    # one by one, however, so appending a weighted ballot takes the same time
+    # whatever its weight.
 
     # In any ballot list, many of the ballots will be identical so, instead
     # of storing each ballot, only unique ballots will be stored.
@@ -83,32 +102,41 @@ class Ballots(object):
     self.uniqueBallotCount = []
     # This is the weight for each unique ballot.
     
-    self.uniqueBallotIndexToBallotIndices = []
-    # This list has the same length as self.uniqueBallots.  Each item of the
-    # list is a Python set that contains the indices of self.ballotOrder
-    # corresponding to the unique ballot.
-    
     self.uniqueBallotsLookup = {}
-    # The keys to this dictionary are string representations of unique
-    # ballots and the values are the indices into self.uniqueBallots.  This
-    # dictionary indicates whether a given ballot has already been seen, and
-    # if so, where the ballot exists in self.uniqueBallots.
+    # The keys to this dictionary are hashable representations of unique
+    # ballots (see ballotKey) and the values are the indices into
+    # self.uniqueBallots.  This dictionary indicates whether a given ballot
+    # has already been seen, and if so, where the ballot exists in
+    # self.uniqueBallots.
     
-    self.ballotOrder = []
-    # The length of this list is the total number of ballots.  Each entry is 
-    # the index into self.uniqueBallots of the corresponding ballot.
+    self.ballotRuns = []
+    self.ballotRunEnds = []
+    # The order of the ballots is stored as runs of identical ballots.  Run k
+    # is made up of ballotRunEnds[k] - ballotRunEnds[k-1] copies of the
+    # unique ballot self.uniqueBallots[self.ballotRuns[k]].  Thus
+    # self.ballotRunEnds[k] is the number of ballots in runs 0 through k, and
+    # the last entry is the total number of ballots.  A weighted ballot in a
+    # ballot file takes up a single run.
 
     self.ballotIDsList = []
     # A list of the ballot IDs in the order specified in the ballot file.
     # If the file does not have ballot IDs, then this list remains empty and
     # the ballotID is computed from the ballot index (1 .. N).
 
+    self._numBallots = 0
+    # The total number of ballots when weightedOnly is true and there are no
+    # runs to count them.
+
+    self.runIndex = None
+    # While single ballots are being edited the runs and ballot IDs are kept
+    # in a BallotRunIndex instead of the flat lists above (see startEdits).
+
     self.loader = None
     
   def copy(self, copyBallots=True):
 
     # Documentation for copy module says it doesn't work with arrays
-    ballotList = Ballots()
+    ballotList = self.__class__(weightedOnly=self.weightedOnly)
     ballotList.customBallotIDs = self.customBallotIDs
     ballotList.title = self.title
     ballotList.date = self.date
@@ -116,10 +144,7 @@ class Ballots(object):
     ballotList.names = self.names[:]
     ballotList.withdrawn = self.withdrawn[:]
     if copyBallots:
-      for i in xrange(self.numBallots):
-        ballot = self.getBallot(i)
-        ballotID = self.getBallotID(i) if self.customBallotIDs else None
-        ballotList.appendBallot(ballot, ballotID)
+      ballotList.appendBallotList(self)
     # Don't want the copy to save to the same file as the original
     ballotList.loader = None
 
@@ -127,10 +152,17 @@ class Ballots(object):
   
   @property
   def numBallots(self):
-    return len(self.ballotOrder)
+    if self.weightedOnly:
+      return self._numBallots
+    if self.runIndex is not None:
+      return self.runIndex.numBallots
+    if len(self.ballotRunEnds) == 0:
+      return 0
+    return self.ballotRunEnds[-1]
 
   @property
   def numWeightedBallots(self):
+    self.finishEdits()
     return len(self.uniqueBallots)
 
   def getNumCandidates(self):
@@ -145,6 +177,14 @@ class Ballots(object):
 
   numCandidates = property(getNumCandidates, setNumCandidates)
 
+  def getCustomBallotIDs(self):
+    return self._customBallotIDs and not self.weightedOnly
+
+  def setCustomBallotIDs(self, customBallotIDs):
+    self._customBallotIDs = customBallotIDs
+
+  customBallotIDs = property(getCustomBallotIDs, setCustomBallotIDs)
+
   def getNames(self):
     return self._names
   
@@ -167,42 +207,249 @@ class Ballots(object):
   
   def appendBallot(self, ballot, ballotID=None):
     "Append a ballot to this Ballots object."
-
-    # Check to make sure whether ballot IDs are allowed
-    assert((ballotID == None) ^ (self.customBallotIDs)) # XOR
     
     # Not sure if we want to do this.  May make more sense to have the
     # ballot loader do the checking.
     #self.checkBallot(ballot)
     
-    # String representation of ballot for determining whether it is unique
-    ballotString = str(ballot)
-
-    # Record the ballot ID if there is one
-    if ballotID is not None:
-      self.ballotIDsList.append(ballotID)
-
-    ballotIndex = len(self.ballotOrder) # Index of the ballot being added
-    if ballotString in self.uniqueBallotsLookup:
-      # We have seen this ballot before 
-      uniqueBallotIndex = self.uniqueBallotsLookup[ballotString]
-      self.uniqueBallotIndexToBallotIndices[uniqueBallotIndex].add(ballotIndex)
-      self.uniqueBallotCount[uniqueBallotIndex] += 1
+    if ballotID is None:
+      self.appendBallots([ballot])
     else:
+      self.appendBallots([ballot], ids=[ballotID])
+
+  def appendBallots(self, ballots, weights=None, ids=None):
+    """Append many ballots to this Ballots object.
+
+    ballots is an iterable of ballots.  weights is an optional iterable
+    giving the number of times each ballot appears, and ids is an optional
+    iterable giving the ballot ID of each ballot.  A ballot with an ID must
+    have a weight of 1.
+    """
+
+    # Check to make sure whether ballot IDs are allowed.  Ballot IDs are
+    # dropped for weighted only ballots.
+    if self.weightedOnly:
+      ids = None
+    assert((ids is None) ^ (self.customBallotIDs)) # XOR
+    if weights is None:
+      weights = repeat(1)
+    if ids is None:
+      ids = repeat(None)
+
+    if self.runIndex is not None:
+      # Ballots appended while editing go into the edit index
+      for ballot, weight, ballotID in izip(ballots, weights, ids):
+        if weight > 0:
+          uniqueBallotIndex = self.addUniqueBallot(ballot)
+          self.uniqueBallotCount[uniqueBallotIndex] += weight
+          self.runIndex.appendRun(uniqueBallotIndex, weight, ballotID)
+      return
+
+    self.makeBallotIDsWritable()
+    for ballot, weight, ballotID in izip(ballots, weights, ids):
+
+      if weight == 0:
+        continue
+
+      # Record the ballot ID if there is one
+      if ballotID is not None:
+        assert(weight == 1)
+        self.ballotIDsList.append(ballotID)
+
+      uniqueBallotIndex = self.addUniqueBallot(ballot)
+      self.appendRun(uniqueBallotIndex, weight)
+
+  def addUniqueBallot(self, ballot):
+    """Return the index of a ballot in self.uniqueBallots.
+
+    A ballot that has not been seen before is added with a weight of zero.
+    """
+
+    # A tuple of the rankings determines whether the ballot is unique.
+    # Equal rankings are lists, which can't be hashed, so fall back to the
+    # slower general key if necessary.
+    lookup = self.uniqueBallotsLookup
+    ballotKey = tuple(ballot)
+    try:
+      uniqueBallotIndex = lookup.get(ballotKey)
+    except TypeError:
+      ballotKey = self.ballotKey(ballot)
+      uniqueBallotIndex = lookup.get(ballotKey)
+
+    if uniqueBallotIndex is None:
       # We have not seen this ballot before
       self.uniqueBallots.append(ballot)
-      self.uniqueBallotCount.append(1)
+      self.uniqueBallotCount.append(0)
       uniqueBallotIndex = len(self.uniqueBallots) - 1
-      self.uniqueBallotsLookup[ballotString] = uniqueBallotIndex
-      self.uniqueBallotIndexToBallotIndices.append(set([ballotIndex]))
-    self.ballotOrder.append(uniqueBallotIndex)
+      lookup[ballotKey] = uniqueBallotIndex
+    return uniqueBallotIndex
+
+  def appendRun(self, uniqueBallotIndex, weight):
+    "Append weight copies of a unique ballot to the end of the ballots."
+
+    self.uniqueBallotCount[uniqueBallotIndex] += weight
+    if self.weightedOnly:
+      self._numBallots += weight
+      return
+
+    # Extend the last run if it is the same ballot or start a new one
+    numBallots = self.numBallots + weight
+    if len(self.ballotRuns) > 0 and self.ballotRuns[-1] == uniqueBallotIndex:
+      self.ballotRunEnds[-1] = numBallots
+    else:
+      self.ballotRuns.append(uniqueBallotIndex)
+      self.ballotRunEnds.append(numBallots)
 
-  def appendBallotUsingNames(self, ballot, ballotID=None):
+  @staticmethod
+  def ballotKey(ballot):
+    "Return a hashable key that is the same for identical ballots."
+    return tuple([tuple(r) if isinstance(r, list) else r for r in ballot])
+
+  def appendBallotUsingNames(self, ballot, ballotID=None, weight=1):
     "Append a ballot to this Ballots object."
     ballot2 = []
     for name in ballot:
       ballot2.append(self._n2i[name])
-    self.appendBallot(ballot2, ballotID)
+    if weight == 1:
+      self.appendBallot(ballot2, ballotID)
+    else:
+      assert(ballotID is None)
+      self.appendBallots([ballot2], [weight])
+
+  def appendBallotList(self, ballotList):
+    "Append all the ballots of another Ballots object."
+
+    ballotList.finishEdits()
+    if self.customBallotIDs:
+      # Each ballot ID goes with a single ballot
+      for i in xrange(ballotList.numBallots):
+        ballot, ballotID = ballotList.getBallotAndID(i)
+        self.appendBallot(ballot, ballotID)
+    else:
+      runs = list(ballotList.iterBallotRuns())
+      self.appendBallots([ballotList.uniqueBallots[j][:] for j, n in runs],
+                         [n for j, n in runs])
+
+  def iterBallotRuns(self):
+    """Iterate over the runs of identical ballots in order.
+
+    Yields the index of the unique ballot and the number of ballots in the
+    run.  For weighted only ballots there is one run for each unique ballot.
+    """
+
+    if self.weightedOnly:
+      for j in xrange(self.numWeightedBallots):
+        yield j, self.uniqueBallotCount[j]
+      return
+
+    self.finishEdits()
+    start = 0
+    for j, end in izip(self.ballotRuns, self.ballotRunEnds):
+      yield j, end - start
+      start = end
+
+  @property
+  def uniqueBallotIndexToBallotIndices(self):
+    """Indices of the individual ballots for each unique ballot.
+
+    This list has the same length as self.uniqueBallots.  Each item of the
+    list is a list of xrange objects that together contain the indices of
+    the ballots that are copies of the unique ballot.
+    """
+
+    ballotIndices = [[] for j in xrange(self.numWeightedBallots)]
+    start = 0
+    for j, n in self.iterBallotRuns():
+      ballotIndices[j].append(xrange(start, start + n))
+      start += n
+    return ballotIndices
+
+  def getRunIndex(self, i):
+    "Return the index of the run that contains the ith ballot."
+
+    if self.weightedOnly:
+      raise RuntimeError, "The order of weighted only ballots is not kept."
+    if i < 0 or i >= self.numBallots:
+      raise IndexError, "ballot index out of range"
+    return bisect_right(self.ballotRunEnds, i)
+
+  def getUniqueBallotIndex(self, i):
+    "Return the index into self.uniqueBallots of the ith ballot."
+
+    if i < 0:
+      i += self.numBallots
+    if self.runIndex is not None:
+      return self.runIndex.getUniqueBallotIndex(i)
+    return self.ballotRuns[self.getRunIndex(i)]
+
+  def startEdits(self):
+    """Move the runs of ballots into a BallotRunIndex for editing.
+
+    Replacing, deleting, and appending single ballots then take O(log n)
+    time.  Anything that needs the flat lists of runs moves the runs back
+    with finishEdits() first.
+    """
+
+    if self.runIndex is not None:
+      return
+    if self.weightedOnly:
+      raise RuntimeError, "The order of weighted only ballots is not kept."
+    if self.customBallotIDs:
+      self.makeBallotIDsWritable()
+      ballotIDs = self.ballotIDsList
+    else:
+      ballotIDs = None
+    self.runIndex = BallotRunIndex(self.ballotRuns, self.ballotRunEnds,
+                                   ballotIDs)
+    del self.ballotRuns[:]
+    del self.ballotRunEnds[:]
+    # Clean ballots may be looking up their IDs in this list
+    self.ballotIDsList = []
+
+  def finishEdits(self):
+    """Move edited runs of ballots back to the flat lists of runs.
+
+    Unique ballots left without any weight by the edits are removed here.
+    """
+
+    if self.runIndex is None:
+      return
+    (runs, runEnds, ballotIDs) = self.runIndex.getRuns()
+    self.runIndex = None
+    self.ballotRuns.extend(runs)
+    self.ballotRunEnds.extend(runEnds)
+    if ballotIDs is not None:
+      self.ballotIDsList.extend(ballotIDs)
+    self.removeUnusedBallots()
+
+  def removeUnusedBallots(self):
+    """Remove unique ballots that no longer have any weight.
+
+    Edits leave these in place so that the indices of the other unique
+    ballots don't change.  The remaining unique ballots are renumbered.
+    """
+
+    counts = self.uniqueBallotCount
+    keep = [j for j in xrange(len(counts)) if counts[j] > 0]
+    if len(keep) == len(counts):
+      return
+    newIndex = [None] * len(counts)
+    for k, j in enumerate(keep):
+      newIndex[j] = k
+    runs = self.ballotRuns
+    for k in xrange(len(runs)):
+      runs[k] = newIndex[runs[k]]
+    self.keepUniqueBallots(keep)
+    lookup = {}
+    for ballotKey, j in self.uniqueBallotsLookup.iteritems():
+      if newIndex[j] is not None:
+        lookup[ballotKey] = newIndex[j]
+    self.uniqueBallotsLookup = lookup
+
+  def keepUniqueBallots(self, keep):
+    "Keep only the unique ballots with the indices in keep."
+    self.uniqueBallots = [self.uniqueBallots[j] for j in keep]
+    self.uniqueBallotCount = [self.uniqueBallotCount[j] for j in keep]
 
   def getWeight(self, i):
     "Return the weight of the ith weighted ballot."
@@ -212,6 +459,16 @@ class Ballots(object):
     "Return the ith weighted ballot."
 
     return (self.uniqueBallotCount[i], self.uniqueBallots[i][:])
+
+  def getWeightedBallotSpan(self, i):
+    """Return the rankings of the ith weighted ballot without copying them.
+
+    Returns a sequence and the start and end of the ballot in it.  The
+    sequence must not be changed.
+    """
+
+    ballot = self.uniqueBallots[i]
+    return ballot, 0, len(ballot)
     
   def getSortedWeightedBallots(self):
     "This is used to compare two ballot lists for testing purposes."
@@ -226,11 +483,13 @@ class Ballots(object):
     return sortedBallots
 
   def getBallot(self, i):
-    j = self.ballotOrder[i]
+    j = self.getUniqueBallotIndex(i)
     return self.uniqueBallots[j][:]
 
   def getBallotID(self, i):
     if self.customBallotIDs:
+      if self.runIndex is not None:
+        return self.runIndex.getBallotID(i)
       return self.ballotIDsList[i]
     else:
       return i + 1
@@ -239,48 +498,54 @@ class Ballots(object):
     return (self.getBallot(i), self.getBallotID(i))
 
   def getBallotsAndIDs(self):
+    self.finishEdits()
     if self.customBallotIDs:
       ballotIDs = self.ballotIDsList[:]
     else:
       ballotIDs = range(1, self.numBallots + 1)
       
-    return zip([self.uniqueBallots[i][:] for i in self.ballotOrder], ballotIDs)
+    ballots = []
+    for j, n in self.iterBallotRuns():
+      ballot = self.uniqueBallots[j]
+      ballots.extend([ballot[:] for k in xrange(n)])
+    return zip(ballots, ballotIDs)
 
   def setBallot(self, i, ballot):
-
-    # This is an expensive operation but it is only done when the user
-    # is editing ballots so it does not need to be done that quickly
-    oldBallots = self.getBallotsAndIDs()
-    oldBallots[i] = (ballot[:], oldBallots[i][1])
-    self.deleteBallots()
-    for ballot, ballotID in oldBallots:
-      if not self.customBallotIDs:
-        ballotID = None
-      self.appendBallot(ballot, ballotID)
+    "Replace the ith ballot."
+
+    # Only the run holding the ballot and the weights change.  The old
+    # unique ballot is kept even if it has no weight left.
+    self.startEdits()
+    if i < 0:
+      i += self.numBallots
+    j2 = self.addUniqueBallot(ballot[:])
+    j = self.runIndex.setUniqueBallotIndex(i, j2)
+    self.uniqueBallotCount[j] -= 1
+    self.uniqueBallotCount[j2] += 1
 
   def deleteBallot(self, i):
+    "Delete the ith ballot."
 
-    # This is an expensive operation but it is only done when the user
-    # is editing ballots so it does not need to be done that quickly
-    oldBallots = self.getBallotsAndIDs()
-    oldBallots.pop(i)
-    self.deleteBallots()
-    for ballot, ballotID in oldBallots:
-      if not self.customBallotIDs:
-        ballotID = None
-      self.appendBallot(ballot, ballotID)
+    self.startEdits()
+    if i < 0:
+      i += self.numBallots
+    j = self.runIndex.deleteBallot(i)
+    self.uniqueBallotCount[j] -= 1
     
   def deleteBallots(self):
     self.uniqueBallots = []
-    self.uniqueBallotIndexToBallotIndices = []
+    self.uniqueBallotCount = []
     self.uniqueBallotsLookup = {}
     self.ballotIDsList = []
-    self.ballotOrder = []
+    self.ballotRuns = []
+    self.ballotRunEnds = []
+    self._numBallots = 0
+    self.runIndex = None
 
   def getTopChoiceFromBallot(self, i, choices):
     "Return the top choice on a ballot among candidates still in the running."
 
-    j = self.ballotOrder[i]
+    j = self.getUniqueBallotIndex(i)
     ballot = self.uniqueBallots[j]
     for c in ballot:
       if c in choices:
@@ -296,6 +561,10 @@ class Ballots(object):
         return c
     return None
 
+  def getTopChoiceCursor(self, weighted=True):
+    """Return a TopChoiceCursor for the weighted or individual ballots."""
+    return TopChoiceCursor(self, weighted)
+
   def getCleanBallots(self, removeEmpty=True, removeOvervotes="Cambridge",
                       removeDupes=True, removeWithdrawn=True):
     """Ballots can be cleaned in several ways:
@@ -321,9 +590,9 @@ class Ballots(object):
     """
 
     # We want to keep track of the link between dirty and clean ballots
+    self.finishEdits()
     cleanBallots = self.copy(False)
     cleanBallots.withdrawn = []
-    cleanBallots.customBallotIDs = True
     cleanBallots.dirtyBallots = self
     
     # Set up a translation list for candidate numbers for removing
@@ -341,50 +610,48 @@ class Ballots(object):
         else:
           c2c[i] -= n
 
-    # Loop over ballots and perform requested cleaning
-    for i in xrange(self.numBallots):
-      ballot, ballotID = self.getBallotAndID(i)
-      seenCandidates = set()
-      cleanBallot = [] # This will be a cleaned version of ballot
-      for item in ballot:
-        
-        # Candidate may have to pass two tests to get in the cleaned ballots.
-        # First, candidate must not be withdrawn.
-        # Second, candidate must not already be on the ballot when removeDupes
-        # is true.
-
-        if isinstance(item, list):
-          assert(len(item) > 1)
-          if removeOvervotes == "Cambridge":
-            continue
-          elif removeOvervotes == "San Francisco":
-            break
-          cleanItem = []
-          for c in item:
-            if c == -1:
-              continue  # Skipped ranking
-            c2 = c2c[c] # Candidate number after removing withdrawn candidates
-            if not ((c in self.withdrawn) or (removeDupes and c2 in seenCandidates)):
-              assert(c2 is not None)
-              cleanItem.append(c2)
-              seenCandidates.add(c2)
-          if len(cleanItem) > 1:
-            cleanBallot.append(cleanItem)
-          elif len(cleanItem) == 1:
-            cleanBallot.append(cleanItem[0])
-          
+    # Each unique ballot is cleaned the first time it appears in the ballot
+    # order.  dirtyToClean[j] is the index of the cleaned version of unique
+    # ballot j in cleanBallots, -2 if the cleaned ballot is removed, or -1
+    # if the ballot has not been cleaned yet.
+    withdrawn = set(self.withdrawn)
+    dirtyToClean = array("l", [-1]) * self.numWeightedBallots
+
+    # The clean ballots keep the IDs of the dirty ballots.  They are looked
+    # up in the dirty ballots through the runs of dirty ballots that are
+    # kept.  Weighted only ballots have no IDs.
+    if self.weightedOnly:
+      ballotIDs = None
+    elif self.customBallotIDs:
+      ballotIDs = BallotIDRuns(self.ballotIDsList)
+    else:
+      ballotIDs = BallotIDRuns()
+    removedBallots = False
+    start = 0
+    for j, n in self.iterBallotRuns():
+      k = dirtyToClean[j]
+      if k == -1:
+        cleanBallot = self.cleanBallot(self.uniqueBallots[j], c2c, withdrawn,
+                                       removeOvervotes, removeDupes)
+        if not removeEmpty or len(cleanBallot) > 0:
+          k = cleanBallots.addUniqueBallot(cleanBallot)
         else:
-          c = item
-          if c == -1:
-            continue  # Skipped ranking
-          c2 = c2c[c] # Candidate number after removing withdrawn candidates
-          if not ((c in self.withdrawn) or (removeDupes and c2 in seenCandidates)):
-            assert(c2 is not None)
-            cleanBallot.append(c2)
-            seenCandidates.add(c2)
+          k = -2
+        dirtyToClean[j] = k
 
-      if not removeEmpty or len(cleanBallot) > 0:
-        cleanBallots.appendBallot(cleanBallot, ballotID)
+      if k >= 0:
+        cleanBallots.appendRun(k, n)
+        if ballotIDs is not None:
+          ballotIDs.appendRange(start, n)
+      else:
+        removedBallots = True
+      start += n
+
+    # If no ballots were removed, clean ballot i is dirty ballot i, and the
+    # clean ballots need custom IDs only if the dirty ballots have them.
+    if ballotIDs is not None and (self.customBallotIDs or removedBallots):
+      cleanBallots.customBallotIDs = True
+      cleanBallots.ballotIDsList = ballotIDs
 
     # Remove the withdrawn candidates names
     cleanBallots.names = [self.names[c] for c in range(self.numCandidates)
@@ -392,39 +659,239 @@ class Ballots(object):
     
     return cleanBallots
 
+  def makeBallotIDsWritable(self):
+    "Copy ballot IDs looked up in dirty ballots into a list of their own."
+
+    if isinstance(self.ballotIDsList, BallotIDRuns):
+      self.ballotIDsList = list(self.ballotIDsList)
+
+  def cleanBallot(self, ballot, c2c, withdrawn, removeOvervotes="Cambridge",
+                  removeDupes=True):
+    """Return a cleaned copy of a ballot.
+
+    c2c translates candidate numbers and withdrawn is the set of withdrawn
+    candidates.  See getCleanBallots() for the other arguments.
+    """
+
+    seenCandidates = set()
+    cleanBallot = [] # This will be a cleaned version of ballot
+    for item in ballot:
+      
+      # Candidate may have to pass two tests to get in the cleaned ballots.
+      # First, candidate must not be withdrawn.
+      # Second, candidate must not already be on the ballot when removeDupes
+      # is true.
+
+      if isinstance(item, list):
+        assert(len(item) > 1)
+        if removeOvervotes == "Cambridge":
+          continue
+        elif removeOvervotes == "San Francisco":
+          break
+        cleanItem = []
+        for c in item:
+          if c == -1:
+            continue  # Skipped ranking
+          c2 = c2c[c] # Candidate number after removing withdrawn candidates
+          if not ((c in withdrawn) or (removeDupes and c2 in seenCandidates)):
+            assert(c2 is not None)
+            cleanItem.append(c2)
+            seenCandidates.add(c2)
+        if len(cleanItem) > 1:
+          cleanBallot.append(cleanItem)
+        elif len(cleanItem) == 1:
+          cleanBallot.append(cleanItem[0])
+        
+      else:
+        c = item
+        if c == -1:
+          continue  # Skipped ranking
+        c2 = c2c[c] # Candidate number after removing withdrawn candidates
+        if not ((c in withdrawn) or (removeDupes and c2 in seenCandidates)):
+          assert(c2 is not None)
+          cleanBallot.append(c2)
+          seenCandidates.add(c2)
+
+    return cleanBallot
+
   def appendFile(self, fName):
     "Append ballot data from a file."
 
-    ballotList = Ballots()
-    ballotList.loadUnknown(fName)
-    
-    if (ballotList.numSeats != self.numSeats or
-        ballotList.names != self.names or
-        ballotList.withdrawn != self.withdrawn):
+    data = loadBallotFileData((self.__class__, fName, self.weightedOnly, True,
+                               None))
+    self.appendFileData(fName, data)
+
+  def loadFiles(self, fNames, numProcesses=None, exclude0=True):
+    """Load ballots from several files, such as one file for each precinct.
+
+    The ballots of each file are appended in the order of fNames so the
+    ballot order is the same as loading the first file and appending the
+    others.  All files must have the same numbers of seats and candidates,
+    the same candidate names, and the same withdrawn candidates.
+
+    The files are parsed in a pool of numProcesses processes (by default
+    one for each CPU) and only the unique ballots and their weights are sent
+    back to be merged.  With numProcesses equal to 1, or if the
+    multiprocessing module is not available, the files are parsed here.
+
+    With fewer files than processes, the ballots of each file are split into
+    ranges that are parsed in different processes, if the loader for the
+    file can do this (see getBallotRanges).  For a PairwiseTally each
+    process only sends back the pairwise counts of its ballots.
+    """
+
+    assert(len(fNames) > 0)
+    if multiprocessing is None:
+      numProcesses = 1
+    elif numProcesses is None:
+      try:
+        numProcesses = multiprocessing.cpu_count()
+      except NotImplementedError:
+        numProcesses = 1
+
+    fileNames = []
+    args = []
+    for fName in fNames:
+      for ballotRange in self.getBallotRanges(fName,
+                                              numProcesses // len(fNames),
+                                              exclude0):
+        fileNames.append(fName)
+        args.append((self.__class__, fName, self.weightedOnly, exclude0,
+                     ballotRange))
+    if numProcesses == 1 or len(args) == 1:
+      pool = None
+      results = imap(loadBallotFileData, args)
+    else:
+      pool = multiprocessing.Pool(numProcesses)
+      results = pool.imap(loadBallotFileData, args)
+
+    try:
+      for k, (fName, data) in enumerate(izip(fileNames, results)):
+        if k == 0:
+          # The first file sets the election details
+          (title, numSeats, names, withdrawn, customBallotIDs) = data[:5]
+          self.deleteBallots()
+          self.title = title
+          self.numSeats = numSeats
+          self.names = names
+          self.withdrawn = withdrawn
+          self.customBallotIDs = customBallotIDs
+        self.appendFileData(fName, data)
+    finally:
+      if pool is not None:
+        pool.terminate()
+
+    # Saving should not write the merged ballots to any of the files, but
+    # the ballots of a single file can be saved back to it
+    self.loader = None
+    if len(fNames) == 1:
+      extension = os.path.splitext(fNames[0])[1][1:]
+      loaderClass = getLoaderPluginClass(extension, exclude0)
+      if loaderClass is not None:
+        self.loader = loaderClass()
+        self.loader.fName = fNames[0]
+
+  def getBallotRanges(self, fName, n, exclude0=True):
+    """Return the ranges of ballots for loading a file in n pieces.
+
+    A range of None stands for the whole file.  A file is only split if its
+    loader has a getBallotRanges() method and it isn't loaded from a cache.
+    """
+
+    if n < 2 or self.getCacheName(fName) is not None:
+      return [None]
+    extension = os.path.splitext(fName)[1][1:]
+    loaderClass = getLoaderPluginClass(extension, exclude0)
+    if loaderClass is None or not hasattr(loaderClass, "getBallotRanges"):
+      return [None]
+    return loaderClass().getBallotRanges(fName, n) or [None]
+
+  def appendFileData(self, fName, data):
+    "Append ballot data returned by loadBallotFileData()."
+
+    (title, numSeats, names, withdrawn, customBallotIDs, ballotData) = data
+    if (numSeats != self.numSeats or names != self.names or
+        withdrawn != self.withdrawn):
+      raise RuntimeError, \
+            "Can't append ballots from %s.  The numbers of seats and \n"\
+            "candidates, the names of the candidates, and the withdrawn \n"\
+            "candidates must be identical." % fName
+    if customBallotIDs != self.customBallotIDs:
       raise RuntimeError, \
-            "Can't append ballots.  The numbers of seats and candidates, \n"\
-            "the names of the candidates, and the withdrawn candidates \n"\
-            "must be identical."
+            "Can't append ballots from %s.  Either all or none of the \n"\
+            "ballots must have ballot IDs." % fName
+    self.appendBallotData(ballotData)
+
+  def getBallotData(self):
+    """Return the ballot data for appendBallotData().
+
+    The data can be pickled so it can be sent from other processes.  Arrays
+    pickle as lists of numbers so they are sent as strings.
+    """
+
+    packedData = [data.tostring() for data in self.getPackedData()]
+    if self.customBallotIDs:
+      ballotIDs = list(self.ballotIDsList)
+    else:
+      ballotIDs = None
+    return (packedData, ballotIDs)
+
+  def appendBallotData(self, ballotData):
+    "Append ballot data returned by getBallotData()."
 
-    for i in xrange(ballotList.numBallots):
-      ballot = ballotList.getBallot(i)
-      ballotID = ballotList.getBallotID(i) if self.customBallotIDs else None
-      self.appendBallot(ballot, ballotID)
+    (packedData, ballotIDs) = ballotData
+    typecodes = ["l", "i", "l", "i", "l"]
+    (offsets, rankings, counts, runs, runEnds) = \
+              [array(typecode, text)
+               for typecode, text in zip(typecodes, packedData)]
+    self.appendPackedData(offsets, rankings, counts, runs, runEnds, ballotIDs)
+
+  def appendPackedData(self, offsets, rankings, counts, runs, runEnds,
+                       ballotIDs=None):
+    """Append ballots given as arrays in the format of getPackedData().
+
+    The runs of another Ballots object are appended in order, or just the
+    weights of its unique ballots for weighted only ballots.
+    """
+
+    self.finishEdits()
+    packedList = PackedBallotList(offsets, rankings)
+    index = [self.addUniqueBallot(packedList[j])
+             for j in xrange(len(packedList))]
+
+    if self.weightedOnly:
+      for j, count in enumerate(counts):
+        self.appendRun(index[j], count)
+      return
+
+    assert((ballotIDs is None) ^ (self.customBallotIDs)) # XOR
+    if ballotIDs is not None:
+      self.makeBallotIDsWritable()
+      self.ballotIDsList.extend(ballotIDs)
+    start = 0
+    for j, end in izip(runs, runEnds):
+      self.appendRun(index[j], end - start)
+      start = end
 
   def save(self):
     "Save back to the last file I was saved or loaded from"
+    self.finishEdits()
     self.loader.save(self)
 
   def saveAs(self, fName, packed=False):
     "Create a new ballot loader and save ballots"
     
+    self.finishEdits()
     extension = os.path.splitext(fName)[1][1:]
     loaderClass = getLoaderPluginClass(extension)
     if loaderClass is None:
       # If we don't know then the default is blt format
       loaderClass = getLoaderPluginClass("blt")
-    self.loader = loaderClass()
-    self.loader.save(self, fName, packed)
+    # The loader is replaced after saving so a cache can record the file the
+    # ballots were loaded from
+    loader = loaderClass()
+    loader.save(self, fName, packed)
+    self.loader = loader
 
   def loadKnown(self, fName, extension=None, exclude0 = True):
     "Load a file based on its file extension."
@@ -436,7 +903,11 @@ class Ballots(object):
       raise RuntimeError, "Do not know how to load files with extension %s." % (extension)
 
     self.loader = loaderClass()
-    self.loader.load(self, fName)
+    if self.loadCache(fName):
+      # Saving still writes to the original file
+      self.loader.fName = fName
+    else:
+      self.loader.load(self, fName)
 
   def loadUnknown(self, fName, exclude0 = True):
     "Load a file of unknown format."
@@ -450,6 +921,14 @@ class Ballots(object):
       loaderClasses.remove(bestGuess)
       loaderClasses.insert(0, bestGuess)
 
+    if self.loadCache(fName):
+      # Saving still writes to the original file
+      if bestGuess is None:
+        bestGuess = getLoaderPluginClass("blt")
+      self.loader = bestGuess()
+      self.loader.fName = fName
+      return
+
     errorMsg = "Could not load ballots from file %s." % fName
       
     # Try them in order
@@ -468,6 +947,38 @@ class Ballots(object):
       else:
         self.exceptionQueue.put(errorMsg)
 
+  def loadCache(self, fName):
+    """Load ballots from a binary cache of a ballot file if there is one.
+
+    The cache is the file with the same name and the extension bltc.  It is
+    only used if it was saved from this ballot file and the ballot file has
+    not changed since.  A cache without the order of the ballots is only
+    used for weighted only ballots.  Returns True if the ballots were loaded
+    from the cache.
+    """
+
+    cacheName = self.getCacheName(fName)
+    if cacheName is None:
+      return False
+
+    # The cache loader checks the whole file before changing any ballot data
+    try:
+      getLoaderPluginClass("bltc")().load(self, cacheName)
+    except RuntimeError:
+      return False
+    return True
+
+  def getCacheName(self, fName):
+    "Return the name of an up to date cache of a ballot file or None."
+
+    cacheName = os.path.splitext(fName)[0] + ".bltc"
+    loaderClass = getLoaderPluginClass("bltc")
+    if cacheName == fName or loaderClass is None:
+      return None
+    if not loaderClass().isCacheFor(cacheName, fName, self.weightedOnly):
+      return None
+    return cacheName
+
   def getFileName(self):
     "The name of the last file I was saved or loaded from"
     if (self.loader is not None):
@@ -497,6 +1008,19 @@ class Ballots(object):
     for i, c in enumerate(order):
       c2c[c] = i
 
+    self.translateCandidates(c2c)
+      
+    # Put the names in the right order
+    oldNames = self.names[:]
+    names = self.names
+    for c in range(self.numCandidates):
+      cc = c2c[c]
+      names[cc] = oldNames[c]
+    self.names = names
+
+  def translateCandidates(self, c2c):
+    "Change each candidate number c on the ballots to c2c[c]."
+
     # Translate all the candidate numbers. This must be done in two places:
     # (1) The ballots in uniqueBallots
     # (2) The keys in uniqueBallotsLookup
@@ -508,16 +1032,46 @@ class Ballots(object):
     for i in xrange(self.numWeightedBallots):
       for j, c in enumerate(self.uniqueBallots[i]):
         self.uniqueBallots[i][j] = c2c[c]
-      ballotString = str(list(self.uniqueBallots[i]))
-      self.uniqueBallotsLookup[ballotString] = i
-      
-    # Put the names in the right order
-    oldNames = self.names[:]
-    names = self.names
-    for c in range(self.numCandidates):
-      cc = c2c[c]
-      names[cc] = oldNames[c]
-    self.names = names
+      ballotKey = self.ballotKey(self.uniqueBallots[i])
+      self.uniqueBallotsLookup[ballotKey] = i
+
+  def getPackedData(self):
+    """Return the ballot data as flat arrays.
+
+    Returns the offsets and rankings of the unique ballots packed as in a
+    PackedBallotList, the weights of the unique ballots, and the ballot runs
+    and run ends.  This is used for saving ballots in binary formats.
+    """
+
+    self.finishEdits()
+    packedList = PackedBallotList()
+    for ballot in self.uniqueBallots:
+      packedList.append(ballot)
+    return (packedList.offsets, packedList.rankings,
+            array("l", self.uniqueBallotCount), array("i", self.ballotRuns),
+            array("l", self.ballotRunEnds))
+
+  def setPackedData(self, offsets, rankings, counts, runs, runEnds,
+                    ballotIDs=None):
+    """Replace the ballot data with arrays in the format of getPackedData().
+
+    Any sequences supporting len(), indexing, and slicing can be used, such
+    as MappedArray objects.  The data is copied into Python lists.
+    """
+
+    self.deleteBallots()
+    packedList = PackedBallotList(offsets, rankings)
+    self.uniqueBallots = [packedList[i] for i in xrange(len(packedList))]
+    self.uniqueBallotCount = list(counts)
+    if self.weightedOnly:
+      self._numBallots = runEnds[-1] if len(runEnds) > 0 else 0
+    else:
+      self.ballotRuns = list(runs)
+      self.ballotRunEnds = list(runEnds)
+      if ballotIDs is not None:
+        self.ballotIDsList = list(ballotIDs)
+    for i, ballot in enumerate(self.uniqueBallots):
+      self.uniqueBallotsLookup[self.ballotKey(ballot)] = i
 
   def joinList(self, itemList, convert="names"):
 
@@ -546,3 +1100,805 @@ class Ballots(object):
         return False
     return True
   
+
+##################################################################
+
+def loadBallotFileData(args):
+  """Load a ballot file and return its data as strings and lists.
+
+  args is a tuple of the Ballots class to use, the file name, whether to
+  keep only weighted ballots, exclude0 as for loadUnknown(), and the range
+  of ballots to load from Ballots.getBallotRanges().  The result can be
+  pickled so files can be loaded in other processes (see
+  Ballots.loadFiles).  It is passed to Ballots.appendFileData().
+  """
+
+  (ballotsClass, fName, weightedOnly, exclude0, ballotRange) = args
+  ballotList = ballotsClass(weightedOnly=weightedOnly)
+  if ballotRange is None:
+    ballotList.loadUnknown(fName, exclude0)
+  else:
+    extension = os.path.splitext(fName)[1][1:]
+    ballotList.loader = getLoaderPluginClass(extension, exclude0)()
+    ballotList.loader.loadRange(ballotList, fName, ballotRange)
+  return (ballotList.title, ballotList.numSeats, ballotList.names,
+          ballotList.withdrawn, ballotList.customBallotIDs,
+          ballotList.getBallotData())
+
+##################################################################
+
+class TopChoiceCursor(object):
+  """Find top choices on ballots as candidates drop out of a count.
+
+  getTopChoice() gives the same answer as getTopChoiceFromWeightedBallot()
+  (or getTopChoiceFromBallot() for individual ballots), but the cursor
+  remembers how far down each ballot it has looked.  The next search for
+  that ballot starts from there instead of from the first ranking.
+
+  This requires that the candidates passed as choices for a given ballot
+  never gain a candidate from one call to the next, which is true for the
+  continuing candidates in a count.  The total work for a count is then
+  proportional to the total number of rankings on the ballots.
+  """
+
+  def __init__(self, b, weighted=True):
+    self.uniqueBallots = b.uniqueBallots
+
+    # self.order[i] is the index of the unique ballot for ballot i, and
+    # self.position[i] is the position on ballot i of the first ranking that
+    # has not been passed over yet.
+    if weighted:
+      self.order = array("i", xrange(b.numWeightedBallots))
+    else:
+      self.order = array("i")
+      for j, n in b.iterBallotRuns():
+        self.order.extend(array("i", [j]) * n)
+    self.position = self.getStartPositions()
+
+  def getStartPositions(self):
+    return array("i", [0]) * len(self.order)
+
+  def getTopChoice(self, i, choices):
+    "Return the top choice on a ballot among candidates still in the running."
+
+    ballot = self.uniqueBallots[self.order[i]]
+    k = self.position[i]
+    for c in islice(ballot, k, None):
+      if c in choices:
+        self.position[i] = ballot.index(c, k)
+        return c
+    self.position[i] = len(ballot)
+    return None
+
+##################################################################
+
+class PackedTopChoiceCursor(TopChoiceCursor):
+  """TopChoiceCursor that reads the packed rankings of a CompactBallots.
+
+  Positions are kept as offsets into the packed rankings.
+  """
+
+  def getStartPositions(self):
+    offsets = self.uniqueBallots.offsets
+    return array("l", [offsets[j] for j in self.order])
+
+  def getTopChoice(self, i, choices):
+    "Return the top choice on a ballot among candidates still in the running."
+
+    rankings = self.uniqueBallots.rankings
+    k = self.position[i]
+    end = self.uniqueBallots.offsets[self.order[i]+1]
+    for k, c in enumerate(rankings[k:end], k):
+      if c in choices:
+        self.position[i] = k
+        return c
+    self.position[i] = end
+    return None
+
+##################################################################
+
+class BallotRunIndex(object):
+  """The runs of ballots split into blocks for editing single ballots.
+
+  Deleting a ballot from the flat lists of runs of a Ballots object shifts
+  every later run end, and splitting a run shifts every later run.  Here
+  the runs are kept in blocks of up to 2*blockSize runs.  Each block has
+  the unique ballot index and the length of each of its runs, and the IDs
+  of its ballots if there are custom ballot IDs.  The numbers of ballots in
+  the blocks are kept in a Fenwick tree, so finding the block that holds a
+  ballot and changing the number of ballots in a block take O(log n) time.
+  Edits only change the runs of one block.
+  """
+
+  blockSize = 64
+
+  def __init__(self, runs, runEnds, ballotIDs=None):
+    self.blockRuns = []
+    self.blockLengths = []
+    self.blockIDs = None if ballotIDs is None else []
+    self.blockTotals = []
+    start = 0
+    for k in xrange(0, len(runs), self.blockSize):
+      blockStart = start
+      lengths = []
+      for end in runEnds[k:k + self.blockSize]:
+        lengths.append(end - start)
+        start = end
+      self.blockRuns.append(list(runs[k:k + self.blockSize]))
+      self.blockLengths.append(lengths)
+      self.blockTotals.append(start - blockStart)
+      if ballotIDs is not None:
+        self.blockIDs.append(list(ballotIDs[blockStart:start]))
+    self.numBallots = start
+    self.buildTree()
+
+  def buildTree(self):
+    "Build the Fenwick tree of the numbers of ballots in the blocks."
+
+    # tree[m] is the number of ballots in blocks m - (m & -m) to m - 1
+    tree = [0] + self.blockTotals
+    for m in xrange(1, len(tree)):
+      parent = m + (m & -m)
+      if parent < len(tree):
+        tree[parent] += tree[m]
+    self.tree = tree
+
+  def addToBlock(self, b, n):
+    "Add n to the number of ballots in block b."
+
+    self.blockTotals[b] += n
+    self.numBallots += n
+    tree = self.tree
+    m = b + 1
+    while m < len(tree):
+      tree[m] += n
+      m += m & -m
+
+  def findBallot(self, i):
+    """Return where the ith ballot is.
+
+    Returns the block holding the ballot, the run in the block, the
+    position of the ballot in the run, and the position of the ballot in
+    the block.
+    """
+
+    if i < 0:
+      i += self.numBallots
+    if i < 0 or i >= self.numBallots:
+      raise IndexError, "ballot index out of range"
+
+    # Find the last block b with fewer than i+1 ballots before it
+    tree = self.tree
+    b = 0
+    step = 1
+    while 2*step < len(tree):
+      step *= 2
+    while step > 0:
+      if b + step < len(tree) and tree[b + step] <= i:
+        b += step
+        i -= tree[b]
+      step //= 2
+
+    position = i
+    for k, length in enumerate(self.blockLengths[b]):
+      if i < length:
+        break
+      i -= length
+    return (b, k, i, position)
+
+  def getUniqueBallotIndex(self, i):
+    "Return the index of the unique ballot of the ith ballot."
+    (b, k, offset, position) = self.findBallot(i)
+    return self.blockRuns[b][k]
+
+  def getBallotID(self, i):
+    (b, k, offset, position) = self.findBallot(i)
+    return self.blockIDs[b][position]
+
+  def setUniqueBallotIndex(self, i, j):
+    """Make the ith ballot a copy of unique ballot j.
+
+    Returns the index of the unique ballot that the ballot was before.
+    """
+
+    (b, k, offset, position) = self.findBallot(i)
+    runs = self.blockRuns[b]
+    lengths = self.blockLengths[b]
+    oldJ = runs[k]
+    if oldJ == j:
+      return oldJ
+
+    # Split the run around the ballot
+    newRuns = [(oldJ, offset), (j, 1), (oldJ, lengths[k] - offset - 1)]
+    newRuns = [(run, length) for run, length in newRuns if length > 0]
+    runs[k:k + 1] = [run for run, length in newRuns]
+    lengths[k:k + 1] = [length for run, length in newRuns]
+    if offset > 0:
+      k += 1
+    self.mergeRuns(b, k)
+
+    if len(runs) > 2*self.blockSize:
+      self.splitBlock(b)
+    return oldJ
+
+  def deleteBallot(self, i):
+    """Delete the ith ballot.
+
+    Returns the index of the unique ballot of the deleted ballot.
+    """
+
+    (b, k, offset, position) = self.findBallot(i)
+    runs = self.blockRuns[b]
+    lengths = self.blockLengths[b]
+    j = runs[k]
+    lengths[k] -= 1
+    if lengths[k] == 0:
+      del runs[k]
+      del lengths[k]
+      if 0 < k < len(runs):
+        self.mergeRuns(b, k - 1)
+    if self.blockIDs is not None:
+      del self.blockIDs[b][position]
+    self.addToBlock(b, -1)
+    return j
+
+  def appendRun(self, j, n, ballotID=None):
+    "Append n copies of unique ballot j to the end of the ballots."
+
+    assert((ballotID is None) ^ (self.blockIDs is not None)) # XOR
+    if (len(self.blockRuns) == 0 or
+        len(self.blockRuns[-1]) >= 2*self.blockSize):
+      self.blockRuns.append([])
+      self.blockLengths.append([])
+      if self.blockIDs is not None:
+        self.blockIDs.append([])
+      self.blockTotals.append(0)
+      self.buildTree()
+    runs = self.blockRuns[-1]
+    lengths = self.blockLengths[-1]
+    if len(runs) > 0 and runs[-1] == j:
+      lengths[-1] += n
+    else:
+      runs.append(j)
+      lengths.append(n)
+    if ballotID is not None:
+      assert(n == 1)
+      self.blockIDs[-1].append(ballotID)
+    self.addToBlock(len(self.blockRuns) - 1, n)
+
+  def mergeRuns(self, b, k):
+    "Merge run k of block b with the runs on either side if they match."
+
+    runs = self.blockRuns[b]
+    lengths = self.blockLengths[b]
+    if k + 1 < len(runs) and runs[k + 1] == runs[k]:
+      lengths[k] += lengths[k + 1]
+      del runs[k + 1]
+      del lengths[k + 1]
+    if k > 0 and runs[k - 1] == runs[k]:
+      lengths[k - 1] += lengths[k]
+      del runs[k]
+      del lengths[k]
+
+  def splitBlock(self, b):
+    "Split block b into two blocks."
+
+    half = len(self.blockRuns[b]) // 2
+    runs = self.blockRuns[b]
+    lengths = self.blockLengths[b]
+    n = sum(lengths[:half])
+    self.blockRuns[b:b + 1] = [runs[:half], runs[half:]]
+    self.blockLengths[b:b + 1] = [lengths[:half], lengths[half:]]
+    if self.blockIDs is not None:
+      ballotIDs = self.blockIDs[b]
+      self.blockIDs[b:b + 1] = [ballotIDs[:n], ballotIDs[n:]]
+    total = self.blockTotals[b]
+    self.blockTotals[b:b + 1] = [n, total - n]
+    self.buildTree()
+
+  def getRuns(self):
+    "Return the runs, the run ends, and the ballot IDs as flat lists."
+
+    runs = []
+    runEnds = []
+    end = 0
+    for blockRuns, blockLengths in izip(self.blockRuns, self.blockLengths):
+      for j, n in izip(blockRuns, blockLengths):
+        end += n
+        if len(runs) > 0 and runs[-1] == j:
+          runEnds[-1] = end
+        else:
+          runs.append(j)
+          runEnds.append(end)
+    if self.blockIDs is None:
+      ballotIDs = None
+    else:
+      ballotIDs = list(chain.from_iterable(self.blockIDs))
+    return (runs, runEnds, ballotIDs)
+
+##################################################################
+
+class PackedBallotList(object):
+  """A list of ballots packed into two flat typed arrays.
+
+  The rankings of all ballots are stored end to end in self.rankings and
+  ballot i occupies self.rankings[self.offsets[i]:self.offsets[i+1]].  A
+  ranking is stored as the candidate index number or as -1 for a skipped
+  ranking.  An equal ranking of k candidates is stored as -k followed by
+  the k candidate index numbers (equal rankings always have at least two
+  candidates so -k never collides with -1).
+
+  Indexing returns a ballot in the usual list format so this can be used
+  wherever a list of ballots is expected.
+  """
+
+  def __init__(self, offsets=None, rankings=None):
+    if offsets is None:
+      offsets = array("l", [0])
+    if rankings is None:
+      rankings = array("i")
+    self.offsets = offsets
+    self.rankings = rankings
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    return self.unpack(self.getPacked(i))
+
+  def getPacked(self, i):
+    "Return the packed rankings of the ith ballot as an array."
+    return self.rankings[self.offsets[i]:self.offsets[i+1]]
+
+  def append(self, ballot):
+    self.appendPacked(array("i", self.pack(ballot)))
+
+  def appendPacked(self, packed):
+    self.rankings.extend(packed)
+    self.offsets.append(len(self.rankings))
+
+  @staticmethod
+  def pack(ballot):
+    "Convert a ballot to a flat list of integers."
+    packed = []
+    for item in ballot:
+      if isinstance(item, list):
+        packed.append(-len(item))
+        packed.extend(item)
+      else:
+        packed.append(item)
+    return packed
+
+  @staticmethod
+  def unpack(packed):
+    "Convert a flat sequence of integers back to a ballot."
+    if len(packed) == 0 or min(packed) >= -1:
+      return list(packed) # no equal rankings
+    ballot = []
+    i = 0
+    while i < len(packed):
+      ranking = packed[i]
+      if ranking < -1:
+        ballot.append(list(packed[i+1:i+1-ranking]))
+        i += 1 - ranking
+      else:
+        ballot.append(ranking)
+        i += 1
+    return ballot
+
+##################################################################
+
+class MappedArray(object):
+  """A read-only array backed by a buffer such as an mmap object.
+
+  Items are unpacked from the buffer as they are accessed so no data is
+  copied when the MappedArray is created.  Slicing returns an ordinary
+  array.
+  """
+
+  def __init__(self, typecode, buf, offset, length):
+    self.typecode = typecode
+    self.itemsize = struct.calcsize(typecode)
+    self.buf = buf
+    self.offset = offset
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      (start, stop, step) = i.indices(self.length)
+      assert(step == 1)
+      stop = max(start, stop)
+      return array(self.typecode, self.buf[self.offset + start*self.itemsize:
+                                           self.offset + stop*self.itemsize])
+    if i < 0:
+      i += self.length
+    if i < 0 or i >= self.length:
+      raise IndexError, "array index out of range"
+    return struct.unpack_from(self.typecode, self.buf,
+                              self.offset + i*self.itemsize)[0]
+
+  def __iter__(self):
+    # Unpack a block at a time
+    blockSize = 65536
+    for start in xrange(0, self.length, blockSize):
+      for item in self[start:start + blockSize]:
+        yield item
+
+  def tostring(self):
+    return self.buf[self.offset:self.offset + self.length*self.itemsize]
+
+  def toArray(self):
+    "Return a copy of the data as an ordinary array."
+    return array(self.typecode, self.tostring())
+
+##################################################################
+
+class BallotIDRuns(object):
+  """The ballot IDs of clean ballots stored as runs of dirty ballots.
+
+  Cleaning only removes whole runs of ballots, so the clean ballots are
+  runs of consecutive dirty ballots and only the number of the first dirty
+  ballot of each run is kept.  The IDs are looked up in dirtyIDs, or are
+  the dirty ballot numbers plus one if the dirty ballots have no IDs.  The
+  dirty ballots only append to their list of IDs and start a new list
+  when their IDs are changed, so the IDs looked up here stay the same.
+
+  Like a MappedArray this is read-only.  The clean ballots copy it into a
+  list with makeBallotIDsWritable() the first time their IDs are changed.
+  """
+
+  def __init__(self, dirtyIDs=None):
+    self.dirtyIDs = dirtyIDs
+    self.ends = array("l")   # Number of clean ballots in runs 0 through k
+    self.starts = array("l") # Number of the first dirty ballot in run k
+
+  def appendRange(self, start, n):
+    "Append the IDs of dirty ballots start through start + n - 1."
+
+    if n == 0:
+      return
+    if len(self.ends) > 0:
+      runStart = self.ends[-2] if len(self.ends) > 1 else 0
+      if self.starts[-1] + self.ends[-1] - runStart == start:
+        # Continues the last run
+        self.ends[-1] += n
+        return
+    self.starts.append(start)
+    self.ends.append(len(self) + n)
+
+  def __len__(self):
+    if len(self.ends) == 0:
+      return 0
+    return self.ends[-1]
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return list(islice(self, *i.indices(len(self))))
+    if i < 0:
+      i += len(self)
+    if i < 0 or i >= len(self):
+      raise IndexError, "ballot ID index out of range"
+    k = bisect_right(self.ends, i)
+    runStart = self.ends[k-1] if k > 0 else 0
+    return self.getID(self.starts[k] + i - runStart)
+
+  def __iter__(self):
+    runStart = 0
+    for end, start in izip(self.ends, self.starts):
+      for j in xrange(start, start + end - runStart):
+        yield self.getID(j)
+      runStart = end
+
+  def getID(self, j):
+    "Return the ID of dirty ballot j."
+    if self.dirtyIDs is None:
+      return j + 1
+    return self.dirtyIDs[j]
+
+##################################################################
+
+class CompactBallots(Ballots):
+  """Ballots object that stores ballot data in flat typed arrays.
+
+  This behaves exactly like Ballots but uses far less memory for elections
+  with millions of ballots.  The unique ballots are kept in a
+  PackedBallotList and the weights and runs of ballots are kept in arrays.
+
+  The arrays may also be MappedArray objects that read the ballot data
+  directly from a memory mapped file (see setPackedData).  They are copied
+  into memory the first time the ballots are changed.
+  """
+
+  def __init__(self, customBallotIDs=False, weightedOnly=False):
+    Ballots.__init__(self, customBallotIDs, weightedOnly)
+    self.deleteBallots()
+
+  def deleteBallots(self):
+    self.uniqueBallots = PackedBallotList()
+    self.uniqueBallotCount = array("l")
+    self.uniqueBallotsLookup = {}
+    self.ballotIDsList = []
+    self.ballotRuns = array("i")
+    self.ballotRunEnds = array("l")
+    self._numBallots = 0
+    self.runIndex = None
+
+  def makeWritable(self):
+    "Copy any mapped ballot data into memory so it can be changed."
+
+    packedList = self.uniqueBallots
+    for obj, attr in [(packedList, "offsets"), (packedList, "rankings"),
+                      (self, "uniqueBallotCount"), (self, "ballotRuns"),
+                      (self, "ballotRunEnds")]:
+      value = getattr(obj, attr)
+      if isinstance(value, MappedArray):
+        setattr(obj, attr, value.toArray())
+
+    self.makeBallotIDsWritable()
+
+    if self.uniqueBallotsLookup is None:
+      self.uniqueBallotsLookup = {}
+      for i in xrange(self.numWeightedBallots):
+        ballotKey = self.ballotKey(self.uniqueBallots[i])
+        self.uniqueBallotsLookup[ballotKey] = i
+
+  def appendBallots(self, ballots, weights=None, ids=None):
+    "Append many ballots to this Ballots object."
+    self.makeWritable()
+    Ballots.appendBallots(self, ballots, weights, ids)
+
+  def appendPackedData(self, offsets, rankings, counts, runs, runEnds,
+                       ballotIDs=None):
+    "Append ballots given as arrays in the format of getPackedData()."
+    self.makeWritable()
+    Ballots.appendPackedData(self, offsets, rankings, counts, runs, runEnds,
+                             ballotIDs)
+
+  def setBallot(self, i, ballot):
+    "Replace the ith ballot."
+    self.makeWritable()
+    Ballots.setBallot(self, i, ballot)
+
+  def keepUniqueBallots(self, keep):
+    "Keep only the unique ballots with the indices in keep."
+    packedList = PackedBallotList()
+    for j in keep:
+      packedList.appendPacked(self.uniqueBallots.getPacked(j))
+    self.uniqueBallots = packedList
+    self.uniqueBallotCount = array("l", [self.uniqueBallotCount[j]
+                                         for j in keep])
+
+  def deleteBallot(self, i):
+    "Delete the ith ballot."
+    self.makeWritable()
+    Ballots.deleteBallot(self, i)
+
+  def getPackedData(self):
+    "Return the ballot data as flat arrays."
+    self.finishEdits()
+    return (self.uniqueBallots.offsets, self.uniqueBallots.rankings,
+            self.uniqueBallotCount, self.ballotRuns, self.ballotRunEnds)
+
+  def setPackedData(self, offsets, rankings, counts, runs, runEnds,
+                    ballotIDs=None):
+    """Replace the ballot data with arrays in the format of getPackedData().
+
+    The arrays are used as they are without copying.  The lookup table for
+    unique ballots is only built when ballots are appended.
+    """
+
+    self.deleteBallots()
+    self.uniqueBallots = PackedBallotList(offsets, rankings)
+    self.uniqueBallotCount = counts
+    if self.weightedOnly:
+      self._numBallots = runEnds[-1] if len(runEnds) > 0 else 0
+    else:
+      self.ballotRuns = runs
+      self.ballotRunEnds = runEnds
+      if ballotIDs is not None:
+        self.ballotIDsList = list(ballotIDs)
+    self.uniqueBallotsLookup = None
+
+  def getTopChoiceFromBallot(self, i, choices):
+    "Return the top choice on a ballot among candidates still in the running."
+
+    j = self.getUniqueBallotIndex(i)
+    return self.getTopChoiceFromWeightedBallot(j, choices)
+
+  def getTopChoiceFromWeightedBallot(self, i, choices):
+    "Return the top choice on a ballot among candidates still in the running."
+
+    # Ballots are clean when counting so the packed rankings can be scanned
+    # directly without unpacking.
+    for c in self.uniqueBallots.getPacked(i):
+      if c in choices:
+        return c
+    return None
+
+  def getTopChoiceCursor(self, weighted=True):
+    """Return a TopChoiceCursor for the weighted or individual ballots."""
+    return PackedTopChoiceCursor(self, weighted)
+
+  def getWeightedBallotSpan(self, i):
+    "Return the packed rankings of the ith weighted ballot without copying."
+    packedList = self.uniqueBallots
+    return packedList.rankings, packedList.offsets[i], packedList.offsets[i+1]
+
+  def translateCandidates(self, c2c):
+    "Change each candidate number c on the ballots to c2c[c]."
+
+    # Group markers and skipped rankings are negative and are left alone
+    self.makeWritable()
+    rankings = self.uniqueBallots.rankings
+    for j in xrange(len(rankings)):
+      if rankings[j] >= 0:
+        rankings[j] = c2c[rankings[j]]
+
+    self.uniqueBallotsLookup = {}
+    for i in xrange(self.numWeightedBallots):
+      ballotKey = self.ballotKey(self.uniqueBallots[i])
+      self.uniqueBallotsLookup[ballotKey] = i
+
+##################################################################
+
+class PairwiseTally(Ballots):
+  """Ballots object that keeps only the pairwise counts of the ballots.
+
+  Condorcet voting only needs the number of ballots ranking each candidate
+  over each other candidate, so the ballots can be counted as a ballot
+  loader appends them and then thrown away.  Any loader plugin can load
+  ballots into a PairwiseTally.
+
+  The ballots are cleaned as by getCleanBallots() with the default options
+  as they are counted, so the withdrawn candidates must be set before any
+  ballots are appended.  The counts use the original candidate numbers and
+  getCleanBallots() returns a PairwiseTally without the withdrawn
+  candidates.  The ballots themselves are not available so methods that
+  need them can't be used.
+  """
+
+  def __init__(self, customBallotIDs=False, weightedOnly=True):
+    Ballots.__init__(self, customBallotIDs, True)
+    self.deleteBallots()
+
+  def deleteBallots(self):
+    Ballots.deleteBallots(self)
+    self.numCleanBallots = 0
+    self.ranked = None
+    self.rankedBefore = None
+    # ranked[c] is the weight of the clean ballots ranking c, and
+    # rankedBefore[c][d] is the weight of those ranking d before c.  They
+    # are created when the first ballots are counted.
+
+  def startCounts(self):
+    "Create the counts once the number of candidates is known."
+    if self.ranked is None:
+      self.ranked = [0] * self.numCandidates
+      self.rankedBefore = []
+      for c in range(self.numCandidates):
+        self.rankedBefore.append([0] * self.numCandidates)
+
+  def copy(self, copyBallots=True):
+    ballotList = Ballots.copy(self, False)
+    if copyBallots:
+      ballotList.appendBallotData(self.getBallotData())
+    return ballotList
+
+  def appendBallots(self, ballots, weights=None, ids=None):
+    """Count many ballots.
+
+    The arguments are as for Ballots.appendBallots().  The ballot IDs are
+    not kept.
+    """
+
+    if weights is None:
+      weights = repeat(1)
+
+    # Identical ballots are cleaned and counted only once.  A ballot that
+    # can't be hashed has equal rankings and always needs cleaning.
+    batch = {}
+    for ballot, weight in izip(ballots, weights):
+      if weight == 0:
+        continue
+      ballotKey = tuple(ballot)
+      try:
+        item = batch.get(ballotKey)
+        equalRankings = False
+      except TypeError:
+        ballotKey = self.ballotKey(ballot)
+        item = batch.get(ballotKey)
+        equalRankings = True
+      if item is None:
+        batch[ballotKey] = [ballot, weight, equalRankings]
+      else:
+        item[1] += weight
+      self._numBallots += weight
+
+    self.startCounts()
+    c2c = range(self.numCandidates)
+    withdrawn = set(self.withdrawn)
+    ranked = self.ranked
+    rankedBefore = self.rankedBefore
+    for ballot, weight, equalRankings in batch.itervalues():
+      # Most ballots have no skipped rankings, withdrawn candidates, or
+      # duplicates and are already clean
+      if not equalRankings:
+        candidates = set(ballot)
+        clean = (len(candidates) == len(ballot) and -1 not in candidates and
+                 candidates.isdisjoint(withdrawn))
+      if equalRankings or not clean:
+        ballot = self.cleanBallot(ballot, c2c, withdrawn)
+      if len(ballot) == 0:
+        continue
+      self.numCleanBallots += weight
+      for j, c in enumerate(ballot):
+        ranked[c] += weight
+        row = rankedBefore[c]
+        for d in ballot[:j]:
+          row[d] += weight
+
+  def setPackedData(self, offsets, rankings, counts, runs, runEnds,
+                    ballotIDs=None):
+    "Count the ballots given as arrays in the format of getPackedData()."
+
+    self.deleteBallots()
+    packedList = PackedBallotList(offsets, rankings)
+    for start in xrange(0, len(counts), 10000):
+      stop = min(start + 10000, len(counts))
+      self.appendBallots([packedList[j] for j in xrange(start, stop)],
+                         counts[start:stop])
+
+  def getBallotData(self):
+    "Return the counts for appendBallotData()."
+    self.startCounts()
+    return (self._numBallots, self.numCleanBallots, self.ranked,
+            self.rankedBefore)
+
+  def appendBallotData(self, ballotData):
+    "Add counts returned by getBallotData()."
+
+    (numBallots, numCleanBallots, ranked, rankedBefore) = ballotData
+    self.startCounts()
+    self._numBallots += numBallots
+    self.numCleanBallots += numCleanBallots
+    for c in range(self.numCandidates):
+      self.ranked[c] += ranked[c]
+      row = self.rankedBefore[c]
+      for d, x in enumerate(rankedBefore[c]):
+        row[d] += x
+
+  def getCleanBallots(self):
+    "Return the counts of the clean ballots without the withdrawn candidates."
+
+    cleanBallots = Ballots.copy(self, False)
+    cleanBallots.withdrawn = []
+    cleanBallots.dirtyBallots = self
+
+    self.startCounts()
+    keep = [c for c in range(self.numCandidates) if c not in self.withdrawn]
+    cleanBallots.names = [self.names[c] for c in keep]
+    cleanBallots._numBallots = cleanBallots.numCleanBallots = \
+                               self.numCleanBallots
+    cleanBallots.ranked = [self.ranked[c] for c in keep]
+    cleanBallots.rankedBefore = [[self.rankedBefore[c][d] for d in keep]
+                                 for c in keep]
+    return cleanBallots
+
+  def getPMat(self):
+    """Return the pairwise comparison matrix.
+
+    pMat[c][d] is the number of ballots ranking candidate c over candidate
+    d.  Only use this with clean ballots (see getCleanBallots).
+    """
+
+    self.startCounts()
+    pMat = []
+    for c in range(self.numCandidates):
+      pMat.append([self.ranked[c] - x for x in self.rankedBefore[c]])
+      pMat[c][c] = 0
+    return pMat
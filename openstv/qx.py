@@ -16,94 +16,236 @@ __revision__ = "$Id: qx.py 710 2010-02-22 00:19:20Z jlundell $"
 
 from openstv.STV import RecursiveSTV
 
-#  class QX: quasi-exact fixed-point arithmetic support
+#  class QXContext: quasi-exact fixed-point arithmetic support
 #
-#  All methods of QX are static.
 #  Set precision and guard through setter methods.
-#  If guard > 0, then QX will use quasi-exact guarded-precision arithmetic
+#  If guard > 0, then QXContext will use quasi-exact guarded-precision arithmetic
 #  See the appendix of http://www.votingmatters.org.uk/ISSUE24/I24P2.pdf
 #    for a brief description of quasi-exact arithmetic
 #
 #  maxDiff & minDiff are maintained to help determine whether the guard is sufficiently large
+#    if gatherStats is set.  Otherwise the comparisons are done in a single pass.
 #
-class QX(object):
+#  Each election has its own context so that counts with different
+#  precisions can run at the same time.  class QX provides the older static
+#  interface to a single context shared by the whole process.
+#
+class QXContext(object):
   "Fixed-point arithmetic with optional guard digits"
-  precision = 6
-  guard = 0
-  p = 10**(precision+guard)
-  g = 10**guard
-  grnd = g/2
-  geps = g/10
-  One = p
-  Epsilon = 1
-  maxDiff = 0
-  minDiff = p * 100
+
+  def __init__(self, precision=6, guard=0):
+    self.precision = precision
+    self.Epsilon = 1
+    self.gatherStats = False
+    self.set_guard(None, guard)
+
+  def set_precision(self, e, v):
+    "set precision in decimal digits"
+    self.precision = v
+    self.p = 10 ** (self.precision + self.guard)
+    if e is not None:
+      e.p = self.p	# for report.py
+    self.One = self.p
+    self.maxDiff = 0
+    self.minDiff = self.p * 100
+
+  def set_guard(self, e, v):
+    "set number of decimal guard digits"
+    self.guard = v
+    self.g = 10 ** self.guard
+    self.grnd = self.g/2
+    self.geps = self.g/10
+    self.set_precision(e, self.precision)
+
+  def fix(self, a):
+    "convert int to fixed point"
+    return a * self.p
+
+  def eq(self, a, b):
+    "return True if a == b; else False"
+    if (self.guard == 0):
+      return a == b
+    if not self.gatherStats:
+      return -self.geps < a - b < self.geps
+    gdiff = abs(a - b)
+    if gdiff < self.geps and gdiff > self.maxDiff:
+      self.maxDiff = gdiff
+    if gdiff >= self.geps and gdiff < self.minDiff:
+      self.minDiff = gdiff
+    return gdiff < self.geps
+
+  #  Without statistics, a < b and not eq(a, b) is the same as b - a >= geps,
+  #  and the other comparisons are simplified in the same way.
+
+  def lt(self, a, b):
+    "return True if a < b; else False"
+    if (self.guard == 0):
+      return a < b
+    if not self.gatherStats:
+      return b - a >= self.geps
+    return (a < b) and not self.eq(a, b)
+
+  def gt(self, a, b):
+    "return True if a > b; else False"
+    if (self.guard == 0):
+      return a > b
+    if not self.gatherStats:
+      return a - b >= self.geps
+    return (a > b) and not self.eq(a, b)
+
+  def le(self, a, b):
+    "return True if a <= b; else False"
+    if (self.guard == 0):
+      return a <= b
+    if not self.gatherStats:
+      return a - b < self.geps
+    return (a <= b) or self.eq(a, b)
+
+  def ge(self, a, b):
+    "return True if a >= b; else False"
+    if (self.guard == 0):
+      return a >= b
+    if not self.gatherStats:
+      return b - a < self.geps
+    return (a >= b) or self.eq(a, b)
+
+  def above(self, values, candidates, limit):
+    "return the candidates c for which gt(values[c], limit)"
+    if (self.guard == 0):
+      return [c for c in candidates if values[c] > limit]
+    if self.gatherStats:
+      return [c for c in candidates if self.gt(values[c], limit)]
+    limit += self.geps
+    return [c for c in candidates if values[c] >= limit]
+
+  def tied(self, values, candidates, value):
+    "return the candidates c for which eq(values[c], value)"
+    if (self.guard == 0):
+      return [c for c in candidates if values[c] == value]
+    if self.gatherStats:
+      return [c for c in candidates if self.eq(values[c], value)]
+    low = value - self.geps
+    high = value + self.geps
+    return [c for c in candidates if low < values[c] < high]
+
+  def mult(self, a, b):
+    "multiply two fixed-point numbers"
+    return a * b / self.p
+
+  def div(self, a, b):
+    "divide two fixed-point numbers"
+    return (a * self.p) / b
+
+  def add(self, a, b):
+    "add two fixed-point numbers (for completeness)"
+    return a + b
+
+  def sub(self, a, b):
+    "subtract two fixed-point numbers (for completeness)"
+    return a - b
+
+  def str(self, v):
+    "stringify a fixed-point value"
+    if self.p == 0:
+      return str(v)
+    nfmt = "%d.%0" + str(self.precision) + "d" # %d.%0_d
+    gv = (v + self.grnd)/self.g	              # round off guard digits
+    return nfmt % (gv/(self.p/self.g), gv%(self.p/self.g))
+
+  def postCount(self, e, R):
+    "Report QX statistics"
+    e.msg.append("")
+    e.msg[R] = """\
+maxDiff: %d  (s/b << geps)
+geps:    %d
+minDiff: %d  (s/b >> geps)
+guard:   %d
+prec:    %d
+
+""" % (
+      self.maxDiff,
+      self.geps,
+      self.minDiff,
+      self.g,
+      self.p
+      )
+
+##################################################################
+
+class QXMeta(type):
+  "Forward the attributes of class QX to its context."
+
+  def __getattr__(cls, name):
+    return getattr(cls.context, name)
+
+  def __setattr__(cls, name, value):
+    if name == "context":
+      type.__setattr__(cls, name, value)
+    else:
+      setattr(cls.context, name, value)
+
+class QX(object):
+  """Static interface to a QXContext shared by the whole process.
+
+  Attributes such as QX.p and QX.precision are read from and written to the
+  shared context.  Elections use their own contexts, so changing this one
+  doesn't affect them.  The shared context gathers statistics as QX always
+  did.
+  """
+
+  __metaclass__ = QXMeta
+  context = QXContext()
+  context.gatherStats = True
 
   @staticmethod
   def set_precision(e, v):
     "set precision in decimal digits"
-    QX.precision = v
-    QX.p = 10 ** (QX.precision + QX.guard)
-    e.p = QX.p	# for report.py
-    QX.One = QX.p
-    QX.maxDiff = 0
-    QX.minDiff = QX.p * 100
+    QX.context.set_precision(e, v)
 
   @staticmethod
   def set_guard(e, v):
     "set number of decimal guard digits"
-    QX.guard = v
-    QX.g = 10 ** QX.guard
-    QX.grnd = QX.g/2
-    QX.geps = QX.g/10
-    QX.set_precision(e, QX.precision)
+    QX.context.set_guard(e, v)
 
   @staticmethod
   def fix(a):
     "convert int to fixed point"
-    return a * QX.p
+    return QX.context.fix(a)
 
   @staticmethod
   def eq(a, b):
     "return True if a == b; else False"
-    if (QX.guard == 0):
-      return a == b
-    gdiff = abs(a - b)
-    if gdiff < QX.geps and gdiff > QX.maxDiff:
-      QX.maxDiff = gdiff
-    if gdiff >= QX.geps and gdiff < QX.minDiff:
-      QX.minDiff = gdiff
-    return abs(a - b) < QX.geps
+    return QX.context.eq(a, b)
 
   @staticmethod
   def lt(a, b):
     "return True if a < b; else False"
-    return (a < b) and (QX.guard == 0 or not QX.eq(a, b))
+    return QX.context.lt(a, b)
 
   @staticmethod
   def gt(a, b):
     "return True if a > b; else False"
-    return (a > b) and (QX.guard == 0 or not QX.eq(a, b))
+    return QX.context.gt(a, b)
 
   @staticmethod
   def le(a, b):
     "return True if a <= b; else False"
-    return (a <= b) or (QX.guard != 0 and QX.eq(a, b))
+    return QX.context.le(a, b)
 
   @staticmethod
   def ge(a, b):
     "return True if a >= b; else False"
-    return (a >= b) or (QX.guard != 0 and QX.eq(a, b))
+    return QX.context.ge(a, b)
 
   @staticmethod
   def mult(a, b):
     "multiply two fixed-point numbers"
-    return a * b / QX.p
+    return QX.context.mult(a, b)
 
   @staticmethod
   def div(a, b):
     "divide two fixed-point numbers"
-    return (a * QX.p) / b
+    return QX.context.div(a, b)
 
   @staticmethod
   def add(a, b):
@@ -118,45 +260,30 @@ class QX(object):
   @staticmethod
   def str(v):
     "stringify a fixed-point value"
-    if QX.p == 0:
-      return str(v)
-    nfmt = "%d.%0" + str(QX.precision) + "d" # %d.%0_d
-    gv = (v + QX.grnd)/QX.g	              # round off guard digits
-    return nfmt % (gv/(QX.p/QX.g), gv%(QX.p/QX.g))
+    return QX.context.str(v)
 
   @staticmethod
   def postCount(e, R):
     "Report QX statistics"
-    e.msg.append("")
-    e.msg[R] = """\
-maxDiff: %d  (s/b << geps)
-geps:    %d
-minDiff: %d  (s/b >> geps)
-guard:   %d
-prec:    %d
-
-""" % (
-      QX.maxDiff,
-      QX.geps,
-      QX.minDiff,
-      QX.g,
-      QX.p
-      )
+    QX.context.postCount(e, R)
 
 ##################################################################
 
 class RecursiveQXSTV(RecursiveSTV):
   """Class that reimplements recursive methods using QX (quasi-exact) arithmetic.
   
-  No additional attributes.
+  Attributes:
+
+    qx -- The QXContext used for the arithmetic of this count.
   """
 
   def __init__(self, b):
     RecursiveSTV.__init__(self, b)
+    self.qx = QXContext()
     self.prec = 9
     self.strongTieBreakMethod = "random" # break all ties randomly
     self.weakTieBreakMethod = "strong"	# treat all ties as strong
-    self.surplusLimit = QX.Epsilon
+    self.surplusLimit = self.qx.Epsilon
     
     #  A note for debugging via print:
     #  comment out the sys.stderr assignment in Frame.__init__
@@ -167,27 +294,25 @@ class RecursiveQXSTV(RecursiveSTV):
   def preCount(self):
     RecursiveSTV.preCount(self)
 
-    QX.set_precision(self, self.prec)
-    QX.set_guard(self, self.prec)
+    self.qx.set_precision(self, self.prec)
+    self.qx.set_guard(self, self.prec)
 
   def displayValue(self, value):
     "RecursiveQXSTV: Format a value with specified precision."
 
-    return QX.str(value)
+    return self.qx.str(value)
 
   def updateThresh(self):
     "RecursiveQXSTV: Compute the value of the winning threshold."
 
-    threshNum = QX.fix(self.b.numBallots) - self.exhausted[self.R]
+    threshNum = self.qx.fix(self.b.numBallots) - self.exhausted[self.R]
     self.thresh[self.R] = threshNum/(self.numSeats + 1)
 
   def updateWinners(self):
     "RecursiveQXSTV: Find new winning candidates."
 
-    winners = []
-    for c in self.continuing:
-      if QX.gt(self.count[self.R][c], self.thresh[self.R]):
-        winners.append(c)
+    winners = self.qx.above(self.count[self.R], self.continuing,
+                            self.thresh[self.R])
     if len(winners) > 0:
       self.roundInfo[self.R]["winners"] = self.newWinners(winners)
 
@@ -195,7 +320,7 @@ class RecursiveQXSTV(RecursiveSTV):
     """RecursiveQXSTV: Decide whether to transfer surplus votes or eliminate 
     candidates."""
     
-    if ( QX.eq(self.surplus[self.R-1], 0) or
+    if ( self.qx.eq(self.surplus[self.R-1], 0) or
          (self.delayedTransfer == "On" and len(self.getSureLosers()) != 0) ):
       return False
     else:
@@ -221,7 +346,7 @@ class RecursiveQXSTV(RecursiveSTV):
     continuing.sort(key=lambda a, f=self.count[R]: f[a])
     clusteredContinuing = [[continuing[0]]]
     for c in continuing[1:]:
-      if QX.eq(self.count[R][c], self.count[R][ clusteredContinuing[-1][0] ]):
+      if self.qx.eq(self.count[R][c], self.count[R][ clusteredContinuing[-1][0] ]):
         clusteredContinuing[-1].append(c)
       else:
         clusteredContinuing.append([c])
@@ -234,7 +359,7 @@ class RecursiveQXSTV(RecursiveSTV):
       s += len(cluster) * currentClusterCount
       potentialLosers += cluster
       
-      if QX.lt(s, nextClusterCount) and len(potentialLosers) <= maxNumLosers:
+      if self.qx.lt(s, nextClusterCount) and len(potentialLosers) <= maxNumLosers:
         losers = potentialLosers[:]
         
     return losers
@@ -244,7 +369,6 @@ class RecursiveQXSTV(RecursiveSTV):
 
     assert(mostfewest in ["most", "fewest"])
     assert(len(cList) > 0)
-    tiedCand = []
 
     # Find a candidate who is winning/losing.  He may be tied with others.
     if mostfewest == "most":
@@ -253,12 +377,8 @@ class RecursiveQXSTV(RecursiveSTV):
       cList.sort(key=lambda a, f=function: f[a])
     top = cList[0] # first/last place candidate
 
-    # Find the number of candidates who are tied with him.
-    for c in cList:
-      if QX.eq(function[c], function[top]):
-        tiedCand.append(c)
-
-    return tiedCand
+    # Find the candidates who are tied with him.
+    return self.qx.tied(function, cList, function[top])
 
   def updateKeepFactors(self):
     "RecursiveQXSTV: Udpate the candidate keep factors."
@@ -271,13 +391,15 @@ class RecursiveQXSTV(RecursiveSTV):
 
     candidateList = list(self.continuing | self.winners)
     candidateList.sort()
+    overThresh = set(self.qx.above(self.count[self.R-1], candidateList,
+                                   self.thresh[self.R-1]))
     for c in candidateList:
-      if QX.gt(self.count[self.R-1][c], self.thresh[self.R-1]):
+      if c in overThresh:
         self.roundInfo[self.R]["action"][1].append(c)
         kf, rem = divmod(self.keepFactor[self.R-1][c] * self.thresh[self.R-1],
                       self.count[self.R-1][c])
         if rem > 0: 
-          kf += QX.Epsilon
+          kf += self.qx.Epsilon
         self.keepFactor[self.R][c] = kf
         winners.append("%s, %s"\
                        % (self.b.names[c],
@@ -294,4 +416,4 @@ class RecursiveQXSTV(RecursiveSTV):
     "RecursiveQXSTV: Report QX stats if enabled"
     RecursiveSTV.postCount(self)
     if False:
-      QX.postCount(self, self.R+1)
+      self.qx.postCount(self, self.R+1)
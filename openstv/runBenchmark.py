@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+"run performance benchmarks from the command line"
+
+__revision__ = "$Id$"
+
+import sys
+import os
+import random
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import getopt
+
+from openstv.ballots import Ballots, CompactBallots
+from openstv.plugins import getMethodPlugins
+from openstv.qx import QXContext
+
+##################################################################
+
+def writeSyntheticBallots(fName, numBallots, numCandidates, packed=False,
+                          seed=1):
+  """Write a BLT file with randomly generated ballots.
+
+  Candidates have different levels of support and voters rank a random
+  number of candidates, so popular rankings repeat as they do in real
+  elections.  Each line of the file holds one ballot unless packed is True,
+  in which case each line holds one unique ballot and its weight.
+  """
+
+  r = random.Random(seed)
+  support = [r.random() ** 2 for c in range(numCandidates)]
+  f = open(fName, "w")
+  f.write("%d %d\n" % (numCandidates, max(1, numCandidates/3)))
+  weights = {}
+  for i in xrange(numBallots):
+    ranked = range(numCandidates)
+    ranked.sort(key=lambda c: -support[c] * r.random())
+    n = min(numCandidates, int(r.expovariate(0.5)) + 1)
+    line = " ".join([str(c+1) for c in ranked[:n]])
+    if packed:
+      weights[line] = weights.get(line, 0) + 1
+    else:
+      f.write("1 %s 0\n" % line)
+  for line, weight in weights.iteritems():
+    f.write("%d %s 0\n" % (weight, line))
+  f.write("0\n")
+  for c in range(numCandidates):
+    f.write('"Candidate %d"\n' % (c+1))
+  f.write('"Synthetic election"\n')
+  f.close()
+
+def timeIt(function, *args):
+  "Return the result of calling function and the elapsed time."
+  t0 = time.time()
+  result = function(*args)
+  return result, time.time() - t0
+
+##################################################################
+
+def benchLoad(ballotsClass, fName):
+  """Time loading a ballot file.
+
+  The synthetic ballot files repeat popular rankings as real elections do,
+  so the number of distinct lines is printed to show the duplication rate.
+  """
+
+  def load():
+    b = ballotsClass()
+    b.loadKnown(fName, "blt")
+    return b
+
+  b, t = timeIt(load)
+  numLines = len(set(open(fName)))
+  size = os.path.getsize(fName) / 1e6
+  print "Loaded %d ballots (%d unique) in %.2f s: %.0f ballots/s" % \
+        (b.numBallots, b.numWeightedBallots, t, b.numBallots / t)
+  print "File has %d distinct lines and %.1f MB: %.1f MB/s" % \
+        (numLines, size, size / t)
+
+def benchAppend(ballotsClass, fName):
+  "Time appending ballots one at a time and in bulk, without parsing."
+
+  b = ballotsClass()
+  b.loadKnown(fName, "blt")
+  ballots = [b.getBallot(i) for i in xrange(b.numBallots)]
+
+  def appendOne():
+    b2 = b.copy(False)
+    for ballot in ballots:
+      b2.appendBallot(ballot)
+
+  def appendBulk():
+    b2 = b.copy(False)
+    b2.appendBallots(ballots)
+
+  dummy, t = timeIt(appendOne)
+  print "appendBallot:  %d ballots in %.2f s: %.0f ballots/s" % \
+        (len(ballots), t, len(ballots) / t)
+  dummy, t = timeIt(appendBulk)
+  print "appendBallots: %d ballots in %.2f s: %.0f ballots/s" % \
+        (len(ballots), t, len(ballots) / t)
+
+def benchCache(ballotsClass, fName):
+  "Time loading a ballot file with and without a binary cache."
+
+  cacheName = os.path.splitext(fName)[0] + ".bltc"
+  if os.path.exists(cacheName):
+    print "Cache file %s already exists" % cacheName
+    return
+
+  def load():
+    b = ballotsClass()
+    b.loadUnknown(fName)
+    return b
+
+  b, t = timeIt(load)
+  print "Parsed %d ballots in %.2f s" % (b.numBallots, t)
+  try:
+    dummy, t = timeIt(b.saveAs, cacheName)
+    print "Wrote cache in %.2f s" % t
+    b, t = timeIt(load)
+    print "Loaded %d ballots from cache in %.3f s" % (b.numBallots, t)
+  finally:
+    os.remove(cacheName)
+
+def benchClean(ballotsClass, fName):
+  "Time cleaning ballots."
+
+  b = ballotsClass()
+  b.loadKnown(fName, "blt")
+  clean, t = timeIt(b.getCleanBallots)
+  print "Cleaned %d ballots (%d unique) in %.2f s" % \
+        (b.numBallots, b.numWeightedBallots, t)
+
+def benchCount(ballotsClass, fName,
+               methodNames=["IRV", "CambridgeSTV", "ERS97STV", "MeekSTV",
+                            "WarrenSTV"]):
+  "Time counting the ballots with several methods."
+
+  methods = getMethodPlugins("byName", exclude0=False)
+  for name in methodNames:
+    b = ballotsClass(weightedOnly=methods[name].weightedBallotsOnly)
+    b.loadKnown(fName, "blt")
+    e = methods[name](b.getCleanBallots())
+    e.strongTieBreakMethod = "index"
+    dummy, t = timeIt(e.runElection)
+    print "%s: counted %d ballots in %d rounds in %.2f s" % \
+          (name, e.b.numBallots, e.numRounds, t)
+
+def benchSurplus(ballotsClass, fName, methodName="CambridgeSTV"):
+  """Time an order dependent count, where surplus ballots are transferred
+  one at a time.
+
+  The popular candidates of the synthetic ballot files have large
+  surpluses, so this shows how the surplus transfers scale with the number
+  of ballots.
+  """
+
+  methods = getMethodPlugins("byName", exclude0=False)
+  b = ballotsClass()
+  b.loadKnown(fName, "blt")
+  e = methods[methodName](b.getCleanBallots())
+  e.strongTieBreakMethod = "index"
+  dummy, t = timeIt(e.runElection)
+  print "%s: counted %d ballots in %d rounds in %.2f s" % \
+        (methodName, e.b.numBallots, e.numRounds, t)
+  print "Largest surplus: %d ballots" % max(e.surplus)
+
+def benchQX(ballotsClass, fName, numValues=100000, reps=10,
+            methodNames=["MeekQXSTV", "WarrenQXSTV", "QPQ"]):
+  """Time quasi-exact comparisons with and without statistics.
+
+  Comparisons are timed one at a time and in bulk with the same precision
+  and guard digits as the QX methods, and then the ballots are counted with
+  the QX methods.
+  """
+
+  qx = QXContext(9, 9)
+  r = random.Random(1)
+  values = [r.randrange(100 * qx.p) for i in xrange(numValues)]
+  candidates = range(numValues)
+  limit = 50 * qx.p
+
+  def compareOne():
+    for k in xrange(reps):
+      [c for c in candidates if qx.gt(values[c], limit)]
+
+  def compareBulk():
+    for k in xrange(reps):
+      qx.above(values, candidates, limit)
+
+  for gatherStats in [True, False]:
+    qx.gatherStats = gatherStats
+    label = "statistics on: " if gatherStats else "statistics off:"
+    dummy, t = timeIt(compareOne)
+    print "gt %s %.0f ns/comparison" % (label, 1e9 * t / (reps * numValues))
+    dummy, t = timeIt(compareBulk)
+    print "above %s %.0f ns/comparison" % (label, 1e9 * t / (reps * numValues))
+
+  methods = getMethodPlugins("byName", exclude0=False)
+  for name in methodNames:
+    for gatherStats in [True, False]:
+      b = ballotsClass(weightedOnly=methods[name].weightedBallotsOnly)
+      b.loadKnown(fName, "blt")
+      e = methods[name](b.getCleanBallots())
+      e.strongTieBreakMethod = "index"
+      e.qx.gatherStats = gatherStats
+      dummy, t = timeIt(e.runElection)
+      print "%s, statistics %s: counted %d ballots in %d rounds in %.2f s" % \
+            (name, ["off", "on"][gatherStats], e.b.numBallots, e.numRounds, t)
+
+def benchPMat(ballotsClass, fName, candidateCounts=[5, 10, 20, 40]):
+  """Time computing the pairwise matrix of Condorcet voting with and
+  without numpy.
+
+  The ballot file is timed first, and then synthetic ballot files with the
+  same number of ballots and different numbers of candidates.
+  """
+
+  condorcet = getMethodPlugins("byName", exclude0=False)["Condorcet"]
+  b = ballotsClass(weightedOnly=True)
+  b.loadKnown(fName, "blt")
+  tmpDir = tempfile.mkdtemp()
+  fNames = [fName]
+  try:
+    for numCandidates in candidateCounts:
+      fNames.append(os.path.join(tmpDir, "c%d.blt" % numCandidates))
+      writeSyntheticBallots(fNames[-1], b.numBallots, numCandidates)
+
+    for name in fNames:
+      b = ballotsClass(weightedOnly=True)
+      b.loadKnown(name, "blt")
+      e = condorcet(b.getCleanBallots())
+      times = []
+      for useNumpy in [False, True][:e.useNumpy + 1]:
+        e.useNumpy = useNumpy
+        dummy, t = timeIt(e.computePMat)
+        times.append("%s %.2f s" % (["python", "numpy"][useNumpy], t))
+      print "%d candidates, %d ballots (%d unique): %s" % \
+            (e.b.numCandidates, e.b.numBallots, e.b.numWeightedBallots,
+             ", ".join(times))
+  finally:
+    for name in fNames[1:]:
+      os.remove(name)
+    os.rmdir(tmpDir)
+
+def benchMultiLoad(ballotsClass, fName, numFiles=16):
+  "Time loading ballots split into several files, as for precincts."
+
+  b = ballotsClass()
+  b.loadKnown(fName, "blt")
+  tmpDir = tempfile.mkdtemp()
+  fNames = []
+  try:
+    for k in range(numFiles):
+      part = b.copy(False)
+      part.appendBallots([b.getBallot(i) for i in
+                          xrange(k * b.numBallots / numFiles,
+                                 (k+1) * b.numBallots / numFiles)])
+      fNames.append(os.path.join(tmpDir, "precinct%d.blt" % k))
+      part.saveAs(fNames[-1])
+
+    def load(numProcesses):
+      b = ballotsClass()
+      b.loadFiles(fNames, numProcesses)
+      return b
+
+    def append():
+      b = ballotsClass()
+      b.loadUnknown(fNames[0])
+      for fName in fNames[1:]:
+        b.appendFile(fName)
+      return b
+
+    b, t = timeIt(append)
+    print "appendFile: %d files with %d ballots in %.2f s" % \
+          (numFiles, b.numBallots, t)
+    b, t = timeIt(load, 1)
+    print "loadFiles, 1 process: %d files with %d ballots in %.2f s" % \
+          (numFiles, b.numBallots, t)
+    b, t = timeIt(load, None)
+    print "loadFiles, process pool: %d files with %d ballots in %.2f s" % \
+          (numFiles, b.numBallots, t)
+
+    def loadSplit():
+      b = ballotsClass()
+      b.loadFiles([fName], None)
+      return b
+
+    b, t = timeIt(loadSplit)
+    print "loadFiles, process pool: 1 file with %d ballots split in %.2f s" % \
+          (b.numBallots, t)
+  finally:
+    for name in fNames:
+      os.remove(name)
+    os.rmdir(tmpDir)
+
+def benchEdit(ballotsClass, fName, numEdits=10000, maxTime=10.0):
+  """Time random ballot edits as made in the ballot file editor.
+
+  Ballots are replaced with copies of other ballots and with new ballots,
+  deleted, and appended.  New ballots are mostly unique so the old unique
+  ballots are often left without any weight.
+  """
+
+  b = ballotsClass()
+  b.loadKnown(fName, "blt")
+  r = random.Random(1)
+  candidates = range(b.numCandidates)
+
+  def newBallot():
+    return r.sample(candidates, r.randint(1, len(candidates)))
+
+  def copyEdit():
+    ballot = b.getBallot(r.randrange(b.numBallots))
+    b.setBallot(r.randrange(b.numBallots), ballot)
+
+  def newEdit():
+    b.setBallot(r.randrange(b.numBallots), newBallot())
+
+  def deleteEdit():
+    b.deleteBallot(r.randrange(b.numBallots))
+
+  def appendEdit():
+    b.appendBallot(newBallot())
+
+  for name, edit in [("replace with copy", copyEdit),
+                     ("replace with new", newEdit),
+                     ("delete", deleteEdit),
+                     ("append", appendEdit)]:
+    t0 = time.time()
+    for n in xrange(numEdits):
+      edit()
+      if time.time() - t0 > maxTime:
+        break
+    t = time.time() - t0
+    print "%s: %d edits of %d ballots in %.2f s: %.3f ms/edit" % \
+          (name, n + 1, b.numBallots, t, 1000 * t / (n + 1))
+
+  dummy, t = timeIt(b.finishEdits)
+  print "finishEdits: %d unique ballots in %.2f s" % (b.numWeightedBallots, t)
+
+benchmarks = {
+  "append": benchAppend,
+  "cache": benchCache,
+  "clean": benchClean,
+  "count": benchCount,
+  "edit": benchEdit,
+  "load": benchLoad,
+  "multiload": benchMultiLoad,
+  "pmat": benchPMat,
+  "qx": benchQX,
+  "surplus": benchSurplus,
+  }
+benchmarkNames = benchmarks.keys()
+benchmarkNames.sort()
+
+usage = """
+Usage:
+
+  runBenchmark.py [-n ballots] [-c candidates] [-p] [-m] benchmark [ballotfile]
+
+  -n: number of ballots in the synthetic ballot file (default 1000000)
+  -c: number of candidates in the synthetic ballot file (default 10)
+  -p: write the synthetic ballot file with weighted (packed) ballots
+  -m: store ballots in compact arrays
+
+  Runs a benchmark and prints the timings to stdout.  If no ballot file
+  is given, a synthetic BLT file is generated first.  The following
+  benchmarks are available:
+%s
+""" % "\n".join(["    " + name for name in benchmarkNames])
+
+if __name__ == "__main__":
+
+  # Parse the command line.
+  try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "c:mn:p")
+  except getopt.GetoptError, err:
+    print str(err)
+    print usage
+    sys.exit(1)
+
+  numBallots = 1000000
+  numCandidates = 10
+  packed = False
+  ballotsClass = Ballots
+  for o, a in opts:
+    if o == "-n":
+      numBallots = int(a)
+    if o == "-c":
+      numCandidates = int(a)
+    if o == "-p":
+      packed = True
+    if o == "-m":
+      ballotsClass = CompactBallots
+
+  if len(args) not in [1, 2] or args[0] not in benchmarkNames:
+    print usage
+    sys.exit(1)
+
+  name = args[0]
+  if len(args) == 2:
+    fName = args[1]
+    temporary = False
+  else:
+    (fd, fName) = tempfile.mkstemp(suffix=".blt")
+    os.close(fd)
+    temporary = True
+    dummy, t = timeIt(writeSyntheticBallots, fName, numBallots, numCandidates,
+                      packed)
+    print "Generated %d ballots for %d candidates in %.2f s" % \
+          (numBallots, numCandidates, t)
+
+  try:
+    benchmarks[name](ballotsClass, fName)
+  finally:
+    if temporary:
+      os.remove(fName)
@@ -8,7 +8,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import getopt
 
-from openstv.ballots import Ballots
+from openstv.ballots import Ballots, CompactBallots, PairwiseTally
 from openstv.plugins import getMethodPlugins, getReportPlugins
 
 methods = getMethodPlugins("byName", exclude0=False)
@@ -23,119 +23,177 @@ usage = """
 Usage:
 
   runElection.py [-p prec] [-r report] [-t tiebreak] [-w weaktie] [-s seats] 
-                 [-P] [-x reps] method ballotfile
+                 [-k history] [-c checkpoint] [-m] [-j processes] [-P]
+                 [-x reps] method ballotfile [ballotfile ...]
 
   -p: override default precision (in digits)
   -r: report format: %s
   -t: strong tie-break method: random*, alpha, index
   -w: weak tie-break method: (method-default)*, strong, forward, backward 
   -s: number of seats (for text-format ballot files)
+  -k: rounds kept by iterative methods: all*, events, deltas
+  -c: save the state of an STV count to a checkpoint file between rounds,
+      and resume the count from the file if it exists
+  -m: store ballots in compact arrays to reduce memory use
+  -j: number of processes for loading several ballot files (default: one
+      for each CPU).  A single large BLT file is split among the processes
+      only when this is given.  For Condorcet each process counts the
+      pairwise comparisons of its share of the ballots.
   -P: profile and send output to profile.out
   -x: specify repeat count (for profiling)
     *default
 
   Runs an election for the given method and ballot file. Results are
-  printed to stdout. The following methods are available:
+  printed to stdout. If several ballot files are given, such as one for
+  each precinct, the ballots of all the files are counted together in the
+  order given. The following methods are available:
 %s
 """ % (", ".join(reportNames),
        "\n".join(["    " + name for name in methodNames]))
 
-# Parse the command line.
-try:
-  (opts, args) = getopt.getopt(sys.argv[1:], "Pp:r:s:t:w:x:")
-except getopt.GetoptError, err:
-  print str(err) # will print something like "option -a not recognized"
-  print usage
-  sys.exit(1)
-
-profile = False
-reps = 1
-reportformat = "TextReport"
-strongTieBreakMethod = None
-weakTieBreakMethod = None
-numSeats = None
-prec = None
-for o, a in opts:
-  if o == "-r":
-    if a in reportNames:
-      reportformat = a
-    else:
-      print "Unrecognized report format '%s'" % a
-      print usage
-      sys.exit(1)
-  if o == "-p":
-    prec = int(a)
-  if o == "-s":
-    numSeats = int(a)
-  if o == "-t":
-    if a in ["random", "alpha", "index"]:
-      strongTieBreakMethod = a
-    else:
-      print "Unrecognized tie-break method '%s'" % a
-      print usage
-      sys.exit(1)
-  if o == "-w":
-    if a in ["strong", "forward", "backward"]:
-      weakTieBreakMethod = a
-    else:
-      print "Unrecognized weak tie-break method '%s'" % a
-      print usage
-      sys.exit(1)
-  if o == "-P":
-    import cProfile
-    import pstats
-    profile = True
-    profilefile = "profile.out"
-  if o == "-x":
-    reps = int(a)
-
-if len(args) != 2:
+if __name__ == "__main__":
+
+  # Parse the command line.
+  try:
+    (opts, args) = getopt.getopt(sys.argv[1:], "c:j:k:mPp:r:s:t:w:x:")
+  except getopt.GetoptError, err:
+    print str(err) # will print something like "option -a not recognized"
+    print usage
+    sys.exit(1)
+
+  profile = False
+  reps = 1
+  reportformat = "TextReport"
+  strongTieBreakMethod = None
+  weakTieBreakMethod = None
+  numSeats = None
+  prec = None
+  ballotsClass = Ballots
+  numProcesses = None
+  historyPolicy = None
+  checkpointFile = None
+  for o, a in opts:
+    if o == "-r":
+      if a in reportNames:
+        reportformat = a
+      else:
+        print "Unrecognized report format '%s'" % a
+        print usage
+        sys.exit(1)
+    if o == "-p":
+      prec = int(a)
+    if o == "-s":
+      numSeats = int(a)
+    if o == "-t":
+      if a in ["random", "alpha", "index"]:
+        strongTieBreakMethod = a
+      else:
+        print "Unrecognized tie-break method '%s'" % a
+        print usage
+        sys.exit(1)
+    if o == "-w":
+      if a in ["strong", "forward", "backward"]:
+        weakTieBreakMethod = a
+      else:
+        print "Unrecognized weak tie-break method '%s'" % a
+        print usage
+        sys.exit(1)
+    if o == "-k":
+      if a in ["all", "events", "deltas"]:
+        historyPolicy = a
+      else:
+        print "Unrecognized history policy '%s'" % a
+        print usage
+        sys.exit(1)
+    if o == "-c":
+      checkpointFile = a
+    if o == "-P":
+      import cProfile
+      import pstats
+      profile = True
+      profilefile = "profile.out"
+    if o == "-x":
+      reps = int(a)
+    if o == "-m":
+      ballotsClass = CompactBallots
+    if o == "-j":
+      numProcesses = int(a)
+
   if len(args) < 2:
     print "Specify method and ballot file"
+    print usage
+    sys.exit(1)
+
+  name = args[0]
+  bltFns = args[1:]
+
+  if name not in methodNames:
+    print "Unrecognized method '%s'" % name
+    print usage
+    sys.exit(1)
+
+  # Condorcet voting only needs the pairwise counts, which are counted as
+  # the ballots are loaded
+  if name == "Condorcet":
+    ballotsClass = PairwiseTally
+
+  try:
+    # Methods that only use weighted ballots don't need the ballot order
+    dirtyBallots = ballotsClass(weightedOnly=methods[name].weightedBallotsOnly)
+    if len(bltFns) == 1 and numProcesses is None:
+      dirtyBallots.loadKnown(bltFns[0], exclude0=False)
+    else:
+      dirtyBallots.loadFiles(bltFns, numProcesses, exclude0=False)
+    if numSeats:
+      dirtyBallots.numSeats = numSeats
+    cleanBallots = dirtyBallots.getCleanBallots()
+  except RuntimeError, msg:
+    print msg
+    sys.exit(1)
+
+  def doElection(reps=1):
+    "run election with repeat count for profiling"
+    for i in xrange(reps):
+      if isinstance(cleanBallots, PairwiseTally):
+        e = methods[name](cleanBallots, cleanBallots.getPMat())
+      else:
+        e = methods[name](cleanBallots)
+      if strongTieBreakMethod is not None:
+        e.strongTieBreakMethod = strongTieBreakMethod
+      if weakTieBreakMethod is not None:
+        e.weakTieBreakMethod = weakTieBreakMethod
+      if prec is not None:
+        e.prec = prec
+      if historyPolicy is not None and e.iterative:
+        e.historyPolicy = historyPolicy
+      e.checkpointFile = checkpointFile
+      if checkpointFile is not None and os.path.exists(checkpointFile):
+        # The options of the interrupted count are used
+        try:
+          e.loadCheckpoint(checkpointFile)
+        except RuntimeError, msg:
+          print msg
+          sys.exit(1)
+        e.resumeElection()
+      else:
+        e.runElection()
+    return e
+
+  if profile:
+    cProfile.run('e = doElection(reps)', profilefile)
   else:
-    print "Too many arguments"
-  print usage
-  sys.exit(1)
-
-name = args[0]
-bltFn = args[1]
-
-if name not in methodNames:
-  print "Unrecognized method '%s'" % name
-  print usage
-  sys.exit(1)
-
-try:
-  dirtyBallots = Ballots()
-  dirtyBallots.loadKnown(bltFn, exclude0=False)
-  if numSeats:
-    dirtyBallots.numSeats = numSeats
-  cleanBallots = dirtyBallots.getCleanBallots()
-except RuntimeError, msg:
-  print msg
-  sys.exit(1)
-
-def doElection(reps=1):
-  "run election with repeat count for profiling"
-  for i in xrange(reps):
-    e = methods[name](cleanBallots)
-    if strongTieBreakMethod is not None:
-      e.strongTieBreakMethod = strongTieBreakMethod
-    if weakTieBreakMethod is not None:
-      e.weakTieBreakMethod = weakTieBreakMethod
-    if prec is not None:
-      e.prec = prec
-    e.runElection()
-  return e
-
-if profile:
-  cProfile.run('e = doElection(reps)', profilefile)
-else:
-  e = doElection()
-
-r = reports[reportformat](e)
-r.generateReport()
-
-if profile:
-  p = pstats.Stats(profilefile)
-  p.strip_dirs().sort_stats('time').print_stats(50)
+    e = doElection()
+
+  if e.checkpointError is not None:
+    print >> sys.stderr, e.checkpointError
+
+  # The count is finished so the checkpoint is no longer needed
+  if checkpointFile is not None and os.path.exists(checkpointFile):
+    os.remove(checkpointFile)
+
+  r = reports[reportformat](e)
+  r.generateReport()
+
+  if profile:
+    p = pstats.Stats(profilefile)
+    p.strip_dirs().sort_stats('time').print_stats(50)
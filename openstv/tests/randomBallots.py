@@ -0,0 +1,52 @@
+"Random elections for testing counts."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import random
+from openstv.ballots import Ballots
+
+def randomBallots(seed, minBallots=8, maxBallots=60, maxWeight=2):
+  """Return clean ballots for a small random election.
+
+  Candidates have different levels of support and voters rank a random
+  number of them.  With few ballots and small weights there are many ties,
+  which exercises the tie breaking of the methods.
+  """
+
+  r = random.Random(seed)
+  b = Ballots()
+  numCandidates = r.randint(4, 9)
+  b.numCandidates = numCandidates
+  b.numSeats = r.randint(1, min(4, numCandidates - 1))
+  support = [r.random() for c in range(numCandidates)]
+  for i in xrange(r.randint(minBallots, maxBallots)):
+    ranked = range(numCandidates)
+    ranked.sort(key=lambda c: -support[c] * r.random())
+    b.appendBallots([ranked[:r.randint(1, numCandidates)]],
+                    [r.randint(1, maxWeight)])
+  return b.getCleanBallots()
+
+def runCount(methodClass, b, **options):
+  """Run a count with a deterministic strong tie break and return it.
+
+  options are set as attributes of the election before counting.
+  """
+
+  e = methodClass(b)
+  e.strongTieBreakMethod = "index"
+  for name, value in options.items():
+    setattr(e, name, value)
+  e.runElection()
+  return e
@@ -0,0 +1,118 @@
+"Tests for resuming counts from checkpoints."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+from openstv.plugins import getMethodPlugins
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class Interrupted(Exception):
+  "Raised to stop a count after a checkpoint is saved."
+  pass
+
+class CheckpointTest(unittest.TestCase):
+  "A resumed count must give the same result as an uninterrupted one."
+
+  seeds = range(20)
+  # Cambridge needs at least 50 ballots for each seat
+  ballotOptions = {"MeekSTV": {},
+                   "ERS97STV": {},
+                   "NIrelandSTV": {},
+                   "CambridgeSTV": {"minBallots": 200, "maxBallots": 300}}
+
+  def setUp(self):
+    self.dirName = tempfile.mkdtemp()
+    self.fName = os.path.join(self.dirName, "count.ckp")
+
+  def tearDown(self):
+    shutil.rmtree(self.dirName)
+
+  def interruptCount(self, methodClass, b, k):
+    "Run a count until the first checkpoint after round k is saved."
+
+    class InterruptedMethod(methodClass):
+      def saveCheckpoint(self):
+        methodClass.saveCheckpoint(self)
+        if self.R >= k:
+          raise Interrupted
+
+    e = InterruptedMethod(b)
+    e.strongTieBreakMethod = "index"
+    e.checkpointFile = self.fName
+    e.checkpointInterval = 0
+    try:
+      e.runElection()
+    except Interrupted:
+      return
+    self.fail("The count finished before round %d." % k)
+
+  def getResult(self, e):
+    "Return the winners, number of rounds, and counts of a count."
+    counts = [list(e.count[r]) for r in range(e.numRounds)]
+    return (sorted(e.winners), e.numRounds, counts)
+
+  def testResume(self):
+    methods = getMethodPlugins("byName", exclude0=False)
+    numResumed = dict([(name, 0) for name in self.ballotOptions])
+    for seed in self.seeds:
+      for name, options in self.ballotOptions.items():
+        try:
+          full = self.getResult(runCount(methods[name],
+                                         randomBallots(seed, **options)))
+        except RuntimeError:
+          continue
+        for k in range(full[1] - 1):
+          where = "seed %d, %s, round %d" % (seed, name, k)
+          self.interruptCount(methods[name], randomBallots(seed, **options), k)
+
+          # The checkpoint must not hold views of the ballots
+          f = open(self.fName, "rb")
+          try:
+            state = cPickle.load(f)["state"]
+          finally:
+            f.close()
+          self.failIf("cursor" in state, where)
+
+          # Resume with a separate copy of the same ballots
+          e = methods[name](randomBallots(seed, **options))
+          e.loadCheckpoint(self.fName)
+          e.resumeElection()
+          self.assertEqual(self.getResult(e), full, where)
+          numResumed[name] += 1
+
+    for name in self.ballotOptions:
+      self.failUnless(numResumed[name] > 0, "%s was never resumed" % name)
+
+  def testWriteError(self):
+    methods = getMethodPlugins("byName", exclude0=False)
+    full = self.getResult(runCount(methods["MeekSTV"], randomBallots(0)))
+    # The file can't be opened in a missing directory, and a directory
+    # can't be replaced by the file
+    badNames = [os.path.join(self.dirName, "missing", "count.ckp"),
+                self.dirName]
+    for fName in badNames:
+      e = runCount(methods["MeekSTV"], randomBallots(0),
+                   checkpointFile=fName, checkpointInterval=0)
+      self.assertEqual(self.getResult(e), full, fName)
+      self.failIf(e.checkpointError is None, fName)
+      self.assertEqual(e.checkpointFile, None, fName)
+    self.assertEqual(os.listdir(self.dirName), [])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,66 @@
+"Tests for the ballot IDs of clean ballots."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import unittest
+from openstv.ballots import Ballots, CompactBallots
+
+class CleanBallotIDsTest(unittest.TestCase):
+  "Clean ballots must keep the IDs of the dirty ballots."
+
+  ballotClasses = [Ballots, CompactBallots]
+  ballots = [[0, 1], [], [1], [1], [], [2, 0], [0, 1]]
+
+  def getDirtyBallots(self, ballotClass, ballotIDs=None):
+    b = ballotClass(ballotIDs is not None)
+    b.numCandidates = 3
+    b.appendBallots(self.ballots, ids=ballotIDs)
+    return b
+
+  def testNoneRemoved(self):
+    for ballotClass in self.ballotClasses:
+      b = self.getDirtyBallots(ballotClass)
+      cleanBallots = b.getCleanBallots(removeEmpty=False)
+      # Clean ballot i is dirty ballot i so no IDs are stored
+      self.failIf(cleanBallots.customBallotIDs)
+      self.assertEqual(cleanBallots.getBallotsAndIDs(), b.getBallotsAndIDs())
+
+  def testRemoved(self):
+    for ballotClass in self.ballotClasses:
+      for ballotIDs in [None, ["a", "b", "c", "d", "e", "f", "g"]]:
+        b = self.getDirtyBallots(ballotClass, ballotIDs)
+        expected = [(ballot, ballotID) for (ballot, ballotID)
+                    in b.getBallotsAndIDs() if len(ballot) > 0]
+        cleanBallots = b.getCleanBallots()
+        self.failUnless(cleanBallots.customBallotIDs)
+        self.assertEqual(cleanBallots.getBallotsAndIDs(), expected)
+        self.assertEqual([cleanBallots.getBallotID(i) for i in range(5)],
+                         [ballotID for (ballot, ballotID) in expected])
+
+        # Changing the dirty ballots must not change the clean ones
+        b.deleteBallot(0)
+        b.setBallot(0, [2])
+        if ballotIDs is None:
+          b.appendBallot([1])
+        else:
+          b.appendBallot([1], "h")
+        self.assertEqual(cleanBallots.getBallotsAndIDs(), expected)
+
+        # The clean ballots can be changed too
+        cleanBallots.deleteBallot(0)
+        self.assertEqual(cleanBallots.getBallotsAndIDs(), expected[1:])
+
+if __name__ == "__main__":
+  unittest.main()
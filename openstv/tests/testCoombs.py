@@ -0,0 +1,88 @@
+"Tests for the last-place votes of Coombs."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import unittest
+from openstv.MethodPlugins.Coombs import Coombs
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class RescanCoombs(Coombs):
+  "Coombs counting the last-place votes by going over every ballot."
+
+  def preCount(self):
+    Coombs.preCount(self)
+    self.unranked = [None] * self.b.numWeightedBallots
+    for i in xrange(self.b.numWeightedBallots):
+      b = self.b.getWeightedBallot(i)[1]
+      self.unranked[i] = [c for c in self.continuing if c not in b]
+
+  def mostLast(self):
+    total = [0] * self.b.numCandidates
+    for i in xrange(self.b.numWeightedBallots):
+      nUnranked = len(self.unranked[i])
+      weight, blt = self.b.getWeightedBallot(i)
+      if nUnranked == 0:
+        ballot = blt[:]
+        ballot.reverse()
+        for c in ballot:
+          if c in self.continuing:
+            break
+        total[c] += weight
+      else:
+        share = 1.0 * weight / nUnranked
+        for c in self.unranked[i]:
+          total[c] += share
+
+    ctng = list(self.continuing)
+    ctng.sort(key=lambda a, f=total: -f[a])
+    c0 = ctng[0]
+    desc = ""
+    numTied = total.count(total[c0])
+    if numTied > 1:
+      desc += "Candidates %s were tied when choosing a candidate to "\
+              "eliminate. " % self.b.joinList(ctng[:numTied])
+      (c0, desc2) = self.breakStrongTie(ctng[:numTied])
+      desc += desc2
+
+    desc += "Last place votes: "
+    ctng.sort()
+    for c in ctng[:-1]:
+      desc += "%s, %f; "  % (self.b.names[c], total[c])
+    c = ctng[-1]
+    desc += "and %s, %f. "  % (self.b.names[c], total[c])
+
+    for i in xrange(self.b.numWeightedBallots):
+      if c0 in self.unranked[i]:
+        self.unranked[i].remove(c0)
+
+    return (c0, desc)
+
+class CoombsTest(unittest.TestCase):
+  "Keeping the last-place votes up to date must not change the count."
+
+  seeds = range(300)
+
+  def testRescan(self):
+    for seed in self.seeds:
+      b = randomBallots(seed, maxBallots=[20, 200, 500][seed % 3],
+                        maxWeight=[1, 2, 5][seed // 3 % 3])
+      e = runCount(Coombs, b)
+      expected = runCount(RescanCoombs, b)
+      self.assertEqual(e.msg, expected.msg, "seed %d" % seed)
+      self.assertEqual(e.count, expected.count, "seed %d" % seed)
+      self.assertEqual(e.winners, expected.winners, "seed %d" % seed)
+
+if __name__ == "__main__":
+  unittest.main()
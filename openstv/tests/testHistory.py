@@ -0,0 +1,60 @@
+"Tests for the history policies of iterative methods."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import unittest
+from openstv.plugins import getMethodPlugins
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class HistoryPolicyTest(unittest.TestCase):
+  "The history policy must not change the result of a count."
+
+  # In seeds 6, 516, 1271, and 1368 RT STV breaks a weak tie using the
+  # counts of a surplus round
+  seeds = range(40) + [516, 1271, 1368]
+
+  def getResult(self, methodClass, b, weakTieBreakMethod, historyPolicy):
+    "Return the winners, number of rounds, and kept counts of a count."
+
+    try:
+      e = runCount(methodClass, b, weakTieBreakMethod=weakTieBreakMethod,
+                   historyPolicy=historyPolicy)
+    except RuntimeError, (msg,):
+      return (None, msg, None)
+    counts = dict([(r, list(e.count[r])) for r in e.getRounds()])
+    return (sorted(e.winners), e.numRounds, counts)
+
+  def testPolicies(self):
+    methods = getMethodPlugins("byName", exclude0=False)
+    names = [name for name in sorted(methods) if methods[name].iterative]
+    for seed in self.seeds:
+      b = randomBallots(seed)
+      for name in names:
+        for weakTieBreakMethod in ["forward", "backward"]:
+          (winners, numRounds, counts) = \
+                    self.getResult(methods[name], b, weakTieBreakMethod, "all")
+          for historyPolicy in ["events", "deltas"]:
+            result = self.getResult(methods[name], b, weakTieBreakMethod,
+                                    historyPolicy)
+            where = "seed %d, %s, %s, %s" % (seed, name, weakTieBreakMethod,
+                                             historyPolicy)
+            self.assertEqual(result[:2], (winners, numRounds), where)
+            if counts is not None:
+              # The rounds kept must have the same counts
+              for r, count in result[2].items():
+                self.assertEqual(count, counts[r], where)
+
+if __name__ == "__main__":
+  unittest.main()
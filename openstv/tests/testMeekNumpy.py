@@ -0,0 +1,101 @@
+"Tests for the numpy counting kernel of Meek STV."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import os
+import unittest
+import openstv
+from openstv.ballots import Ballots
+from openstv.MethodPlugins.MeekSTV import MeekSTV, numpy
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class CountingMeekSTV(MeekSTV):
+  "Meek STV that counts the rounds counted with numpy."
+
+  def __init__(self, b):
+    MeekSTV.__init__(self, b)
+    self.numpyRounds = 0
+
+  def updateCountNumpy(self):
+    self.numpyRounds += 1
+    MeekSTV.updateCountNumpy(self)
+
+class MeekNumpyTest(unittest.TestCase):
+  "Counting with numpy must give the same counts as the tree traversal."
+
+  seeds = range(40)
+
+  def getResult(self, b, useNumpy, prec=6):
+    "Return the counts, exhausted votes, and winners of a count."
+
+    e = runCount(CountingMeekSTV, b, useNumpy=useNumpy, prec=prec)
+    result = ([list(e.count[r]) for r in range(e.numRounds)],
+              [e.exhausted[r] for r in range(e.numRounds)],
+              sorted(e.winners))
+    return (result, e.numpyRounds)
+
+  def checkSame(self, b, where, prec=6, numpyUsed=True):
+    "Check that a count is the same with and without numpy."
+
+    (expected, numpyRounds) = self.getResult(b, False, prec)
+    self.assertEqual(numpyRounds, 0, where)
+    (result, numpyRounds) = self.getResult(b, True, prec)
+    self.assertEqual(result, expected, where)
+    self.assertEqual(numpyRounds > 0, numpyUsed, where)
+
+  def getTestBallots(self):
+    "Return the clean ballots of the file distributed with OpenSTV."
+    fName = os.path.join(os.path.dirname(openstv.__file__), "test_ballots.blt")
+    b = Ballots()
+    b.loadUnknown(fName)
+    return b.getCleanBallots()
+
+  def getOneFirstChoice(self, numBallots):
+    """Return ballots that all rank the same candidate first.
+
+    In the first round the node of that candidate multiplies p*p by
+    numBallots, which is the largest product of the count.
+    """
+
+    b = Ballots()
+    b.numCandidates = 3
+    b.numSeats = 2
+    b.appendBallots([[0, 1], [0, 2]], [numBallots - numBallots // 3,
+                                       numBallots // 3])
+    return b.getCleanBallots()
+
+  def testRandomBallots(self):
+    if numpy is None:
+      return
+    for seed in self.seeds:
+      self.checkSame(randomBallots(seed), "seed %d" % seed)
+
+  def testTestBallots(self):
+    if numpy is None:
+      return
+    for prec in [4, 6, 8]:
+      self.checkSame(self.getTestBallots(), "prec %d" % prec, prec)
+
+  def testOverflowLimit(self):
+    # At prec 9, p*p*9 fits in 64 bits and p*p*10 doesn't
+    p = 10**9
+    self.failUnless(p * p * 9 < 2**63 <= p * p * 10)
+    if numpy is not None:
+      self.checkSame(self.getOneFirstChoice(9), "9 ballots", 9)
+    self.checkSame(self.getOneFirstChoice(10), "10 ballots", 9,
+                   numpyUsed=False)
+
+if __name__ == "__main__":
+  unittest.main()
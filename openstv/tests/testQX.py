@@ -0,0 +1,102 @@
+"Tests for running quasi-exact counts at the same time."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import sys
+import threading
+import unittest
+from openstv.plugins import getMethodPlugins
+from openstv.qx import QX
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class ThreadedQXTest(unittest.TestCase):
+  "Each QX count must give the same result when other QX counts are running."
+
+  methodNames = ["MeekQXSTV", "WarrenQXSTV", "QPQ"]
+  # The guard digits are set to the precision, so this varies both
+  precs = [4, 6, 9, 12]
+  seeds = range(3)
+  numThreads = 6
+
+  def getResult(self, methodClass, b, prec):
+    "Return the winners, number of rounds, and counts of a count."
+
+    try:
+      e = runCount(methodClass, b, prec=prec)
+    except Exception, msg:
+      return (None, repr(msg), None)
+    counts = [list(e.count[r]) for r in range(e.numRounds)]
+    return (sorted(e.winners), e.numRounds, counts)
+
+  def testThreads(self):
+    methods = getMethodPlugins("byName", exclude0=False)
+    jobs = []
+    for seed in self.seeds:
+      b = randomBallots(seed, minBallots=100, maxBallots=200, maxWeight=3)
+      for name in self.methodNames:
+        for prec in self.precs:
+          jobs.append((seed, name, prec, methods[name], b))
+
+    expected = {}
+    for (seed, name, prec, methodClass, b) in jobs:
+      expected[seed, name, prec] = self.getResult(methodClass, b, prec)
+
+    results = {}
+    def runJobs(jobs):
+      for (seed, name, prec, methodClass, b) in jobs:
+        results.setdefault((seed, name, prec), []).append(
+          self.getResult(methodClass, b, prec))
+
+    # Also keep changing the context shared through the static QX interface,
+    # which the counts must not use.
+    done = threading.Event()
+    def changeSharedContext():
+      prec = 1
+      while not done.isSet():
+        QX.set_precision(None, prec)
+        QX.set_guard(None, 13 - prec)
+        prec = prec % 12 + 1
+
+    # Each thread runs all of the jobs starting at a different one
+    threads = [threading.Thread(target=changeSharedContext)]
+    for i in range(self.numThreads):
+      k = i * len(jobs) // self.numThreads
+      order = jobs[k:] + jobs[:k]
+      if i % 2:
+        order.reverse()
+      threads.append(threading.Thread(target=runJobs, args=(order,)))
+
+    # Switch threads often so that the counts are interleaved
+    checkInterval = sys.getcheckinterval()
+    sys.setcheckinterval(10)
+    try:
+      for thread in threads[1:]:
+        thread.start()
+      threads[0].start()
+      for thread in threads[1:]:
+        thread.join()
+    finally:
+      done.set()
+      threads[0].join()
+      sys.setcheckinterval(checkInterval)
+
+    for key in expected:
+      where = "seed %d, %s, prec %d" % key
+      self.assertEqual(len(results[key]), self.numThreads, where)
+      for result in results[key]:
+        self.assertEqual(result, expected[key], where)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,63 @@
+"Tests for the reports of counts that keep only some rounds."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import StringIO
+import unittest
+from openstv.plugins import getMethodPlugins
+from openstv.ReportPlugins.YamlReport import YamlReport
+from openstv.tests.randomBallots import randomBallots, runCount
+
+class YamlReportTest(unittest.TestCase):
+  "A YAML report of the rounds kept must agree with the report of all rounds."
+
+  seeds = range(20)
+
+  def getStages(self, e):
+    "Return the lines of each stage of the YAML report of a count."
+
+    f = StringIO.StringIO()
+    YamlReport(e, outputFile=f).generateReport()
+    stages = f.getvalue().split(" -\n")[1:]
+    return [stage.splitlines() for stage in stages]
+
+  def testEvents(self):
+    methods = getMethodPlugins("byName", exclude0=False)
+    names = [name for name in sorted(methods) if methods[name].iterative]
+    for seed in self.seeds:
+      b = randomBallots(seed)
+      for name in names:
+        where = "seed %d, %s" % (seed, name)
+        try:
+          full = self.getStages(runCount(methods[name], b,
+                                         historyPolicy="all"))
+        except RuntimeError:
+          continue
+        e = runCount(methods[name], b, historyPolicy="events")
+        rounds = e.getRounds()
+        stages = self.getStages(e)
+        self.assertEqual(len(stages), len(rounds), where)
+        for i, r in enumerate(rounds):
+          # Stage, Tally, and Won are those of the same round and Lost and
+          # Xfer those of the round before the next one kept
+          if i+1 < len(rounds):
+            rNext = rounds[i+1] - 1
+          else:
+            rNext = len(full) - 1
+          self.assertEqual(stages[i][:3], full[r][:3], where)
+          self.assertEqual(stages[i][3:], full[rNext][3:], where)
+
+if __name__ == "__main__":
+  unittest.main()